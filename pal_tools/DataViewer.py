@@ -28,6 +28,7 @@ from utils import path, derivative, loadPV
 from thread import QThreadFuture, manager
 
 from scan_utils import UpdatePlotThread
+from fly_hdf5 import FLY_HDF5_SPEC, FlyHDF5Handler
 from scan_utils import CheckDcmThread
 
 logger = logging.getLogger('__name__')
@@ -217,6 +218,7 @@ class DataViewer(qt.QMainWindow):
 
         # DataBroker
         self.dbv1 = Broker.from_config(config)
+        self.dbv1.reg.register_handler(FLY_HDF5_SPEC, FlyHDF5Handler, overwrite=True)
         self.db = self.dbv1.v2
 
         # Main QWidget
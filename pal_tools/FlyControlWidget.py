@@ -115,6 +115,10 @@ class FlyControlWidget(qt.QMainWindow):
         self.flyCoolTime.setSingleStep(1)
         self.flyCoolTime.setProperty("value", 30)
 
+        # Alternate repetitions sweep down from the previous stop energy
+        self.flyBidirectional = qt.QCheckBox("Bidirectional", self)
+        self.flyBidirectional.setChecked(False)
+
     def layout_widgets(self):
         flyInfoWg = qt.QWidget(self)
         flyInfoWg.setLayout(qt.QVBoxLayout())
@@ -144,6 +148,7 @@ class FlyControlWidget(qt.QMainWindow):
                 addLabelWidgetVert("Resolution[eV]", self.flyResolutionE, align='center'),
                 addLabelWidgetVert("Scan Time[s]", self.flyScanTime, align='center')], align='uniform'))
         scanSetupGB.layout().addWidget(addLabelWidget("Cooling Time[s]", self.flyCoolTime, align='right'))
+        scanSetupGB.layout().addWidget(addWidgets([self.flyBidirectional], align='right'))
 
         self.main_panel.layout().addWidget(scanSetupGB)
 
@@ -0,0 +1,215 @@
+__author__ = "Sang-Woo Kim, Pohang Accelerator Laboratory"
+__contact__ = "physwkim@postech.ac.kr"
+__license__ = "MIT"
+__copyright__ = "Pohang Accelerator Laboratory, Pohang, South Korea"
+
+
+import numpy as np
+
+from silx.gui import qt
+
+from Plot1DCustom import Plot1DCustom
+from energy_grid import K_FACTOR
+from scan_utils import ColorDict, formatDuration
+
+_hc = 12398.5
+_si_111 = 5.4309/np.sqrt(3)
+
+# Debounce of the region edits [msec]
+UPDATE_DELAY = 200
+
+
+class GridPreviewWidget(qt.QMainWindow):
+    """
+    Preview of the step-scan energy grid
+
+    The grid is rebuilt shortly after the regions, E0 or the delay time are
+    edited. Invalid settings are shown below the plot.
+
+    :param control : ScanControlWidget, control.parent is the Main window
+    """
+    sigEncResolution = qt.Signal(object)
+
+    views = ['Step [eV] vs Energy',
+             'Step [k] vs k',
+             'Theta [deg.] vs Energy',
+             'Encoder steps vs Energy']
+
+    def __init__(self, control, parent=None):
+        super(GridPreviewWidget, self).__init__(parent)
+        self._control = control
+        self._enc_resolution = None
+        self.create_widgets()
+        self.layout_widgets()
+        self.make_connections()
+
+    def create_widgets(self):
+        self.main_panel = qt.QWidget(self)
+        self.main_panel.setLayout(qt.QVBoxLayout())
+        self.setCentralWidget(self.main_panel)
+
+        self.plot = Plot1DCustom(self, 'mpl')
+        self.plot.setMinimumSize(qt.QSize(400, 250))
+
+        self.view_combo = qt.QComboBox(self)
+        self.view_combo.addItems(self.views)
+
+        self.summary_label = qt.QLabel(self)
+        self.summary_label.setAlignment(qt.Qt.AlignLeft | qt.Qt.AlignTop)
+        self.summary_label.setText("-")
+
+        self.message_label = qt.QLabel(self)
+        self.message_label.setWordWrap(True)
+        self.message_label.hide()
+
+        self.update_timer = qt.QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(UPDATE_DELAY)
+
+    def layout_widgets(self):
+        self.main_panel.layout().addWidget(self.view_combo)
+        self.main_panel.layout().addWidget(self.plot)
+        self.main_panel.layout().addWidget(self.message_label)
+        self.main_panel.layout().addWidget(self.summary_label)
+
+    def make_connections(self):
+        control = self._control
+
+        for idx in range(1, 7):
+            getattr(control, 'SRB_{}'.format(idx)).valueChanged.connect(self.scheduleUpdate)
+            getattr(control, 'eMode_bar_{}'.format(idx)).valueChanged.connect(self.scheduleUpdate)
+
+        for idx in range(1, 6):
+            getattr(control, 'stepSize_{}'.format(idx)).valueChanged.connect(self.scheduleUpdate)
+            getattr(control, 'SRBOnOff_{}'.format(idx)).toggled.connect(self.scheduleUpdate)
+            getattr(control, 'SRB_time_{}'.format(idx)).valueChanged.connect(self.scheduleUpdate)
+
+        control.edit_E0.valueChanged.connect(self.scheduleUpdate)
+        control.edit_delay_time.valueChanged.connect(self.scheduleUpdate)
+
+        self.view_combo.currentIndexChanged.connect(self.updatePreview)
+        self.update_timer.timeout.connect(self.updatePreview)
+
+        # Encoder resolution is followed by a CA monitor, not read on each update
+        self.sigEncResolution.connect(self._setEncResolution)
+        dcm = control.parent.ophydDict.get('dcm')
+        if dcm is not None:
+            dcm.encResolution.subscribe(self._encResolutionChanged, run=True)
+
+    def scheduleUpdate(self, *args):
+        """Update after the edits settle"""
+        self.update_timer.start()
+
+    def showMessage(self, text, color='red'):
+        if text:
+            self.message_label.setStyleSheet("color : {}".format(color))
+            self.message_label.setText(text)
+            self.message_label.show()
+        else:
+            self.message_label.hide()
+
+    def _encResolutionChanged(self, value=None, **kwargs):
+        # Called on the CA monitor thread
+        self.sigEncResolution.emit(value)
+
+    def _setEncResolution(self, value):
+        try:
+            self._enc_resolution = abs(float(value)) or None
+        except (TypeError, ValueError):
+            self._enc_resolution = None
+        self.scheduleUpdate()
+
+    def encResolution(self):
+        """Encoder resolution of the mono [deg.], None if not connected"""
+        return self._enc_resolution
+
+    def updatePreview(self, *args):
+        main = self._control.parent
+
+        try:
+            eList = main.makeEnergyScanList()
+        except Exception as e:
+            self.plot.clearCurves()
+            self.summary_label.setText("-")
+            self.showMessage(str(e) or "Please check scan range settings.")
+            return
+
+        grid = eList.grid
+        region = grid['region']
+        relative = grid['energy']
+        E0 = float(self._control.edit_E0.value())
+        energy = relative + E0
+
+        warnings = []
+
+        with np.errstate(invalid='ignore'):
+            theta = np.rad2deg(np.arcsin(_hc/(2.*_si_111*energy)))
+
+        if np.isnan(theta).any():
+            self.plot.clearCurves()
+            self.summary_label.setText("-")
+            self.showMessage("Energies below {:.1f} eV are out of the Si(111) "
+                             "range".format(_hc/(2.*_si_111)))
+            return
+
+        steps = np.diff(relative)
+        if (steps <= 0).any():
+            idx = int(region[1:][steps <= 0][0])
+            warnings.append("Region {} repeats or goes back in energy".format(idx+1))
+
+        enc_resolution = self.encResolution()
+        if enc_resolution:
+            enc_steps = np.abs(np.diff(theta)) / enc_resolution
+            num_merged = int(np.count_nonzero(np.round(enc_steps) < 1))
+            if num_merged:
+                warnings.append("{} points are closer than an encoder step and "
+                                "will be merged".format(num_merged))
+        else:
+            enc_steps = np.full(len(steps), np.nan)
+
+        self.showMessage('\n'.join(warnings), color='orange')
+
+        # Time per region
+        delay_time = float(self._control.edit_delay_time.value()) / 1000
+        times = main.overhead_model.pointTimes(np.array(eList.energy_list, dtype=object) + E0,
+                                               eList.time_list, delay_time)
+        region_times = np.bincount(region, weights=times)
+        region_points = np.bincount(region)
+
+        text = ''
+        for idx, item in enumerate(eList.energy_list):
+            text += "Region {} : {} points, {:.2f} ~ {:.2f} eV, {}\n".format(
+                        idx+1, region_points[idx], item[0], item[-1],
+                        formatDuration(region_times[idx]))
+        text += "Total : {} points, {}".format(len(grid), formatDuration(np.sum(times)))
+        self.summary_label.setText(text)
+
+        # Point density as the step into each point
+        view = self.view_combo.currentIndex()
+        if view == 0:
+            x, y, xlabel = energy[1:], steps, 'Energy [eV]'
+        elif view == 1:
+            k = K_FACTOR * np.sqrt(np.clip(relative, 0, None))
+            x, y, xlabel = k[1:], np.diff(k), 'k [1/A]'
+        elif view == 2:
+            x, y, xlabel = energy[1:], theta[1:], 'Energy [eV]'
+        else:
+            x, y, xlabel = energy[1:], enc_steps, 'Energy [eV]'
+
+        self.plot.clearCurves()
+        for idx in range(len(eList.energy_list)):
+            mask = region[1:] == idx
+            if view == 1:
+                mask &= relative[1:] > 0
+
+            if np.count_nonzero(mask):
+                self.plot.addCurve(x[mask], y[mask],
+                                   legend='Region {}'.format(idx+1),
+                                   color=ColorDict[idx % len(ColorDict)],
+                                   symbol='o',
+                                   linestyle=' ',
+                                   resetzoom=False)
+
+        self.plot.setGraphXLabel(xlabel)
+        self.plot.setGraphYLabel(self.views[view].split(' vs ')[0])
+        self.plot.resetZoom()
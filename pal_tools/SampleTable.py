@@ -12,7 +12,12 @@ from utils import addWidgets, loadExcel, saveExcel, toArray
 class SampleTable(qt.QWidget):
     """
     Customized ArrayTableWidget from silx.gui.data.ArrayTableWidget
+
+    Columns are the sample name, position, repeats and optionally
+    'Element', 'Edge' and 'Regions', text columns of a multi-edge batch.
     """
+    text_columns = ('element', 'edge', 'regions')
+
     def __init__(self, *args, **kwargs):
         super(SampleTable, self).__init__(*args, **kwargs)
 
@@ -21,6 +26,7 @@ class SampleTable(qt.QWidget):
 
         self.lbl = np.array([])
         self.data = np.array([])
+        self.text = {}
         self.df = None
         self.column_labels = None
         self.filename = None
@@ -53,7 +59,13 @@ class SampleTable(qt.QWidget):
         self.saveBtn.clicked.connect(self.save)
         self.saveBtn.setToolTip("Save to the excel file")
 
-        buttons = addWidgets([self.addBtn,
+        self.optimizeOrder = qt.QCheckBox(self)
+        self.optimizeOrder.setText("Optimize Order")
+        self.optimizeOrder.setToolTip("Reorder samples to reduce sample changer travel "
+                                      "and edge changes")
+
+        buttons = addWidgets([self.optimizeOrder,
+                              self.addBtn,
                               self.minusBtn,
                               self.loadBtn,
                               self.saveBtn], align='right')
@@ -72,10 +84,10 @@ class SampleTable(qt.QWidget):
         item.setTextAlignment(qt.Qt.AlignCenter | qt.Qt.AlignVCenter)
         self.table.setItem(currentRow+1, 0, item)
 
-        for n, data in enumerate([1, 1]):
-            item = qt.QTableWidgetItem(str(data))
+        for n in range(1, self.table.columnCount()):
+            item = qt.QTableWidgetItem('' if self.isTextColumn(n) else '1')
             item.setTextAlignment(qt.Qt.AlignCenter | qt.Qt.AlignVCenter)
-            self.table.setItem(currentRow+1, n+1, item)
+            self.table.setItem(currentRow+1, n, item)
 
         self.table.itemChanged.connect(self.check_validity)
 
@@ -107,10 +119,18 @@ class SampleTable(qt.QWidget):
 
         self.load()
 
+    def isTextColumn(self, column):
+        """Return True if column is an Element, Edge or Regions column"""
+        if self.column_labels is None or column >= len(self.column_labels):
+            return False
+        return str(self.column_labels[column]).strip().lower() in self.text_columns
+
     def check_validity(self, item):
         text = item.text()
         if item.column() == 0:
             match = re.findall('[a-zA-Z0-9_]+', text)
+        elif self.isTextColumn(item.column()):
+            match = re.findall('[a-zA-Z0-9_.\\-]+', text)
         elif item.column() == 1:
             match = re.findall('[0-9]+', text)
             if len(match):
@@ -144,6 +164,9 @@ class SampleTable(qt.QWidget):
             self.table.setItem(row, 0, item)
 
             for n, data in enumerate(self.data[row]):
+                # Empty cells of text columns are read as nan
+                if self.isTextColumn(n+1) and (pd.isnull(data) or str(data) == 'nan'):
+                    data = ''
                 item = qt.QTableWidgetItem(str(data))
                 item.setTextAlignment(qt.Qt.AlignCenter | qt.Qt.AlignVCenter)
                 self.table.setItem(row, n+1, item)
@@ -157,31 +180,67 @@ class SampleTable(qt.QWidget):
 
         self.lbl = []
         self.data = []
+        self.text = {self.column_labels[col] : [] for col in range(1, cols)
+                     if self.isTextColumn(col)}
         for row in range(rows):
             temp = []
             for col in range(cols):
+                item = self.table.item(row, col)
                 if col == 0:
-                    self.lbl.append(self.table.item(row, col).text())
+                    self.lbl.append(item.text())
+
+                elif self.isTextColumn(col):
+                    self.text[self.column_labels[col]].append(item.text() if item else '')
 
                 else:
-                    temp.append(float(self.table.item(row, col).text()))
+                    temp.append(float(item.text()))
             self.data.append(temp)
 
-        # To numpy array
+        # To numpy array, numeric columns only
         self.data = np.array(self.data)
 
         # To DataFrame
         df = pd.DataFrame()
+        index = 0
         for n, label in enumerate(self.column_labels):
             if n == 0:
                 df[label] = self.lbl
+            elif label in self.text:
+                df[label] = self.text[label]
             else:
-                df[label] = self.data[:, n-1]
+                df[label] = self.data[:, index]
+                index += 1
 
         self.df = df
 
         return self.lbl, self.data
 
+    def getQueue(self):
+        """
+        Return the batch queue, list of dict of non-empty rows
+
+        Keys are 'row', 'name', 'position', 'num_scan', 'element', 'edge'
+        and 'regions', empty text if the column does not exist.
+        """
+        sample_names, sample_info = self.getData()
+        text = {str(label).strip().lower() : values for label, values in self.text.items()}
+
+        queue = []
+        for row, (name, info) in enumerate(zip(sample_names, sample_info)):
+            if not len(name):
+                continue
+
+            item = {'row' : row,
+                    'name' : name,
+                    'position' : float(info[0]),
+                    'num_scan' : int(info[1])}
+            for key in self.text_columns:
+                item[key] = text[key][row].strip() if key in text else ''
+
+            queue.append(item)
+
+        return queue
+
 
 if __name__ == '__main__':
     app = qt.QApplication([])
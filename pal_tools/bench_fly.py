@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""Fly-scan benchmark against the simulated DCM/HC10E IOC
+
+Runs fly_scan_with_cleanup of the startup profile end to end and reports
+kickoff latency, collect time, insert time, number of events and points
+per second.
+
+Example)
+    python sim_fly_ioc.py --interfaces 127.0.0.1 &
+    python bench_fly.py --scan-time 30 --repeat 3
+"""
+
+import os
+import sys
+import time as ttime
+import logging
+import argparse
+import tempfile
+from collections import defaultdict
+
+os.environ.setdefault('EPICS_CA_ADDR_LIST', '127.0.0.1')
+os.environ.setdefault('EPICS_CA_AUTO_ADDR_LIST', 'NO')
+os.environ.setdefault('EPICS_CA_MAX_ARRAY_BYTES', '100000000')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+from silx.gui import qt
+from bluesky import RunEngine
+from databroker import Broker
+
+from utils import path, loadPV
+from fly_hdf5 import FLY_HDF5_SPEC, FlyHDF5Handler, load_fly_table
+
+_hc = 12398.5
+_si_111 = 5.4309/np.sqrt(3)
+
+# Startup files needed by fly_scan_with_cleanup
+STARTUP_FILES = ['10-detectors.py', '22-devices.py', '25-pseudomotors.py', '95-plans.py']
+
+
+class _Widget:
+    """Headless stand-in for the Qt controls touched by the fly-scan plans"""
+    def __init__(self, value=0):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = value
+
+    def currentIndex(self):
+        return self._value
+
+    def setDisabled(self, disabled):
+        pass
+
+
+class HeadlessParent:
+    """Minimal Main window interface used by fly_scan and finalize"""
+    def __init__(self, orig_mono_speed, number_of_scan=1):
+        self._orig_mono_speed = orig_mono_speed
+        self.blinkStatus = False
+
+        control = type('Control', (), {})()
+        control.run_type = _Widget(2)
+        control.number_of_scan_edit = _Widget(number_of_scan)
+        control.abortButton = _Widget()
+        control.ecal_abortButton = _Widget()
+        control.run_start = _Widget()
+        control.run_calibrate_button = _Widget()
+        control.flyControl = type('FlyControl', (), {})()
+        control.flyControl.flyCoolTime = _Widget(0)
+        self.control = control
+
+    def subscribe_callback(self):
+        pass
+
+    def unsubscribe_callback(self):
+        pass
+
+    def control_enable(self, enable):
+        pass
+
+    def toLog(self, text, color=None):
+        print(text)
+
+
+class Timer:
+    """Accumulate wall time of wrapped calls and generators"""
+    def __init__(self):
+        self.total = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            t0 = ttime.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.total[name] += ttime.perf_counter() - t0
+                self.calls[name] += 1
+        return wrapper
+
+    def wrap_generator(self, name, func):
+        def wrapper(*args, **kwargs):
+            t0 = ttime.perf_counter()
+            items = list(func(*args, **kwargs))
+            self.total[name] += ttime.perf_counter() - t0
+            self.calls[name] += 1
+            yield from items
+        return wrapper
+
+
+def check_energy_range(table, startTh, enc_sign, enc_resolution, startE, stopE):
+    """
+    Check that the measured energies span startE..stopE within one point step
+
+    The encoder is converted to energy as the DataViewer does.
+    """
+    theta = enc_sign * np.asarray(table['ENC'], dtype=float) * enc_resolution + startTh
+    energy = np.sort(_hc/(2.*_si_111*np.sin(np.deg2rad(theta))))
+    assert len(energy) > 1, "Fly scan has no points"
+
+    first_step = energy[1] - energy[0]
+    last_step = energy[-1] - energy[-2]
+    assert abs(energy[0] - startE) <= first_step, \
+        "First energy {:.2f} eV, expected {:.2f} eV".format(energy[0], startE)
+    assert abs(energy[-1] - stopE) <= last_step, \
+        "Last energy {:.2f} eV, expected {:.2f} eV".format(energy[-1], stopE)
+
+
+def load_profile(startup_dir):
+    """Execute startup files in one namespace as IPython does"""
+    ns = {'__name__': 'bench_profile', 'logging': logging, 'sys': sys}
+    for filename in STARTUP_FILES:
+        filepath = os.path.join(startup_dir, filename)
+        with open(filepath) as f:
+            exec(compile(f.read(), filepath, 'exec'), ns)
+    return ns
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--startup', default=path('../profile_collection/startup'),
+                        help='startup profile directory')
+    parser.add_argument('--E0', type=float, default=8333.)
+    parser.add_argument('--start', type=float, default=-200., help='relative start energy [eV]')
+    parser.add_argument('--stop', type=float, default=600., help='relative stop energy [eV]')
+    parser.add_argument('--resolution', type=float, default=0.4, help='energy per point [eV]')
+    parser.add_argument('--scan-time', type=float, default=30., help='scan time [sec]')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--inline', action='store_true', help='save waveforms inline, not in HDF5')
+    parser.add_argument('--db', default='temp', help="databroker name, 'temp' for a temporary one")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    app = qt.QApplication.instance() or qt.QApplication([])
+
+    ns = load_profile(args.startup)
+    flyer = ns['energyFlyer']
+    dcm = ns['dcm']
+
+    db = Broker.named(args.db)
+    db.reg.register_handler(FLY_HDF5_SPEC, FlyHDF5Handler, overwrite=True)
+
+    timer = Timer()
+
+    RE = RunEngine({})
+    RE.subscribe(timer.wrap('insert', db.insert))
+
+    if args.inline:
+        flyer.setAssetRoot(None)
+    else:
+        flyer.setAssetRoot(tempfile.mkdtemp(prefix='bench_fly_'))
+
+    # RunEngine._collect of bluesky 1.6 calls collect()
+    flyer.collect = timer.wrap_generator('collect', flyer.collect)
+    flyer.collect_asset_docs = timer.wrap_generator('collect', flyer.collect_asset_docs)
+
+    device_dict = {'energyFlyer' : flyer,
+                   'dcm' : dcm,
+                   'ENC_fly_counter' : ns['ENC_fly_counter'],
+                   'I0_fly_counter' : ns['I0_fly_counter'],
+                   'It_fly_counter' : ns['It_fly_counter'],
+                   'If_fly_counter' : ns['If_fly_counter'],
+                   'Ir_fly_counter' : ns['Ir_fly_counter']}
+
+    flyer.wait_for_connection(timeout=10)
+    dcm.wait_for_connection(timeout=10)
+
+    # Direction between mono_theta and encoder(HC10E)
+    enc_sign = float(loadPV()['Scaler']['HC10E_ENC_Direction'])
+
+    orig_mono_speed = flyer.fly_motor_speed.get()
+    enc_resolution = flyer.fly_motor_eres.get()
+
+    startE = args.E0 + args.start
+    stopE = args.E0 + args.stop
+
+    results = []
+    for idx in range(args.repeat):
+        RE(ns['mv_and_wait'](dcm, energy=startE, delay=0))
+
+        startTh = dcm.theta.user_readback.get()
+        stopTh = np.rad2deg(np.arcsin(_hc/(2.*_si_111*stopE)))
+        th_step = abs(startTh - np.rad2deg(np.arcsin(_hc/(2.*_si_111*(startE + args.resolution)))))
+
+        encoder_steps = max(int(round(th_step / enc_resolution)), 1)
+        speed = abs(startTh - stopTh) / args.scan_time
+        num_of_counts = int(abs(startTh - stopTh) / enc_resolution / encoder_steps)
+
+        flyer.setStartEnergy(startE)
+        flyer.setTargetEnergy(stopE)
+        flyer.setSpeed(speed)
+        flyer.setEncSteps(encoder_steps)
+        flyer.setNumOfCounts(num_of_counts)
+
+        timer.total.clear()
+
+        parent = HeadlessParent(orig_mono_speed)
+        t0 = ttime.perf_counter()
+        uids = RE(ns['fly_scan_with_cleanup'](args.E0, speed, device_dict, parent),
+                  scan_type='measure', scan_mode='fly', startE=startE, startTh=startTh,
+                  stopE=stopE, stopTh=stopTh, enc_resolution=enc_resolution,
+                  scan_encoder_steps=encoder_steps, motor_speed=speed, E0=args.E0)
+        total = ttime.perf_counter() - t0
+
+        app.processEvents()
+
+        header = db[uids[0]]
+        run_time = header.stop['time'] - header.start['time']
+        table = load_fly_table(header)
+        num_points = len(table)
+        num_events = len(header.table('primary', fill=False))
+
+        check_energy_range(table, startTh, enc_sign, enc_resolution, startE, stopE)
+        latency = list(header.start.get('kickoff_latency', {}).values())
+
+        results.append(dict(kickoff=latency[0] if latency else float('nan'),
+                            collect=timer.total['collect'],
+                            insert=timer.total['insert'],
+                            events=num_events,
+                            points=num_points,
+                            run_time=run_time,
+                            total=total))
+
+    print('{:>4} {:>10} {:>10} {:>10} {:>8} {:>8} {:>10} {:>10}'.format(
+          '#', 'kickoff[s]', 'collect[s]', 'insert[s]', 'events', 'points', 'run[s]', 'points/s'))
+    for idx, item in enumerate(results):
+        print('{:>4} {:>10.3f} {:>10.3f} {:>10.3f} {:>8d} {:>8d} {:>10.2f} {:>10.1f}'.format(
+              idx + 1, item['kickoff'], item['collect'], item['insert'], item['events'],
+              item['points'], item['run_time'], item['points'] / item['run_time']))
+
+
+if __name__ == '__main__':
+    main()
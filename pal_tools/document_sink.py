@@ -0,0 +1,152 @@
+import queue
+import logging
+import threading
+import time as ttime
+
+from event_model import pack_event_page
+
+logger = logging.getLogger(__name__)
+
+
+class BulkInsertSink:
+    """
+    Insert documents on a worker thread in the order they are emitted
+
+    Consecutive events of a descriptor are inserted as one event page. The
+    RunEngine callback only queues the documents, except for the stop
+    document which waits until the run is stored, so callbacks subscribed
+    after the sink read a complete run.
+
+    Parameters
+    ----------
+    insert : callable, insert(name, doc), e.g. Broker.insert
+    batch_size : maximum number of events in a page
+    flush_timeout : maximum wait for the run to be stored on stop [sec]
+    report : callable, report(text), called with the statistics of each run
+    """
+    def __init__(self, insert, batch_size=500, flush_timeout=60, report=None):
+        self.insert = insert
+        self.batch_size = batch_size
+        self.flush_timeout = flush_timeout
+        self.report = report
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.resetStats()
+
+        self._thread = threading.Thread(target=self._run, name='bulk-insert', daemon=True)
+        self._thread.start()
+
+    def __call__(self, name, doc):
+        self._queue.put((name, doc))
+
+        with self._lock:
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+
+        if name == 'stop':
+            flushed = self.flush(self.flush_timeout)
+            self._report(doc, flushed)
+
+    @property
+    def depth(self):
+        """Number of documents waiting to be inserted"""
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Wait until the queued documents are inserted, return True if flushed"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def stats(self):
+        """Statistics since the last run as dict, latency in seconds"""
+        with self._lock:
+            return {'documents' : self._num_docs,
+                    'inserts' : self._num_inserts,
+                    'errors' : self._num_errors,
+                    'mean_latency' : self._total_latency / self._num_inserts if self._num_inserts else 0.,
+                    'max_latency' : self._max_latency,
+                    'max_depth' : self._max_depth}
+
+    def resetStats(self):
+        with self._lock:
+            self._num_docs = 0
+            self._num_inserts = 0
+            self._num_errors = 0
+            self._total_latency = 0.
+            self._max_latency = 0.
+            self._max_depth = 0
+
+    def _run(self):
+        # Taken from the queue while collecting a page, inserted next
+        pending = None
+
+        while True:
+            if pending is not None:
+                name, doc = pending
+                pending = None
+            else:
+                name, doc = self._queue.get()
+
+            if name == 'flush':
+                doc.set()
+                continue
+
+            if name != 'event':
+                self._insert(name, doc, 1)
+                continue
+
+            events = [doc]
+            while len(events) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if item[0] == 'event' and item[1]['descriptor'] == doc['descriptor']:
+                    events.append(item[1])
+                else:
+                    pending = item
+                    break
+
+            if len(events) == 1:
+                self._insert('event', doc, 1)
+            else:
+                self._insert('event_page', pack_event_page(*events), len(events))
+
+    def _insert(self, name, doc, num_docs):
+        start = ttime.perf_counter()
+        try:
+            self.insert(name, doc)
+            error = False
+        except Exception:
+            logger.exception("BulkInsertSink : failed to insert {}".format(name))
+            error = True
+
+        latency = ttime.perf_counter() - start
+        with self._lock:
+            self._num_docs += num_docs
+            self._num_inserts += 1
+            self._num_errors += error
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+
+    def _report(self, doc, flushed):
+        stats = self.stats()
+        self.resetStats()
+
+        text = "Stored run {} : {} documents in {} inserts, insert latency " \
+               "{:.1f} ms (max {:.1f} ms), max queue depth {}".format(
+                    doc['run_start'][:8], stats['documents'], stats['inserts'],
+                    stats['mean_latency'] * 1000, stats['max_latency'] * 1000,
+                    stats['max_depth'])
+
+        if stats['errors']:
+            text += ", {} inserts failed".format(stats['errors'])
+
+        if not flushed:
+            text += ", {} documents are still queued".format(self.depth)
+
+        logger.info(text)
+        if self.report is not None:
+            self.report(text)
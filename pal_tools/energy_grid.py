@@ -0,0 +1,185 @@
+"""Energy grids of step scans from E-space and k-space regions
+
+Region idx spans the boundaries SRB[idx] and SRB[idx+1] relative to E0.
+eMode of a boundary is True for eV and False for k, a region ending at a
+k boundary is stepped in k by StepSize[idx], the others in eV. Any number
+of regions is accepted, len(SRB) = len(eMode) = number of regions + 1.
+"""
+
+import functools
+import numpy as np
+
+# k [1/A] = K_FACTOR * sqrt(E - E0 [eV])
+K_FACTOR = 0.512
+
+# One row per point, region is the index in EnergyScanList.energy_list
+GRID_DTYPE = np.dtype([('energy', 'f8'), ('region', 'i2'), ('dwell', 'f4')])
+
+def eGrid(start_energy, stop_energy, step_energy):
+    """
+    E-space points from start_energy below stop_energy in eV
+
+    stop_energy is included when it is one step after the last point.
+    """
+    if step_energy <= 0:
+        raise ValueError("Energy step should be positive : {}".format(step_energy))
+
+    energy = np.arange(start_energy, stop_energy, step_energy)
+
+    # Check end point
+    if len(energy) and np.isclose(energy[-1] + step_energy, stop_energy):
+        energy = np.append(energy, stop_energy)
+
+    return energy
+
+def kGrid(start_energy, stop_k, step_k):
+    """
+    k-space points after start_energy [eV] below stop_k, in eV
+
+    The points are start_k + N * step_k for N = 1, 2, ...
+    """
+    if step_k <= 0:
+        raise ValueError("k step should be positive : {}".format(step_k))
+
+    if start_energy < 0:
+        raise ValueError("k-space region should start above E0 : {}".format(start_energy))
+
+    start_k = np.sqrt(start_energy) * K_FACTOR
+    stop_energy = (stop_k / K_FACTOR)**2
+
+    # One extra point so that the end condition is always met
+    num = max(int(np.ceil((stop_k - start_k) / step_k)), 0) + 1
+    energy = ((step_k * np.arange(1, num + 1) + start_k) / K_FACTOR)**2
+
+    end = np.flatnonzero(energy >= stop_energy)
+    if len(end):
+        energy = energy[:end[0]]
+
+    return energy
+
+def _regions(SRB, eMode, StepSize, SRBOnOff, joined=True):
+    """Energy arrays of the active regions"""
+    regions = []
+    for idx in range(len(SRB)-1):
+        if not SRBOnOff[idx]:
+            continue
+
+        step = StepSize[idx]
+
+        if eMode[idx] and eMode[idx+1] and not joined:
+            item = np.arange(SRB[idx], SRB[idx+1], step)
+
+        elif eMode[idx] and eMode[idx+1]:
+            if len(regions):
+                start = regions[-1][-1]
+
+                # Check start point
+                if start + StepSize[idx-1] > SRB[idx]:
+                    start = start + step
+            else:
+                start = SRB[idx]
+
+            item = eGrid(start, SRB[idx+1], step)
+
+        elif not len(regions):
+            raise ValueError("Region {} should follow an E-space region".format(idx+1))
+
+        elif eMode[idx+1]:
+            item = np.arange(regions[-1][-1], SRB[idx+1], step)
+
+        else:
+            item = kGrid(regions[-1][-1], SRB[idx+1], step)
+
+        if not len(item):
+            raise ValueError("Region {} has no points".format(idx+1))
+
+        regions.append(np.round(item, 5))
+
+    if not len(regions):
+        raise ValueError("No active region")
+
+    return regions
+
+@functools.lru_cache(maxsize=64)
+def _energyGrid(SRB, eMode, StepSize, SRBOnOff, Time, joined):
+    regions = _regions(SRB, eMode, StepSize, SRBOnOff, joined)
+    lengths = [len(item) for item in regions]
+
+    if Time is not None and len(Time) < len(regions):
+        raise ValueError("Integration time is missing for {} regions".format(len(regions)))
+
+    grid = np.empty(sum(lengths), dtype=GRID_DTYPE)
+    grid['energy'] = np.concatenate(regions)
+    grid['region'] = np.repeat(np.arange(len(regions)), lengths)
+    grid['dwell'] = 0 if Time is None else np.repeat(Time[:len(regions)], lengths)
+
+    # Shared by every caller with the same parameters
+    grid.setflags(write=False)
+
+    return grid
+
+def energyGrid(SRB, eMode, StepSize, SRBOnOff, Time=None, joined=True):
+    """
+    Energy grid of the regions as a read-only structured array of GRID_DTYPE
+
+    Grids are cached by their parameters.
+
+    Parameters
+    ----------
+    SRB : region boundaries relative to E0, in eV or k
+    eMode : True if the boundary is in eV, False if in k
+    StepSize : step of each region, in eV or k
+    SRBOnOff : True if the region is active
+    Time : integration time of each active region [sec], dwell is 0 if None
+    joined : True to continue an E-space region from the last point of the
+             previous region and to include its end boundary when it is one
+             step after the last point, False to start it at its own boundary
+             and stop below the next one, as the user scans do
+    """
+    return _energyGrid(tuple(float(value) for value in SRB),
+                       tuple(bool(value) for value in eMode),
+                       tuple(float(value) for value in StepSize),
+                       tuple(bool(value) for value in SRBOnOff),
+                       None if Time is None else tuple(float(value) for value in Time),
+                       bool(joined))
+
+def regionBounds(grid):
+    """Start index of each region in grid and len(grid)"""
+    num_regions = int(grid['region'][-1]) + 1 if len(grid) else 0
+    return np.append(np.searchsorted(grid['region'], np.arange(num_regions)), len(grid))
+
+class EnergyScanList:
+    """ make an E-Scan array, energy_list is one array per active region """
+    def __init__(self, SRB=None, eMode=None, StepSize=None,\
+                 SRBOnOff=None, Time=None):
+
+        self.SRB = SRB
+        self.eMode = eMode
+        self.StepSize = StepSize
+        self.SRBOnOff = SRBOnOff
+        self.time_list = Time
+        self.grid = None
+        self.energy_list = []
+        self.energy_start_points = []
+        self.makeArray()
+
+    def makeArray(self):
+        """ make an energy scan list """
+        self.grid = energyGrid(self.SRB, self.eMode, self.StepSize,
+                               self.SRBOnOff, self.time_list)
+        energy = self.grid['energy']
+        bounds = regionBounds(self.grid)
+
+        self.energy_list = np.empty(len(bounds)-1, dtype=object)
+        for idx in range(len(bounds)-1):
+            self.energy_list[idx] = energy[bounds[idx]:bounds[idx+1]]
+
+        # Start energy of each region and the end energy in eV
+        self.energy_start_points = energy[bounds[:-1]].tolist() + [float(energy[-1])]
+
+        if self.time_list is not None:
+            self.time_list = self.time_list[:len(self.energy_list)]
+
+    def kMode(self, start_energy_eV, stop_energy_k, step_energy_k):
+        """ kMode energy list """
+        return kGrid(start_energy_eV, stop_energy_k, step_energy_k)
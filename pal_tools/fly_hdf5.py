@@ -0,0 +1,134 @@
+import os
+import uuid
+import datetime
+
+import h5py
+import numpy as np
+import pandas as pd
+
+FLY_HDF5_SPEC = 'BL1D_FLY_HDF5'
+FLY_KEYS = ('ENC', 'I0', 'It', 'If', 'Ir')
+
+
+class FlyHDF5Writer:
+    """Write fly-scan waveforms to a chunked, compressed HDF5 file
+
+    One resizable dataset per key. The file is in SWMR mode, so readers can
+    open it while the scan is running.
+
+    Parameters
+    ----------
+    root : asset root directory, files are saved in root/YYYY/MM/DD
+    keys : dataset names
+    chunk_size : number of points in a HDF5 chunk
+    """
+    def __init__(self, root, keys=FLY_KEYS, chunk_size=1024, compression='gzip'):
+        self._keys = tuple(keys)
+        self._datum_counter = 0
+
+        date_path = datetime.datetime.now().strftime('%Y/%m/%d')
+        self._resource_uid = str(uuid.uuid4())
+        resource_path = os.path.join(date_path, self._resource_uid + '.h5')
+
+        full_path = os.path.join(root, resource_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        self._file = h5py.File(full_path, 'w', libver='latest')
+        for key in self._keys:
+            self._file.create_dataset(key,
+                                      shape=(0,),
+                                      maxshape=(None,),
+                                      chunks=(chunk_size,),
+                                      dtype='f8',
+                                      compression=compression,
+                                      shuffle=True)
+        self._file.swmr_mode = True
+
+        self.filename = full_path
+        self.resource = {'uid': self._resource_uid,
+                         'spec': FLY_HDF5_SPEC,
+                         'root': root,
+                         'resource_path': resource_path,
+                         'resource_kwargs': {},
+                         'path_semantics': 'posix'}
+
+    def write(self, waveforms):
+        """
+        Append waveforms and return datum documents
+
+        Parameters
+        ----------
+        waveforms : dict of arrays with the same length
+
+        return dict of datum documents
+        """
+        datums = {}
+        for key in self._keys:
+            value = np.asarray(waveforms[key], dtype='f8')
+            dataset = self._file[key]
+            start = dataset.shape[0]
+            stop = start + value.size
+
+            dataset.resize((stop,))
+            dataset[start:stop] = value
+
+            datums[key] = {'resource': self._resource_uid,
+                           'datum_id': '{}/{}'.format(self._resource_uid, self._datum_counter),
+                           'datum_kwargs': {'key': key, 'start': start, 'stop': stop}}
+            self._datum_counter += 1
+
+        self._file.flush()
+
+        return datums
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class FlyHDF5Handler:
+    """Databroker handler for FlyHDF5Writer files
+
+    The file is opened on the first access and refreshed on each read,
+    so it can be read while it is written.
+    """
+    specs = {FLY_HDF5_SPEC}
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = None
+
+    def __call__(self, key, start, stop):
+        if self._file is None:
+            self._file = h5py.File(self._filename, 'r', libver='latest', swmr=True)
+
+        dataset = self._file[key]
+        dataset.refresh()
+
+        return dataset[start:stop]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_fly_table(header):
+    """
+    Return fly scan data of header as a DataFrame with one row per point
+
+    Events with external arrays hold one chunk of points each, they are
+    filled from the HDF5 files and concatenated.
+
+    Parameters
+    ----------
+    header : databroker v1 header
+    """
+    data = header.table('primary', fill=True)
+
+    if not len(data) or np.ndim(data['ENC'].iloc[0]) == 0:
+        return data
+
+    return pd.DataFrame({key: np.concatenate([np.atleast_1d(value) for value in data[key]])
+                         for key in FLY_KEYS})
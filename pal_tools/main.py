@@ -30,6 +30,7 @@ import time as ttime
 import datetime
 from timeit import default_timer as timer
 import logging
+import threading
 import zmq
 import subprocess
 
@@ -48,16 +49,25 @@ from scanControlWidget import ScanControlWidget
 from Widgets import MainToolBar
 from TableWindow import TableWindow
 from SampleTable import SampleTable
+from GridPreviewWidget import GridPreviewWidget
 
 from utils import path, derivative, loadPV
 from utils import addLabelWidgetVert
 from utils import nearest
+from utils import loadRegions, saveRegions, findEdge
 
-from scan_utils import EnergyScanList
+from scan_utils import EnergyScanList, quantizeEnergyList
+from scan_utils import OverheadModel, ScanTimeCallback, formatDuration
+from scan_utils import orderBatch, batchTravel
+from scan_utils import ScanStateCallback, loadScanState, remainingEnergyList, stitchTables
 from scan_utils import Tweak
 from scan_utils import AfterScanCallback
 
+from fly_hdf5 import load_fly_table
+
 from thread import QThreadFuture, manager
+from plan_queue import PlanQueue
+from run_index import RunIndex
 
 logger = logging.getLogger('__name__')
 logger.debug("main initialized")
@@ -80,6 +90,7 @@ class Main(qt.QMainWindow):
     """Main Window"""
     hided = qt.Signal(object)
     closed = qt.Signal(object)
+    sigPlanFinished = qt.Signal(object)
     def __init__(self, RE=None, plan_funcs=None, db=None, dets=None,
                  motors=None, devices=None, *args, **kwargs):
 
@@ -225,6 +236,17 @@ class Main(qt.QMainWindow):
         self.logWidget.setMinimumHeight(150)
         self.rightBottomWidget.setWidget(addLabelWidgetVert('Log', self.logWidget, align='left'))
 
+        # Energy grid preview, tabbed with the log
+        self.gridPreview = GridPreviewWidget(self.control, parent=self)
+        self.gridPreviewWidget = qt.QDockWidget('Scan Grid', parent=self)
+        self.gridPreviewWidget.setContentsMargins(margin, margin, margin, margin)
+        self.gridPreviewWidget.setFeatures(qt.QDockWidget.NoDockWidgetFeatures)
+        self.gridPreviewWidget.setWidget(self.gridPreview)
+        self.addDockWidget(qt.Qt.RightDockWidgetArea, self.gridPreviewWidget)
+        self.rightBottomWidget.setWindowTitle('Log')
+        self.tabifyDockWidget(self.rightBottomWidget, self.gridPreviewWidget)
+        self.rightBottomWidget.raise_()
+
         # ProgressBar
         self.progressBar = qt.QProgressBar(self)
         self.progressBar.setMaximumWidth(20)
@@ -265,14 +287,34 @@ class Main(qt.QMainWindow):
         # RunEngine
         self.RE=RE
 
+        # Plans are run on the worker of the plan queue
+        self.plan_queue = None
+        if self.RE is not None:
+            self.plan_queue = PlanQueue(self.RE,
+                                        publish=lambda text: _submit(self.sendZmq, text),
+                                        finished=self.sigPlanFinished.emit)
+
+        # Plan waited for by runPlan and its event loop
+        self._waiting_item = None
+        self._wait_loop = None
+
+        # uids of the runs started by runPlan since resetRunUids
+        self._run_uids = []
+        self.sigPlanFinished.connect(self._planFinished)
+
         # DataBroker
         self.db = db
 
         if self.db is None:
             self.control.run_start.setEnabled(False)
+            self.control.resumeScanButton.setEnabled(False)
 
         self.tweak = Tweak()
 
+        # Step-scan time model, fitted from the past runs
+        self.overhead_model = OverheadModel()
+        self._overhead_fit_lock = threading.Lock()
+
         # Initialize K428 Amplifiers
         for name in ['I0_amp', 'It_amp', 'If_amp', 'Ir_amp']:
 
@@ -333,6 +375,9 @@ class Main(qt.QMainWindow):
 
         # RunEngine controllers in Energy scan tab
         self.control.run_start.clicked.connect(self.run_scan_energy)
+        self.control.resumeScanButton.clicked.connect(self.resumeScan)
+        self.control.enqueueButton.clicked.connect(self.enqueueScan)
+        self.control.clearQueueButton.clicked.connect(self.clearQueue)
         # self.control.pauseButton.clicked.connect(self._pause)
         # self.control.resumeButton.clicked.connect(self._resume)
         self.control.abortButton.clicked.connect(self._abort)
@@ -356,6 +401,10 @@ class Main(qt.QMainWindow):
         self.control.number_of_scan_edit.valueChanged.connect(self.activate_scan_number)
         self.control.run_type.currentIndexChanged.connect(self.activate_scan_number)
 
+        # Scan time estimation
+        self.control.estimate_button.clicked.connect(self.estimateScanTime)
+        self.control.save_regions_button.clicked.connect(self.saveRegionSettings)
+
         # E0 pseudo-motor related
         self.control.move_to_E0.clicked.connect(self.moveEnergy)
         self.control.stop_E0_button.clicked.connect(self.stop_E0)
@@ -404,6 +453,21 @@ class Main(qt.QMainWindow):
         # Finalize callback
         self.after_scan_cb = AfterScanCallback(self)
 
+        # Progress of step scans for resuming
+        self.scan_state_cb = ScanStateCallback(path('scan_state.json'))
+        if self.RE is not None:
+            self.RE.subscribe(self.scan_state_cb)
+
+        # Index of the runs for lookups by uid and scan_type
+        self.run_index = RunIndex(self.db)
+        if self.RE is not None:
+            self.RE.subscribe(self.run_index)
+
+        # Time model of step scans, fitted off the Qt thread at startup and after each scan
+        self.fitOverheadModel()
+        if self.RE is not None:
+            self.RE.subscribe(self._refitOverheadModel, 'stop')
+
         # Restrict special characters on filename
         regex = qt.QRegExp("[a-zA-Z0-9_]+")
         validator = qt.QRegExpValidator(regex)
@@ -425,6 +489,9 @@ class Main(qt.QMainWindow):
         self.update_E0_Angle()
         self.update_E0_Angle2()
 
+        # Initial energy grid preview
+        self.gridPreview.scheduleUpdate()
+
         # Change energy for overflow test
         self.control.testEnergyLineEdit.return_stroked.connect(self.moveEnergyForTest)
 
@@ -512,6 +579,8 @@ class Main(qt.QMainWindow):
 
             msg = 'Blink:{}'.format(str(self.blinkStatus))
             self.sendZmq(msg)
+
+            self.updateQueueLabel()
         except Exception as e:
             self.toLog("Exception in updateEngineStatus", color='red')
             print("Exception in updateEngineStatus : {}".format(e))
@@ -542,6 +611,10 @@ class Main(qt.QMainWindow):
 
     def moveEnergyForTest(self):
         """Move energy fot testing"""
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         E0 = self.control.edit_E0.value()
         value = E0 + float(self.control.testEnergyLineEdit.value())
         self.moveToEnergy(value)
@@ -554,6 +627,8 @@ class Main(qt.QMainWindow):
 
     def closeEvent(self, args):
         manager.stop()
+        if self.plan_queue is not None:
+            self.plan_queue.stop()
         self.closed.emit(True)
 
     def toLog(self, text, color='black'):
@@ -565,12 +640,125 @@ class Main(qt.QMainWindow):
         self.logWidget.setTextColor(qt.QColor(color))
         _submit(self.logWidget.append, text)
 
-    def delay(self, time):
-        """Apply delay without gui freeze"""
+    def runPlan(self, plan, subs=None, wait=True, **md):
+        """
+        Run a plan on the plan queue, the arguments are those of RE()
+
+        With wait, the plan runs ahead of the queued scans and a local event
+        loop runs until the worker signals the end of the plan. Then the
+        uids of its runs are returned, or its exception is raised here. The
+        uids are also kept for lastRunUid. Only one plan can be waited for,
+        a second call raises RuntimeError instead of starting another plan
+        inside the wait. Otherwise the plan is queued after the other plans
+        and the QueueItem is returned at once.
+        """
+        if wait and self._waiting_item is not None:
+            raise RuntimeError("{} is running".format(self._waiting_item.name))
+
+        item = self.plan_queue.submit(plan, subs, name=md.get('scan_type', ''),
+                                      immediate=wait, **md)
+        if not wait:
+            return item
+
+        self._waiting_item = item
+        self._wait_loop = qt.QEventLoop()
+        try:
+            # sigPlanFinished is queued, it quits the loop even if the plan is done now
+            if not item.done:
+                self._wait_loop.exec_()
+        finally:
+            self._waiting_item = None
+            self._wait_loop = None
+            self._run_uids.extend(item.uids)
+
+        if item.exception is not None:
+            raise item.exception
+
+        return list(item.uids)
+
+    def resetRunUids(self):
+        """Forget the runs started by runPlan, call before a measurement"""
+        self._run_uids = []
+
+    def lastRunUid(self, scan_type):
+        """uid of the last run of scan_type started by runPlan since resetRunUids, None if not any"""
+        for uid in reversed(self._run_uids):
+            run = self.run_index.get(uid)
+            if run is not None and run['scan_type'] == scan_type:
+                return uid
+        return None
+
+    def _planFinished(self, item):
+        if item is self._waiting_item and self._wait_loop is not None:
+            self._wait_loop.quit()
+
+    def isPlanRunning(self):
+        """True while runPlan waits for a plan"""
+        return self._waiting_item is not None
+
+    def abortRun(self):
+        """
+        Abort the running plan
+
+        RE.abort is not thread-safe. A running plan is aborted on the event
+        loop of the RunEngine, a paused one on the worker of the plan queue
+        as the abort resumes the plan to run its cleanup.
+        """
+        if self.RE.state == 'paused':
+            self.plan_queue.call(self.RE.abort, name='abort')
+        elif self.RE.state != 'idle':
+            self.RE.loop.call_soon_threadsafe(self._abortRunning)
+
+    def _abortRunning(self):
+        # On the event loop of the RunEngine, the state may have changed meanwhile
+        if self.RE.state == 'running':
+            self.RE.abort()
+        elif self.RE.state == 'paused':
+            self.plan_queue.call(self.RE.abort, name='abort')
+
+    def enqueueScan(self):
+        """Queue a step scan of the current settings after the queued plans"""
+        if self.control.run_type.currentIndex() == 2:
+            qt.QMessageBox.information(self, "Info", "Only step scans can be queued.\n")
+            return
+
+        self._flag_stop = False
+        if self.do_scan_and_save(wait=False):
+            self.control.abortButton.setEnabled(True)
+            self.toLog("A step scan of {} is queued".format(self.control.filename_edit.text()),
+                       color='blue')
+
+    def clearQueue(self):
+        """Remove the queued scans, the running scan is not aborted"""
+        num = self.plan_queue.clear()
+        self.toLog("{} queued scans are removed".format(num), color='red')
+
+    def updateQueueLabel(self):
+        """Show the running and queued plans"""
+        if self.plan_queue is None:
+            return
+
+        state = self.plan_queue.state()
+        if state['running'] is None and not len(state['queued']):
+            text = "Queue : empty"
+        else:
+            text = "Queue : {} waiting".format(len(state['queued']))
+            if state['running'] is not None:
+                text = "Queue : {} running, {} waiting".format(state['running']['name'],
+                                                              len(state['queued']))
+
+        self.control.queue_label.setText(text)
+
+    def beamCurrent(self):
+        """Storage ring current [mA], 0 if not available"""
         try:
-            self.RE(bps.sleep(time))
+            return float(np.round(caget(self.pv_names['Beam']['Current'], timeout = 1), 3))
         except:
-            pass
+            return 0.0
+
+    def delay(self, time):
+        """Apply delay without gui freeze"""
+        self.runPlan(bps.sleep(time))
 
     def _changeStack(self):
         index = self.control.run_type.currentIndex()
@@ -688,6 +876,7 @@ class Main(qt.QMainWindow):
             _submit(self.control.filename_edit.setEnabled, True)
 
             _submit(self.control.run_start.setEnabled, True)
+            _submit(self.control.resumeScanButton.setEnabled, True)
             _submit(self.control.ecal_start_edit.setEnabled, True)
             _submit(self.control.ecal_stop_edit.setEnabled, True)
             _submit(self.control.ecal_step_size_edit.setEnabled, True)
@@ -782,6 +971,7 @@ class Main(qt.QMainWindow):
             _submit(self.control.filename_edit.setEnabled, False)
 
             _submit(self.control.run_start.setEnabled, False)
+            _submit(self.control.resumeScanButton.setEnabled, False)
 
             _submit(self.control.ecal_start_edit.setEnabled, False)
             _submit(self.control.ecal_stop_edit.setEnabled, False)
@@ -813,8 +1003,13 @@ class Main(qt.QMainWindow):
             ...
 
         self.toLog("RunEngine is aborted!", color='red')
-        if self.RE.state != 'idle':
-            self.RE.abort()
+
+        # Queued scans do not start after an abort
+        num = self.plan_queue.clear()
+        if num:
+            self.toLog("{} queued scans are removed".format(num), color='red')
+
+        self.abortRun()
 
         # Disable buttons in control panel
         self.control.abortButton.setDisabled(True)
@@ -828,7 +1023,7 @@ class Main(qt.QMainWindow):
 
     def _resume(self):
         self.toLog("RunEngine is resumed!", color='red')
-        self.RE.resume()
+        self.plan_queue.call(self.RE.resume, name='resume')
 
     def checkDir(self):
         # no special characters on path string
@@ -845,6 +1040,10 @@ class Main(qt.QMainWindow):
 
     # Tweak related ----------------------------------------------------------
     def run_DCM_tweak(self):
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         try:
             self.toLog("Started DCM Tweak", color='blue')
             self.plot_type = 'align'
@@ -881,14 +1080,14 @@ class Main(qt.QMainWindow):
             # Set color notifiy on
             self.blinkStatus = True
 
-            self.RE(self.planDict['tweak_custom'](self.ophydDict['scaler'],
-                                                  'I0',
-                                                  self.ophydDict['dcm_etc_theta2'],
-                                                  self.control.DCM_axis_tweak_edit.value(),
-                                                  time=1,
-                                                  obj=self.tweak),
-                    scan_type='tweak',
-                    sdd=False)
+            self.runPlan(self.planDict['tweak_custom'](self.ophydDict['scaler'],
+                                                       'I0',
+                                                       self.ophydDict['dcm_etc_theta2'],
+                                                       self.control.DCM_axis_tweak_edit.value(),
+                                                       time=1,
+                                                       obj=self.tweak),
+                         scan_type='tweak',
+                         sdd=False)
 
         except Exception as e:
             print("Error occured during DCM tweak : {}".format(e))
@@ -932,6 +1131,10 @@ class Main(qt.QMainWindow):
 
 
     def run_slit_tweak(self):
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         try:
             self.toLog("Slit Tweak Started", color='blue')
             self.plot_type = 'align'
@@ -996,14 +1199,14 @@ class Main(qt.QMainWindow):
             self._blinkStatus = True
 
             # Start RunEngine
-            self.RE(self.planDict['tweak_custom'](self.ophydDict['scaler'],
-                                                  'I0',
-                                                  motor,
-                                                  step,
-                                                  time=1,
-                                                  obj=self.tweak),
-                    scan_type='tweak',
-                    sdd=False)
+            self.runPlan(self.planDict['tweak_custom'](self.ophydDict['scaler'],
+                                                       'I0',
+                                                       motor,
+                                                       step,
+                                                       time=1,
+                                                       obj=self.tweak),
+                         scan_type='tweak',
+                         sdd=False)
 
         except Exception as e:
             print("Error occured during Slit Tweak : {}".format(e))
@@ -1097,7 +1300,7 @@ class Main(qt.QMainWindow):
             msg = 'DisableAbortButton:True'
             self.sendZmq(msg)
 
-            self.RE(stop_and_mv(dcm, energy))
+            self.runPlan(stop_and_mv(dcm, energy, parent=self))
 
         except Exception as e:
             print("Exception in moveToEnergy : {}".format(e))
@@ -1112,6 +1315,10 @@ class Main(qt.QMainWindow):
             self.sendZmq(msg)
 
     def moveEnergy(self):
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         reply = qt.QMessageBox.question(self,
                         "Info", # title
                         "==============  warning  ================\n" \
@@ -1145,8 +1352,7 @@ class Main(qt.QMainWindow):
     def stop_E0(self):
         self._flag_stop = True
 
-        if self.RE.state != 'idle':
-            self.RE.abort()
+        self.abortRun()
 
         item = self.ophydDict['dcm']
         item.spmg.set(0)
@@ -1216,14 +1422,15 @@ class Main(qt.QMainWindow):
 
     def run_calibrate_energy(self):
 
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         self._flag_stop = False
         self._flag_pause = False
 
-        # Save previous run's uid
-        try:
-            self._last_uid = self.db[-1].start['uid']
-        except:
-            self._last_uid = ''
+        # Runs of this calibration
+        self.resetRunUids()
 
         reply = qt.QMessageBox.question(self,
                         "Info", # title
@@ -1316,32 +1523,32 @@ class Main(qt.QMainWindow):
             right = slits.right.user_readback.get()
 
             # bluesky runtime engine
-            self.RE(self.planDict['delay_scan_with_cleanup'](detectors=[self.ophydDict['scaler']],
-                                                                motor=self.ophydDict['dcm'],
-                                                                E0=E0,
-                                                                start=start,
-                                                                stop=stop,
-                                                                step_size=step_size,
-                                                                delay_time=delay_time/1000),
-                    scan_type='calibration',
-                    scan_mode='normal',
-                    E0=E0,
-                    scan_points=self.scan_total_count,
-                    darkI0=darkI0,
-                    darkIt=darkIt,
-                    darkIf=darkIf,
-                    darkIr=darkIr,
-                    gainI0=gainI0,
-                    gainIt=gainIt,
-                    gainIf=gainIf,
-                    gainIr=gainIr,
-                    sdd=sdd,
-                    monoOffset=monoOffset,
-                    slitTop=top,
-                    slitBottom=bottom,
-                    slitLeft=left,
-                    slitRight=right,
-                    beamcurrent=beamcurrent)
+            self.runPlan(self.planDict['delay_scan_with_cleanup'](detectors=[self.ophydDict['scaler']],
+                                                                     motor=self.ophydDict['dcm'],
+                                                                     E0=E0,
+                                                                     start=start,
+                                                                     stop=stop,
+                                                                     step_size=step_size,
+                                                                     delay_time=delay_time/1000),
+                         scan_type='calibration',
+                         scan_mode='normal',
+                         E0=E0,
+                         scan_points=self.scan_total_count,
+                         darkI0=darkI0,
+                         darkIt=darkIt,
+                         darkIf=darkIf,
+                         darkIr=darkIr,
+                         gainI0=gainI0,
+                         gainIt=gainIt,
+                         gainIf=gainIf,
+                         gainIr=gainIr,
+                         sdd=sdd,
+                         monoOffset=monoOffset,
+                         slitTop=top,
+                         slitBottom=bottom,
+                         slitLeft=left,
+                         slitRight=right,
+                         beamcurrent=beamcurrent)
         except Exception as e:
             print("Error in do_calibrate : {}".format(e))
             ideal_energy = self.control.ecal_edit_E0.value()
@@ -1408,8 +1615,8 @@ class Main(qt.QMainWindow):
             print("Error in do_calibrate : {}".format(e))
 
         finally:
-            currentUid = self.db[-1].start['uid']
-            if currentUid != self._last_uid:
+            currentUid = self.lastRunUid('calibration')
+            if currentUid is not None:
                 if self._flag_stop:
                     reply = qt.QMessageBox.question(self,
                                     "Info", # title
@@ -1422,7 +1629,7 @@ class Main(qt.QMainWindow):
 
                     if reply == qt.QMessageBox.Yes:
                         print("before save_data")
-                        self.save_data()
+                        self.save_data(currentUid)
 
             # Move to E0
             self.moveToEnergy(E0)
@@ -1465,6 +1672,10 @@ class Main(qt.QMainWindow):
 
     def measDarkCurrent(self):
         """Start Darkcurrent measurement"""
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         try:
             reply = qt.QMessageBox.question(self,
                             "Info", # title
@@ -1517,7 +1728,7 @@ class Main(qt.QMainWindow):
 
                 # Test run
                 item.preset_time.put(1)
-                self.RE(bp.count([item]), scan_type='test_run')
+                self.runPlan(bp.count([item]), scan_type='test_run')
 
                 # set preset_time to 10 seconds
                 item.preset_time.put(10)
@@ -1525,22 +1736,17 @@ class Main(qt.QMainWindow):
                 self.toLog("Started Dark Current Measurement. Please wait 10 seconds.")
 
                 # trigger scaler
-                self.RE(bp.count([item]), scan_type='dark_current')
+                self.runPlan(bp.count([item]), scan_type='dark_current')
 
                 # retrieve measured data & set dark current
-                headers = self.db(scan_type='dark_current')
-                for idx, header in enumerate(headers):
-                    # Get the last dark current data only
-                    if idx > 0:
-                        break
-                    try:
-                        data = header.table()
-                    except:
-                        return
+                try:
+                    data = self.run_index.header(scan_type='dark_current').table()
+                except:
+                    return
 
-                    # Skip if DataFrame is empty
-                    if not data.count().any():
-                        return
+                # Skip if DataFrame is empty
+                if not data.count().any():
+                    return
 
                 # counts per seconds
                 I0 = int(data['I0']/10.0)
@@ -1588,13 +1794,14 @@ class Main(qt.QMainWindow):
 
     def run_scan_energy(self):
 
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
+
         scan_type = self.control.run_type.currentIndex()
 
-        # Save previous run's uid
-        try:
-            self._last_uid = self.db[-1].start['uid']
-        except:
-            self._last_uid = ''
+        # Runs of this measurement
+        self.resetRunUids()
 
         currentEnergy = self.ophydDict['dcm'].energy.get()
         E0 = self.control.edit_E0.value()
@@ -1640,6 +1847,8 @@ class Main(qt.QMainWindow):
         fly = self.control.run_type.currentIndex() == 2
 
         if fly:
+            self._fly_sweeps = number_of_scan
+
             # repeat scan as specified number_of_scan-times
             for idx in range(number_of_scan):
 
@@ -1647,6 +1856,7 @@ class Main(qt.QMainWindow):
                     break
 
                 print("starting ")
+                self._fly_sweep = idx
                 self.do_scan_and_save()
         else:
             if batch:
@@ -1656,8 +1866,307 @@ class Main(qt.QMainWindow):
                 # repeat scan as specified number_of_scan-times
                 self.do_scan_and_save()
 
-    def do_scan_and_save(self):
-        """Do energy scan and save data"""
+    def numberOfScans(self):
+        """Number of step scans of the current settings"""
+        if self.control.use_batch_checkbox.isChecked():
+            sample_names, sample_info = self.sampleTable.getData()
+            return sum([int(info[1]) for name, info in zip(sample_names, sample_info) if len(name)])
+
+        if self.control.run_type.currentIndex() == 0:
+            return 1
+
+        return int(self.control.number_of_scan_edit.value())
+
+    def fitOverheadModel(self):
+        """Fit the step-scan time model to the past runs on a worker thread"""
+        if self.db is None or not self._overhead_fit_lock.acquire(blocking=False):
+            return
+
+        threading.Thread(target=self._fitOverheadModel, name='overhead-fit', daemon=True).start()
+
+    def _fitOverheadModel(self):
+        try:
+            if self.overhead_model.fit(self.db(scan_type='measure', scan_mode='normal')):
+                self.toLog("Scan overhead : {:.3f} sec/point + {:.4f} sec/eV "
+                           "({} points)".format(self.overhead_model.a,
+                                                self.overhead_model.b,
+                                                self.overhead_model.num_points))
+        except Exception as e:
+            print("Exception in fitOverheadModel : {}".format(e))
+        finally:
+            self._overhead_fit_lock.release()
+
+    def _refitOverheadModel(self, name, doc):
+        """Refit after each finished step scan, called by RunEngine"""
+        run = self.run_index.get(doc['run_start'])
+        if run is not None and run['scan_type'] == 'measure' and doc.get('exit_status') == 'success':
+            self.fitOverheadModel()
+
+    def estimateScanTime(self, *args, energy_list=None, time_list=None, batch_queue=None):
+        """Estimate and show the duration of the step scans in seconds"""
+        delay_time = float(self.control.edit_delay_time.value()) / 1000
+        try:
+            waitTime = self.ophydDict['scaler'].auto_count_time.get() * 1.5
+        except:
+            waitTime = 0
+
+        try:
+            if batch_queue is None and energy_list is None and\
+               self.control.use_batch_checkbox.isChecked():
+                batch_queue = self.batchQueue()
+
+            E0 = self.control.edit_E0.value()
+            if batch_queue is None and energy_list is None:
+                eList = self.makeEnergyScanList()
+                energy_list = np.array(eList.energy_list, dtype=object) + float(E0)
+                time_list = eList.time_list
+        except Exception as e:
+            self.toLog("Scan time is not estimated : {}".format(e), color='red')
+            _submit(self.control.est_time_label.setText, "-")
+            return None
+
+        if batch_queue is not None:
+            schedule = self.scanSchedule(batch_queue, delay_time, waitTime)
+            num_scan = len(schedule)
+            duration = sum([np.sum(times) + setup for times, setup in schedule])
+        else:
+            num_scan = self.numberOfScans()
+            duration = self.overhead_model.estimate(energy_list, time_list, delay_time,
+                                                    E0=E0, waitTime=waitTime, num_scan=num_scan)
+
+        _submit(self.control.est_time_label.setStyleSheet, "")
+        _submit(self.control.est_time_label.setText, formatDuration(duration))
+        self.toLog("Estimated scan time : {} ({} scans)".format(formatDuration(duration), num_scan))
+
+        return duration
+
+    def scanSchedule(self, batch_queue, delay_time, waitTime=0):
+        """List of (point_times, setup_time) of each scan of the batch queue"""
+        schedule = []
+        last_E0 = None
+        for item in batch_queue:
+            point_times = self.overhead_model.pointTimes(item['energy_list'],
+                                                         item['time_list'],
+                                                         delay_time)
+            setup_time = self.overhead_model.setupTime(item['energy_list'],
+                                                       item['E0'],
+                                                       waitTime)
+
+            scans = [(point_times, setup_time)] * item['num_scan']
+
+            # DCM slew to another edge
+            if last_E0 is not None and len(scans):
+                scans[0] = (point_times, setup_time + self.overhead_model.b * abs(item['E0'] - last_E0))
+            last_E0 = item['E0']
+
+            schedule += scans
+
+        return schedule
+
+    def batchQueue(self):
+        """
+        Return the batch queue of the sample table in table order
+
+        E0, energy_list and time_list of each row are made from its Element,
+        Edge and Regions, the current settings for empty cells. ValueError
+        is raised before any scan if a row can not be resolved.
+        """
+        queue = self.sampleTable.getQueue()
+        enc_quantized = self.control.snap_to_encoder_checkbox.isChecked()
+
+        grids = {}
+        for item in queue:
+            try:
+                if len(item['element']):
+                    E0 = findEdge(self.control.elements_data,
+                                  item['element'],
+                                  item['edge'] or 'K')
+                else:
+                    E0 = float(self.control.edit_E0.value())
+
+                regions = item['regions'] or None
+                eList = self.makeEnergyScanList(regions)
+
+            except Exception as e:
+                raise ValueError("Row {} ({}) : {}".format(item['row']+1, item['name'], e))
+
+            key = (E0, regions)
+            if key not in grids:
+                energy_list = np.array(eList.energy_list, dtype=object) + E0
+                if enc_quantized:
+                    try:
+                        energy_list = self.snapEnergyList(energy_list, log=False)
+                    except ValueError as e:
+                        raise ValueError("Row {} ({}) : {}".format(item['row']+1, item['name'], e))
+                grids[key] = energy_list
+
+            item['E0'] = E0
+            item['energy_list'] = grids[key]
+            item['time_list'] = list(eList.time_list)
+            item['md'] = {'element' : item['element'],
+                          'edge' : item['edge'] or ('K' if len(item['element']) else ''),
+                          'regions' : item['regions']}
+
+        return queue
+
+    def planBatchOrder(self, rows):
+        """
+        Return the batch queue in run order
+
+        The order is optimized when 'Optimize Order' of the sample table is
+        checked. The run order is written to a log in the data path.
+
+        :param rows : batch queue in table order, see batchQueue
+        """
+        if not self.sampleTable.optimizeOrder.isChecked():
+            return rows
+
+        try:
+            sample_changer = self.ophydDict['sampleChanger']
+            position = sample_changer.position
+            speed = sample_changer.velocity.get()
+        except:
+            position = 0.
+            speed = None
+
+        energy = self.ophydDict['dcm'].energy.position
+
+        ordered = orderBatch(rows, position=position, energy=energy)
+
+        # Expected time saved against the table order
+        table_travel, table_slew = batchTravel(rows, position=position, energy=energy)
+        travel, slew = batchTravel(ordered, position=position, energy=energy)
+
+        saved = self.overhead_model.b * (table_slew - slew)
+        if speed:
+            saved += (table_travel - travel) / speed
+
+        self.toLog("Batch order optimized : sample travel {:.1f} -> {:.1f}, "
+                   "DCM travel {:.1f} -> {:.1f} eV, "
+                   "{} saved".format(table_travel, travel, table_slew, slew,
+                                     formatDuration(saved)), color='blue')
+
+        # Run order to table order
+        path = self.control.data_save_path.toPlainText()
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        timeString = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_path = os.path.join(path, 'batch_order_{}.log'.format(timeString))
+        with open(log_path, 'w') as file:
+            file.write('Run\tRow\tSample\tPosition\tScans\tE0\n')
+            for run, item in enumerate(ordered):
+                file.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(run+1,
+                                                              item['row']+1,
+                                                              item['name'],
+                                                              item['position'],
+                                                              item['num_scan'],
+                                                              item.get('E0', '')))
+
+            self.toLog("Batch run order is saved to " + log_path)
+
+        return ordered
+
+    def regionSettings(self):
+        """Current region settings, the arguments of EnergyScanList"""
+        return {'SRB' : [self.control.SRB_1.value(),
+                         self.control.SRB_2.value(),
+                         self.control.SRB_3.value(),
+                         self.control.SRB_4.value(),
+                         self.control.SRB_5.value(),
+                         self.control.SRB_6.value()],
+                'eMode' : [self.control.eMode_bar_1.value()!=1000,
+                           self.control.eMode_bar_2.value()!=1000,
+                           self.control.eMode_bar_3.value()!=1000,
+                           self.control.eMode_bar_4.value()!=1000,
+                           self.control.eMode_bar_5.value()!=1000,
+                           self.control.eMode_bar_6.value()!=1000],
+                'StepSize' : [self.control.stepSize_1.value(),
+                              self.control.stepSize_2.value(),
+                              self.control.stepSize_3.value(),
+                              self.control.stepSize_4.value(),
+                              self.control.stepSize_5.value()],
+                'SRBOnOff' : [self.control.SRBOnOff_1.isChecked(),
+                              self.control.SRBOnOff_2.isChecked(),
+                              self.control.SRBOnOff_3.isChecked(),
+                              self.control.SRBOnOff_4.isChecked(),
+                              self.control.SRBOnOff_5.isChecked()],
+                'Time' : [self.control.SRB_time_1.value(),
+                          self.control.SRB_time_2.value(),
+                          self.control.SRB_time_3.value(),
+                          self.control.SRB_time_4.value(),
+                          self.control.SRB_time_5.value()]}
+
+    def saveRegionSettings(self):
+        """Save the current regions under a name for the Regions column"""
+        name, ok = qt.QInputDialog.getText(self, "Save Regions", "Name of the regions :")
+        name = name.strip()
+        if not ok or not len(name):
+            return
+
+        try:
+            self.makeEnergyScanList()
+        except:
+            qt.QMessageBox.information(self, "Info", "Please check scan range settings.\n")
+            return
+
+        regions = loadRegions()
+        regions[name] = self.regionSettings()
+        saveRegions(regions)
+
+        self.toLog("Regions are saved as " + name)
+
+    def makeEnergyScanList(self, regions=None):
+        """EnergyScanList of the saved regions, the current settings if None"""
+        if regions is None:
+            return EnergyScanList(**self.regionSettings())
+
+        saved = loadRegions()
+        if regions not in saved:
+            raise KeyError("Unknown regions : {}".format(regions))
+
+        return EnergyScanList(**saved[regions])
+
+    def snapEnergyList(self, energy_list, log=True):
+        """Snap energy_list to encoder positions and report the effective grid"""
+        _dcm = self.ophydDict['dcm']
+        enc_resolution = abs(_dcm.encResolution.get())
+        requested = sum([len(item) for item in energy_list])
+
+        snapped, _ = quantizeEnergyList(energy_list,
+                                        enc_resolution,
+                                        offset=_dcm.offset.get())
+        energy_list = np.empty(len(snapped), dtype=object)
+        energy_list[:] = snapped
+
+        if not log:
+            return energy_list
+
+        # Report the effective grid
+        self.toLog("Energy grid snapped to encoder ({:g} deg.) : "
+                   "{} -> {} points".format(enc_resolution,
+                                            requested,
+                                            sum([len(item) for item in energy_list])))
+        for idx, item in enumerate(energy_list):
+            if len(item) > 1:
+                steps = np.diff(item)
+                self.toLog("  Region {} : {} points, {:.2f} ~ {:.2f} eV, "
+                           "step {:.3f} ~ {:.3f} eV".format(idx+1, len(item),
+                                                            item[0], item[-1],
+                                                            steps.min(), steps.max()))
+            else:
+                self.toLog("  Region {} : {} points".format(idx+1, len(item)))
+
+        return energy_list
+
+    def do_scan_and_save(self, wait=True):
+        """
+        Do energy scan and save data
+
+        :param wait : False to queue a step scan and return at once, the
+                      settings are captured in the metadata of the scan
+        return True if the scan is done or queued
+        """
         try:
             logger.debug("EXAFS scan started!")
             self.toLog("A EXAFS scan started!", color='blue')
@@ -1673,8 +2182,9 @@ class Main(qt.QMainWindow):
                 msg = "XLabel:{}".format('Energy [eV]')
                 self.sendZmq(msg)
 
-                # Disable control
-                self.control_enable(False)
+                # Disable control, the setup of a queued scan can be changed for the next one
+                if wait:
+                    self.control_enable(False)
 
                 # Check K428 Amplifier Settings
                 for name in ['I0_amp', 'It_amp', 'If_amp', 'Ir_amp']:
@@ -1682,41 +2192,9 @@ class Main(qt.QMainWindow):
                     # Set ZeroCheck False
                     device.zeroCheck.put(0, wait=False)
 
-                try:
-                    beamcurrent = caget(self.pv_names['Beam']['Current'], timeout = 1)
-                    beamcurrent = np.round(beamcurrent, 3)
-                except:
-                    beamcurrent = 0.0
-
                 # Make energy list
                 try:
-                    eList=EnergyScanList(SRB=[self.control.SRB_1.value(),
-                                            self.control.SRB_2.value(),
-                                            self.control.SRB_3.value(),
-                                            self.control.SRB_4.value(),
-                                            self.control.SRB_5.value(),
-                                            self.control.SRB_6.value()],
-                                        eMode=[self.control.eMode_bar_1.value()!=1000,
-                                            self.control.eMode_bar_2.value()!=1000,
-                                            self.control.eMode_bar_3.value()!=1000,
-                                            self.control.eMode_bar_4.value()!=1000,
-                                            self.control.eMode_bar_5.value()!=1000,
-                                            self.control.eMode_bar_6.value()!=1000],
-                                        StepSize=[self.control.stepSize_1.value(),
-                                                self.control.stepSize_2.value(),
-                                                self.control.stepSize_3.value(),
-                                                self.control.stepSize_4.value(),
-                                                self.control.stepSize_5.value()],
-                                        SRBOnOff=[self.control.SRBOnOff_1.isChecked(),
-                                                self.control.SRBOnOff_2.isChecked(),
-                                                self.control.SRBOnOff_3.isChecked(),
-                                                self.control.SRBOnOff_4.isChecked(),
-                                                self.control.SRBOnOff_5.isChecked()],
-                                        Time=[self.control.SRB_time_1.value(),
-                                            self.control.SRB_time_2.value(),
-                                            self.control.SRB_time_3.value(),
-                                            self.control.SRB_time_4.value(),
-                                            self.control.SRB_time_5.value()])
+                    eList = self.makeEnergyScanList()
                 except:
                     reply = qt.QMessageBox.information(self,
                                                        "Info", # title
@@ -1728,6 +2206,17 @@ class Main(qt.QMainWindow):
                 E0 = self.control.edit_E0.value()
                 energy_list = np.array(eList.energy_list, dtype=object) + float(E0)
 
+                # Snap to encoder positions, adjacent points can share one count in k-space
+                enc_quantized = self.control.snap_to_encoder_checkbox.isChecked()
+                if enc_quantized:
+                    try:
+                        energy_list = self.snapEnergyList(energy_list)
+                    except ValueError as e:
+                        qt.QMessageBox.information(self,
+                                                   "Info",
+                                                   "Please check scan range settings.\n{}".format(e))
+                        raise UserException()
+
                 # For information update
                 self.scan_total_count = 0
                 for item in energy_list:
@@ -1738,11 +2227,44 @@ class Main(qt.QMainWindow):
 
 
                 # Set notify on
-                self.blinkStatus = True
+                if wait:
+                    self.blinkStatus = True
 
                 # Should wait until the auto-count of the scaler is finished
                 waitTime = self.ophydDict['scaler'].auto_count_time.get() * 1.5
 
+                # Edge and regions of each sample in run order
+                batch_queue = None
+                if self.control.use_batch_checkbox.isChecked():
+                    try:
+                        batch_queue = self.planBatchOrder(self.batchQueue())
+                    except ValueError as e:
+                        qt.QMessageBox.information(self,
+                                                   "Info",
+                                                   "Please check the sample table.\n{}".format(e))
+                        raise UserException()
+
+                    self.toLog("Batch queue : {} samples, {} edges".format(
+                               len(batch_queue), len(set([item['E0'] for item in batch_queue]))))
+
+                # Estimated time, updated during the scan
+                if batch_queue is not None:
+                    self.estimateScanTime(batch_queue=batch_queue)
+                    schedule = self.scanSchedule(batch_queue, delay_time/1000, waitTime)
+                else:
+                    self.estimateScanTime(energy_list=energy_list, time_list=time_list)
+                    schedule = None
+
+                scan_time_cb = ScanTimeCallback(self.control.est_time_label,
+                                                self.overhead_model.pointTimes(energy_list,
+                                                                               time_list,
+                                                                               delay_time/1000),
+                                                self.overhead_model.setupTime(energy_list,
+                                                                              E0,
+                                                                              waitTime),
+                                                num_scan=self.numberOfScans(),
+                                                schedule=schedule)
+
                 dets = [self.ophydDict['scaler']]
                 sdd = False
 
@@ -1766,37 +2288,72 @@ class Main(qt.QMainWindow):
 
                 monoOffset = self.control.E0_offset.text()
 
+                # Start the next move while the scaler is read
+                pipelined = self.control.pipeline_checkbox.isChecked()
+
+                # Wait until theta is stable, the delay time is the maximum wait
+                settle = self.control.settle_checkbox.isChecked()
+
+                # Adaptive count time within the time of each region
+                dwell_mode = [None, 'transmission', 'fluorescence'][self.control.dwell_mode.currentIndex()]
+                dwell_error = self.control.dwell_error_edit.value() / 100.
+                dwell_min = self.control.dwell_min_edit.value()
+
                 # Bluesky runtime engine
                 plan = self.planDict['multi_exafs_scan_with_cleanup']
 
-                self.RE(plan(detectors=[self.ophydDict['scaler']],
-                             motor=self.ophydDict['dcm_energy'],
+                self.runPlan(plan(detectors=[self.ophydDict['scaler']],
+                                  motor=self.ophydDict['dcm_energy'],
+                                  E0=E0,
+                                  energy_list=energy_list,
+                                  time_list=time_list,
+                                  delay_time=delay_time/1000,
+                                  waitTime=waitTime,
+                                  device_dict=self.ophydDict,
+                                  parent=self,
+                                  pipelined=pipelined,
+                                  settle=settle,
+                                  dwell_mode=dwell_mode,
+                                  dwell_error=dwell_error,
+                                  dwell_min=dwell_min,
+                                  dark={'I0' : darkI0,
+                                        'It' : darkIt,
+                                        'If' : darkIf,
+                                        'Ir' : darkIr},
+                                  batch_queue=batch_queue,
+                                  num_scan=None if batch_queue else self.numberOfScans()),
+                             subs=[scan_time_cb],
+                             wait=wait,
+                             scan_type='measure',
+                             scan_mode='normal',
                              E0=E0,
-                             energy_list=energy_list,
-                             time_list=time_list,
-                             delay_time=delay_time/1000,
-                             waitTime=waitTime,
-                             device_dict=self.ophydDict,
-                             parent=self),
-                        scan_type='measure',
-                        scan_mode='normal',
-                        E0=E0,
-                        scan_points=self.scan_total_count,
-                        darkI0=darkI0,
-                        darkIt=darkIt,
-                        darkIf=darkIf,
-                        darkIr=darkIr,
-                        gainI0=gainI0,
-                        gainIt=gainIt,
-                        gainIf=gainIf,
-                        gainIr=gainIr,
-                        slitTop=top,
-                        slitBottom=bottom,
-                        slitLeft=left,
-                        slitRight=right,
-                        sdd=sdd,
-                        monoOffset=monoOffset,
-                        beamcurrent=beamcurrent)
+                             scan_points=self.scan_total_count,
+                             darkI0=darkI0,
+                             darkIt=darkIt,
+                             darkIf=darkIf,
+                             darkIr=darkIr,
+                             gainI0=gainI0,
+                             gainIt=gainIt,
+                             gainIf=gainIf,
+                             gainIr=gainIr,
+                             slitTop=top,
+                             slitBottom=bottom,
+                             slitLeft=left,
+                             slitRight=right,
+                             sdd=sdd,
+                             monoOffset=monoOffset,
+                             enc_quantized=enc_quantized,
+                             pipelined=pipelined,
+                             settle=settle,
+                             dwell_mode=dwell_mode,
+                             dwell_error=dwell_error,
+                             dwell_min=dwell_min,
+                             beamcurrent=self.beamCurrent,
+                             run_type=self.control.run_type.currentIndex(),
+                             filename=self.control.filename_edit.text(),
+                             data_path=self.control.data_save_path.toPlainText(),
+                             description=self.control.description_edit.toPlainText(),
+                             region_settings=self.regionSettings())
 
             # Fly Scan Mode
             elif scan_type == 2:
@@ -1849,6 +2406,17 @@ class Main(qt.QMainWindow):
                 # Scan Paramters
                 startE = E0 + start_energy_rel
                 stopE = E0 + stop_energy_rel
+
+                # Bidirectional mode : odd sweeps go down in energy from the previous stop energy,
+                # only the first sweep approaches from below and only the last one returns to E0
+                sweep = getattr(self, '_fly_sweep', 0)
+                sweeps = getattr(self, '_fly_sweeps', 1)
+                bidirectional = self.control.flyControl.flyBidirectional.isChecked() and sweeps > 1
+                direction = 'down' if bidirectional and sweep % 2 else 'up'
+                return_to_E0 = not bidirectional or sweep == sweeps - 1
+
+                if direction == 'down':
+                    startE, stopE = stopE, startE
                 scan_encoder_steps = float(self.control.flyControl.flyEncoderStepSize.text())
                 motor_speed = float(self.control.flyControl.flyMotorSpeed.text())
 
@@ -1859,16 +2427,19 @@ class Main(qt.QMainWindow):
                 if self._flag_stop:
                     raise UserException()
 
-                self.toLog("Moving energy to {:.3f}. And wait for 1 second.".format(startE-200.0))
-                # Move energy to startE-200 eV and wait 1 seconds for stablization
-                self.RE(self.planDict['mv_and_wait'](self.ophydDict['dcm'], energy=(startE-200.0), delay=1))
+                if not bidirectional or sweep == 0:
+                    self.toLog("Moving energy to {:.3f}. And wait for 1 second.".format(startE-200.0))
+                    # Move energy to startE-200 eV and wait 1 seconds for stablization
+                    self.runPlan(self.planDict['mv_and_wait'](self.ophydDict['dcm'], energy=(startE-200.0), delay=1))
 
-                if self._flag_stop:
-                    raise UserException()
+                    if self._flag_stop:
+                        raise UserException()
 
-                self.toLog("Moving energy to {:.3f}. And wait for 2 seconds.".format(startE))
-                # Move energy to startE and wait 2 seconds for stablization
-                self.RE(self.planDict['mv_and_wait'](self.ophydDict['dcm'], energy=startE, delay=2))
+                    self.toLog("Moving energy to {:.3f}. And wait for 2 seconds.".format(startE))
+                    # Move energy to startE and wait 2 seconds for stablization
+                    self.runPlan(self.planDict['mv_and_wait'](self.ophydDict['dcm'], energy=startE, delay=2))
+                else:
+                    self.toLog("Sweep {} starts at {:.3f} eV going {}.".format(sweep + 1, startE, direction))
 
                 # Calculate Total Scan Counts
                 dcm = self.ophydDict['dcm']
@@ -1916,41 +2487,50 @@ class Main(qt.QMainWindow):
                     raise UserException()
 
                 # Run fly scan
-                self.RE(self.planDict['fly_scan_with_cleanup'](E0,
-                                                               motor_speed,
-                                                               self.ophydDict,
-                                                               self),
-
-                        scan_type='measure',
-                        scan_mode='fly',
-                        scan_points=self.scan_total_count,
-                        startE=startE,
-                        startTh=startTh,
-                        stopE=stopE,
-                        stopTh=stopTh,
-                        enc_resolution=enc_resolution,
-                        scan_encoder_steps=scan_encoder_steps,
-                        motor_speed=motor_speed,
-                        coolTime=cooling_time,
-                        slitTop=top,
-                        slitBottom=bottom,
-                        slitLeft=left,
-                        slitRight=right,
-                        E0=E0,
-                        gainI0=gainI0,
-                        gainIt=gainIt,
-                        gainIf=gainIf,
-                        gainIr=gainIr,
-                        darkI0=0,
-                        darkIt=0,
-                        darkIf=0,
-                        darkIr=0,
-                        beamcurrent=beamcurrent,
-                        sdd=False)
+                self.runPlan(self.planDict['fly_scan_with_cleanup'](E0,
+                                                                    motor_speed,
+                                                                    self.ophydDict,
+                                                                    self,
+                                                                    return_to_E0=return_to_E0),
+
+                             scan_type='measure',
+                             scan_mode='fly',
+                             scan_points=self.scan_total_count,
+                             startE=startE,
+                             startTh=startTh,
+                             stopE=stopE,
+                             stopTh=stopTh,
+                             enc_resolution=enc_resolution,
+                             scan_encoder_steps=scan_encoder_steps,
+                             motor_speed=motor_speed,
+                             direction=direction,
+                             sweep=sweep,
+                             coolTime=cooling_time,
+                             slitTop=top,
+                             slitBottom=bottom,
+                             slitLeft=left,
+                             slitRight=right,
+                             E0=E0,
+                             gainI0=gainI0,
+                             gainIt=gainIt,
+                             gainIf=gainIf,
+                             gainIr=gainIr,
+                             darkI0=0,
+                             darkIt=0,
+                             darkIf=0,
+                             darkIr=0,
+                             beamcurrent=beamcurrent,
+                             sdd=False)
+
+            return True
 
         except Exception as e:
             print("Exception in do_scan_and_save : {}".format(e))
 
+            if not wait:
+                self.toLog("The scan is not queued", color='red')
+                return False
+
             self._flag_stop = True
 
             fly = self.control.run_type.currentIndex() == 2
@@ -1983,18 +2563,130 @@ class Main(qt.QMainWindow):
             #     # Set original mono speed for normal step-scan
             #     self.ophydDict['energyFlyer'].fly_motor_stop.put(1, wait=False)
 
-            currentUid = self.db[-1].start['uid']
-            if currentUid != self._last_uid:
-                if self._flag_stop:
-                    reply = qt.QMessageBox.question(self,
-                                    "Info", # title
-                                    "A scan is aborted.\n\n" \
-                                    "Do you want to save data?\n",
-                                    qt.QMessageBox.Yes| qt.QMessageBox.No,
-                                    qt.QMessageBox.No) # Default button
+            if wait:
+                currentUid = self.lastRunUid('measure')
+                if currentUid is not None:
+                    if self._flag_stop:
+                        reply = qt.QMessageBox.question(self,
+                                        "Info", # title
+                                        "A scan is aborted.\n\n" \
+                                        "Do you want to save data?\n",
+                                        qt.QMessageBox.Yes| qt.QMessageBox.No,
+                                        qt.QMessageBox.No) # Default button
+
+                        if reply == qt.QMessageBox.Yes:
+                            self.save_data(currentUid)
+
+                        state = loadScanState(self.scan_state_cb.filename)
+                        if state is not None and state['uid'] == currentUid:
+                            self.toLog("{} points are measured, "
+                                       "the scan can be continued with Resume Scan".format(
+                                       state['num_completed']), color='red')
+
+    def resumeScan(self):
+        """Continue the interrupted step scan from the next unmeasured point"""
+        if self.isPlanRunning():
+            self.toLog("Wait until the running plan is finished", color='red')
+            return
 
-                    if reply == qt.QMessageBox.Yes:
-                        self.save_data()
+        state = loadScanState(self.scan_state_cb.filename)
+        if state is None or state.get('exit_status') == 'success':
+            qt.QMessageBox.information(self, "Info", "There is no interrupted scan to resume.\n")
+            return
+
+        energy_list, time_list = remainingEnergyList(state)
+        num_points = sum([len(item) for item in state['energy_list']])
+        num_remaining = sum([len(item) for item in energy_list])
+        if not num_remaining:
+            qt.QMessageBox.information(self, "Info", "All points of the scan are measured.\n")
+            return
+
+        md = dict(state['md'])
+        filename = md.get('sample_name', self.control.filename_edit.text())
+
+        reply = qt.QMessageBox.question(self,
+                        "Info", # title
+                        "Resume the scan of {} from {:.2f} eV?\n\n" \
+                        "{} of {} points are left.\n\n" \
+                        "Please Open the Photon Shutter.".format(filename,
+                                                                 energy_list[0][0],
+                                                                 num_remaining,
+                                                                 num_points),
+                        qt.QMessageBox.Yes| qt.QMessageBox.No,
+                        qt.QMessageBox.Yes) # Default button
+
+        if reply == qt.QMessageBox.No:
+            return
+
+        # Runs of this measurement
+        self.resetRunUids()
+
+        self._flag_stop = False
+        self._flag_pause = False
+
+        try:
+            self.toLog("The scan {} is resumed".format(state['uid'][:8]), color='blue')
+
+            self.plot_type = 'measure'
+            self.control_enable(False)
+            self.blinkStatus = True
+
+            _submit(self.control.filename_edit.setText, filename)
+
+            # Should wait until the auto-count of the scaler is finished
+            waitTime = self.ophydDict['scaler'].auto_count_time.get() * 1.5
+
+            md['scan_points'] = num_points
+            self.scan_total_count = num_points
+
+            self.runPlan(self.planDict['resume_exafs_scan_with_cleanup'](
+                             detectors=[self.ophydDict['scaler']],
+                             motor=self.ophydDict['dcm_energy'],
+                             E0=md['E0'],
+                             energy_list=energy_list,
+                             time_list=time_list,
+                             delay_time=md.get('delay_after_set_energy', 0),
+                             waitTime=waitTime,
+                             device_dict=self.ophydDict,
+                             parent=self,
+                             resumed_from=state['runs'],
+                             pipelined=md.get('pipelined', False),
+                             settle=md.get('settle', False),
+                             dwell_mode=md.get('dwell_mode'),
+                             dwell_error=md.get('dwell_error', 0.001),
+                             dwell_min=md.get('dwell_min', 0.1),
+                             dark={'I0' : md.get('darkI0', 0),
+                                   'It' : md.get('darkIt', 0),
+                                   'If' : md.get('darkIf', 0),
+                                   'Ir' : md.get('darkIr', 0)}),
+                         **md)
+
+        except Exception as e:
+            print("Exception in resumeScan : {}".format(e))
+
+            self._flag_stop = True
+
+            if self.RE.state != 'paused':
+                self.control_enable(True)
+                self.blinkStatus = False
+
+    def stitchedTable(self, header):
+        """Primary table of header and of the runs it resumes, in energy order"""
+        runs = []
+        for uid in header.start.get('resumed_from', []):
+            try:
+                _header = self.db[uid]
+                runs.append((_header.start, _header.table('primary')))
+            except Exception as e:
+                self.toLog("Run {} is not stitched : {}".format(uid[:8], e), color='red')
+
+        runs.append((header.start, header.table('primary')))
+
+        # Points measured again after a resume are taken from the later run
+        data = stitchTables(runs)
+
+        # Points of adaptive scans are not in energy order
+        return data.sort_values('dcm_energy', kind='mergesort')
 
     def subscribe_callback(self):
         """Subscribe AfterScanCallback"""
@@ -2004,20 +2696,24 @@ class Main(qt.QMainWindow):
         """Unsubscribe AfterScanCallback"""
         self.RE.unsubscribe(self.token)
 
-    def save_data(self):
+    def save_data(self, uid=None):
         '''
         export data to a txt file
+
+        :param uid : uid of the run, the last run if None
         '''
 
-        header = self.db[-1]
+        header = self.run_index.header(uid)
 
         meta_data = header.start
         scan_type = meta_data['scan_type']
         scan_mode = meta_data['scan_mode']
 
-        path = self.control.data_save_path.toPlainText()
+        # Settings of queued scans are in the metadata
+        path = meta_data.get('data_path', self.control.data_save_path.toPlainText())
         if scan_type == 'measure':
-            filename = self.control.filename_edit.text()
+            filename = meta_data.get('sample_name',
+                                     meta_data.get('filename', self.control.filename_edit.text()))
         else:
             filename = self.control.ecal_filename_edit.text()
 
@@ -2054,9 +2750,10 @@ class Main(qt.QMainWindow):
             if scan_type in ('measure'):
                 file.write('Scanning Mode : ')
 
-                if self.control.run_type.currentIndex() == 0:
+                run_type = meta_data.get('run_type', self.control.run_type.currentIndex())
+                if run_type == 0:
                     scan_mode = 'Step-Scan'
-                elif self.control.run_type.currentIndex() == 2:
+                elif run_type == 2:
                     scan_mode = 'Fly-Scan'
                 else:
                     scan_mode = 'Multi-Scan'
@@ -2080,10 +2777,10 @@ class Main(qt.QMainWindow):
             file.write(start_time.strftime('%Y-%m-%d %H:%M:%S') + ' ~ ' + stop_time.strftime('%H:%M:%S') +'\t')
 
             file.write('Energy Origin(E0) : ')
-            file.write(str(self.control.edit_E0.value()) + '\t')
+            file.write(str(meta_data.get('E0', self.control.edit_E0.value())) + '\t')
 
             file.write('Mono Offset(deg) : ')
-            file.write(self.control.E0_offset.text() + '\t')
+            file.write(str(meta_data.get('monoOffset', self.control.E0_offset.text())) + '\t')
 
             # Scan time in minutes
             scan_time = (end_time - header.start['time']) / 60
@@ -2100,39 +2797,18 @@ class Main(qt.QMainWindow):
             file.write('SR Injection mode : Top-up\n')
 
             # 4th line
-            file.write('Description : {}\n'.format(self.control.description_edit.toPlainText()
-                                                                                .replace('\n', ' ')))
+            description = meta_data.get('description', self.control.description_edit.toPlainText())
+            file.write('Description : {}\n'.format(description.replace('\n', ' ')))
 
             scan_mode = meta_data['scan_mode']
             # Save SRB settings
             if scan_type == 'measure' and scan_mode == 'normal':
-                eList=EnergyScanList(SRB=[self.control.SRB_1.value(),
-                                            self.control.SRB_2.value(),
-                                            self.control.SRB_3.value(),
-                                            self.control.SRB_4.value(),
-                                            self.control.SRB_5.value(),
-                                            self.control.SRB_6.value()],
-                                    eMode=[self.control.eMode_bar_1.value()!=1000,
-                                            self.control.eMode_bar_2.value()!=1000,
-                                            self.control.eMode_bar_3.value()!=1000,
-                                            self.control.eMode_bar_4.value()!=1000,
-                                            self.control.eMode_bar_5.value()!=1000,
-                                            self.control.eMode_bar_6.value()!=1000],
-                                    StepSize=[self.control.stepSize_1.value(),
-                                                self.control.stepSize_2.value(),
-                                                self.control.stepSize_3.value(),
-                                                self.control.stepSize_4.value(),
-                                                self.control.stepSize_5.value()],
-                                    SRBOnOff=[self.control.SRBOnOff_1.isChecked(),
-                                                self.control.SRBOnOff_2.isChecked(),
-                                                self.control.SRBOnOff_3.isChecked(),
-                                                self.control.SRBOnOff_4.isChecked(),
-                                                self.control.SRBOnOff_5.isChecked()],
-                                    Time=[self.control.SRB_time_1.value(),
-                                            self.control.SRB_time_2.value(),
-                                            self.control.SRB_time_3.value(),
-                                            self.control.SRB_time_4.value(),
-                                            self.control.SRB_time_5.value()])
+                if meta_data.get('regions'):
+                    eList = self.makeEnergyScanList(meta_data['regions'])
+                elif 'region_settings' in meta_data:
+                    eList = EnergyScanList(**meta_data['region_settings'])
+                else:
+                    eList = self.makeEnergyScanList()
 
                 # 5th line
                 text_srb = 'SRB := '
@@ -2239,7 +2915,8 @@ class Main(qt.QMainWindow):
 
         # Retrieve scan data
         if scan_type == 'measure' and scan_mode == 'normal':
-            data = header.table('primary')
+            # Including the interrupted runs of a resumed scan
+            data = self.stitchedTable(header)
             # compensate dark current
             data['I0'] = data['I0'] - meta_data['darkI0'] * data['scaler_time']
             data['It'] = data['It'] - meta_data['darkIt'] * data['scaler_time']
@@ -2267,7 +2944,7 @@ class Main(qt.QMainWindow):
 
         elif scan_type == 'measure' and scan_mode == 'fly':
             try:
-                data_orig = header.table('primary')
+                data_orig = load_fly_table(header)
                 meta_data = header.start
 
                 # Convert encoder to energy
@@ -2287,6 +2964,9 @@ class Main(qt.QMainWindow):
                                       'If'                    : np.array(data_orig.If),
                                       'Ir'                    : np.array(data_orig.Ir)})
 
+                # Bidirectional sweeps are saved in increasing energy
+                data = data.sort_values('dcm_energy', kind='mergesort')
+
             except:
                 data = None
 
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time as ttime
+
+from ophyd.status import DeviceStatus
+
+logger = logging.getLogger(__name__)
+
+
+class _Watch:
+    """Subscriptions and timers of a status, released when it is finished"""
+    def __init__(self, status):
+        self.status = status
+        self.lock = threading.RLock()
+        self.subs = []
+        self.timers = []
+
+    def finish(self, success):
+        with self.lock:
+            if not self.status.done:
+                self.status._finished(success=success)
+
+    def subscribe(self, signal, callback, run=False):
+        self.subs.append((signal, callback))
+        signal.subscribe(callback, run=run)
+
+    def start_timer(self, interval, function):
+        with self.lock:
+            if self.status.done:
+                return None
+            self.timers = [timer for timer in self.timers if timer.is_alive()]
+            timer = threading.Timer(interval, function)
+            timer.daemon = True
+            self.timers.append(timer)
+            timer.start()
+            return timer
+
+    # Finished by the signals, timeout or stall, always unsubscribe
+    def cleanup(self, status):
+        for signal, callback in self.subs:
+            signal.clear_sub(callback)
+        with self.lock:
+            for timer in self.timers:
+                timer.cancel()
+
+
+def done_move_status(device, done_signal, *, readback=None, target=None, tolerance=1e-4,
+                     settle_time=0.5, timeout=None, stall_time=None):
+    """Status which is finished by a monitor on a done-moving signal
+
+    The status is finished when ``done_signal`` goes back to 1 after it has
+    been seen at 0, so it should be created before the motion is started.
+    A move to the current position may never clear done_signal, so when
+    ``target`` is given and done_signal has stayed at 1 for settle_time
+    with readback at target, the status is finished as well.
+    Any ophyd signal can be used, e.g. ``ophyd.sim.SynSignal`` for testing.
+
+    Parameters
+    ----------
+    device : Device
+        the device that owns the status
+    done_signal : Signal
+        '1' : done moving, '0' : moving
+    readback : Signal, optional
+        position readback used for stall and zero-length move detection
+    target : float, optional
+        target position of the move, in readback units
+    tolerance : float
+        readback distance from target accepted as at target
+    settle_time : float
+        wait before checking for a zero-length move [sec]
+    timeout : float, optional
+        fail the status when the motion is not done within timeout [sec]
+    stall_time : float, optional
+        fail the status when readback does not change for stall_time [sec]
+    """
+    status = DeviceStatus(device, timeout=timeout)
+    watch = _Watch(status)
+    state = {'moving': False, 'last_change': ttime.time()}
+
+    def on_done_move(value, **kwargs):
+        if value == 0:
+            state['moving'] = True
+            state['last_change'] = ttime.time()
+        elif state['moving']:
+            watch.finish(True)
+
+    def on_readback(value, old_value=None, **kwargs):
+        if value != old_value:
+            state['last_change'] = ttime.time()
+
+    def check_stall():
+        if status.done:
+            return
+
+        if ttime.time() - state['last_change'] > stall_time:
+            logger.error("{} : motion stalled for {} sec".format(device.name, stall_time))
+            watch.finish(False)
+            return
+
+        watch.start_timer(stall_time / 2., check_stall)
+
+    def check_zero_move():
+        if state['moving'] or status.done:
+            return
+
+        if done_signal.get() == 1 and abs(readback.get() - target) <= tolerance:
+            watch.finish(True)
+
+    watch.subscribe(done_signal, on_done_move)
+
+    if readback is not None:
+        if stall_time is not None:
+            watch.subscribe(readback, on_readback)
+            watch.start_timer(stall_time / 2., check_stall)
+
+        if target is not None:
+            watch.start_timer(settle_time, check_zero_move)
+
+    status.add_callback(watch.cleanup)
+
+    return status
+
+
+def done_signals(positioner):
+    """Done-moving (DMOV) signals of a positioner or of its real positioners"""
+    if hasattr(positioner, 'motor_done_move'):
+        return [positioner.motor_done_move]
+
+    if hasattr(positioner, 'real_positioners'):
+        return [signal for real in positioner.real_positioners for signal in done_signals(real)]
+
+    # PseudoSingle of a PseudoPositioner
+    parent = getattr(positioner, 'parent', None)
+    if parent is not None and hasattr(parent, 'real_positioners'):
+        return done_signals(parent)
+
+    return []
+
+
+def stopped_status(device, signals, *, debounce=0.1, timeout=None):
+    """Status which is finished when all done signals stay at 1 for debounce
+
+    The status is finished within debounce when the motors are already
+    stopped, so it can be created at any time.
+
+    Parameters
+    ----------
+    device : Device
+        the device that owns the status
+    signals : list of Signal
+        '1' : done moving, '0' : moving, see done_signals
+    debounce : float
+        time the signals should stay at 1 [sec]
+    timeout : float, optional
+        fail the status when the motors do not stop within timeout [sec]
+    """
+    status = DeviceStatus(device, timeout=timeout)
+    watch = _Watch(status)
+    state = {'values': [None] * len(signals), 'timer': None}
+
+    def check():
+        with watch.lock:
+            if all(value == 1 for value in state['values']):
+                watch.finish(True)
+
+    def make_callback(index):
+        def on_done_move(value, **kwargs):
+            with watch.lock:
+                state['values'][index] = value
+
+                if state['timer'] is not None:
+                    state['timer'].cancel()
+                    state['timer'] = None
+
+                if all(value == 1 for value in state['values']):
+                    state['timer'] = watch.start_timer(debounce, check)
+
+        return on_done_move
+
+    for index, signal in enumerate(signals):
+        watch.subscribe(signal, make_callback(index), run=True)
+
+    status.add_callback(watch.cleanup)
+
+    return status
+
+
+class StoppedWait:
+    """Triggerable whose trigger status is a stopped_status of a positioner
+
+    Lets a plan wait for the motors to stop through the RunEngine, e.g.
+    ``yield from bps.trigger(StoppedWait(dcm), wait=True)``.
+
+    Parameters
+    ----------
+    positioner : positioner with done-moving signals, see done_signals
+    debounce : float
+        time the motors should stay stopped [sec]
+    timeout : float, optional
+        fail the status when the motors do not stop within timeout [sec]
+    """
+    def __init__(self, positioner, *, debounce=0.1, timeout=None):
+        self.positioner = positioner
+        self.name = positioner.name + '_stopped'
+        self.parent = None
+        self.debounce = debounce
+        self.timeout = timeout
+
+    def trigger(self):
+        return stopped_status(self.positioner, done_signals(self.positioner),
+                              debounce=self.debounce, timeout=self.timeout)
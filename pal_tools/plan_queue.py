@@ -0,0 +1,250 @@
+import json
+import logging
+import itertools
+import threading
+from collections import deque
+
+from bluesky.utils import RunEngineInterrupted, SigintHandler, default_during_task
+
+logger = logging.getLogger(__name__)
+
+
+def during_task(blocking_event):
+    """
+    during_task of a RunEngine driven by PlanQueue
+
+    The default of bluesky runs a Qt event loop and sets the wakeup fd of
+    signals, both only work on the main thread. RE() on the worker thread
+    just waits, RE() on the main thread keeps the default.
+    """
+    if threading.current_thread() is threading.main_thread():
+        default_during_task(blocking_event)
+    else:
+        blocking_event.wait()
+
+
+class QueueItem:
+    """
+    A plan or a RunEngine call waiting in PlanQueue
+
+    Parameters
+    ----------
+    func : callable executed on the worker thread
+    name : name shown in the queue state
+    control : True for calls allowed while the RunEngine is paused, e.g. RE.resume
+    immediate : True for plans run ahead of the queued plans, e.g. GUI steps
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, func, name='', control=False, immediate=False):
+        self.id = next(self._ids)
+        self.func = func
+        self.name = name
+        self.control = control
+        self.immediate = immediate
+
+        self.state = 'queued'
+        self.uids = []
+        self.result = None
+        self.exception = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until finished, return True if finished"""
+        return self._done.wait(timeout)
+
+    def summary(self):
+        return {'id' : self.id, 'name' : self.name, 'state' : self.state}
+
+
+class PlanQueue:
+    """
+    Run plans one after another on a worker thread which owns the RunEngine
+
+    The next plan starts as soon as the previous one returns. Plans wait
+    while the RunEngine is paused, control calls (resume, abort) do not.
+    The queue state is published as 'Queue:<json>' on every change.
+
+    The RunEngine should be created with during_task=during_task.
+
+    Parameters
+    ----------
+    RE : RunEngine
+    publish : callable, publish(text), called from the worker thread
+    finished : callable, finished(item), called from the worker thread when
+               an item is finished, e.g. the emit of a Qt signal
+    """
+    def __init__(self, RE, publish=None, finished=None):
+        self.RE = RE
+        self.publish = publish
+        self.finished = finished
+
+        # Signal handlers can only be installed on the main thread
+        RE.context_managers = [mgr for mgr in RE.context_managers if mgr is not SigintHandler]
+
+        if getattr(RE, '_during_task', during_task) is not during_task:
+            logger.warning("PlanQueue : the RunEngine should use plan_queue.during_task")
+
+        self._items = deque()
+        self._current = None
+        self._stop = False
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, name='plan-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, plan, subs=None, name='', immediate=False, **md):
+        """
+        Queue a plan, return the QueueItem
+
+        Callable values of md are evaluated when the plan starts. The uids
+        of the runs are collected in item.uids as the runs start. Immediate
+        plans run after the control calls and the running plan, before the
+        other queued plans.
+        """
+        item = QueueItem(None, name=name or getattr(plan, '__name__', 'plan'),
+                         immediate=immediate)
+
+        def record(name, doc):
+            item.uids.append(doc['uid'])
+
+        def func():
+            _md = {key : value() if callable(value) else value for key, value in md.items()}
+            token = self.RE.subscribe(record, 'start')
+            try:
+                if subs:
+                    return self.RE(plan, subs, **_md)
+                return self.RE(plan, **_md)
+            finally:
+                self.RE.unsubscribe(token)
+
+        item.func = func
+        return self._put(item)
+
+    def call(self, func, name=''):
+        """Queue a RunEngine call ahead of the plans, e.g. RE.resume"""
+        return self._put(QueueItem(func, name=name or func.__name__, control=True), first=True)
+
+    def remove(self, item_id):
+        """Remove a queued item, return True if removed"""
+        with self._cond:
+            for item in list(self._items):
+                if item.id == item_id:
+                    self._items.remove(item)
+                    self._finish(item, 'removed')
+                    break
+            else:
+                return False
+
+        self._publish()
+        return True
+
+    def clear(self):
+        """Remove all queued plans, return the number of removed plans"""
+        with self._cond:
+            items = [item for item in self._items if not item.control]
+            for item in items:
+                self._items.remove(item)
+                self._finish(item, 'removed')
+
+        self._publish()
+        return len(items)
+
+    def state(self):
+        """Running and queued items as dict"""
+        with self._cond:
+            return {'running' : self._current.summary() if self._current else None,
+                    'queued' : [item.summary() for item in self._items],
+                    'paused' : self.RE.state == 'paused'}
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def stop(self):
+        """Stop the worker after the running item"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def _put(self, item, first=False):
+        with self._cond:
+            if first:
+                self._items.appendleft(item)
+            elif item.immediate:
+                # After the control calls and the immediate plans queued before
+                index = 0
+                while index < len(self._items) and \
+                        (self._items[index].control or self._items[index].immediate):
+                    index += 1
+                self._items.insert(index, item)
+            else:
+                self._items.append(item)
+            self._cond.notify_all()
+
+        self._publish()
+        return item
+
+    def _next(self):
+        for item in self._items:
+            if item.control or self.RE.state == 'idle':
+                return item
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                item = self._next()
+                while item is None and not self._stop:
+                    # Poll the pause state of the RunEngine
+                    self._cond.wait(0.5)
+                    item = self._next()
+
+                if self._stop:
+                    return
+
+                self._items.remove(item)
+                self._current = item
+                item.state = 'running'
+
+            self._publish()
+
+            try:
+                item.result = item.func()
+                state = 'done'
+            except RunEngineInterrupted as e:
+                item.exception = e
+                state = 'paused'
+            except Exception as e:
+                logger.exception("PlanQueue : %s failed", item.name)
+                item.exception = e
+                state = 'failed'
+
+            with self._cond:
+                self._current = None
+                self._finish(item, state)
+
+            self._publish()
+
+            if self.finished is not None:
+                try:
+                    self.finished(item)
+                except Exception as e:
+                    logger.warning("PlanQueue finished : {}".format(e))
+
+    def _finish(self, item, state):
+        item.state = state
+        item._done.set()
+
+    def _publish(self):
+        if self.publish is None:
+            return
+
+        try:
+            self.publish('Queue:' + json.dumps(self.state()))
+        except Exception as e:
+            logger.warning("PlanQueue publish : {}".format(e))
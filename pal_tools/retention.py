@@ -0,0 +1,161 @@
+import os
+import logging
+import threading
+import time as ttime
+
+from pymongo import ASCENDING
+
+from run_index import ensureIndexes
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """
+    Delete runs older than the retention time on a background thread
+
+    Runs are deleted as a whole, run_start with its run_stop, descriptors,
+    events, resources and datums, and the asset files of the resources
+    below asset_root. Run documents are found by the indexes on time,
+    run_start, descriptor and resource, resources by the run_start field
+    added by the RunEngine.
+
+    Parameters
+    ----------
+    client : MongoClient
+    days : retention time [day]
+    interval : hours between prunes, 0 to prune once
+    metadatastore : database name of the run documents
+    filestore : database name of the resources and datums
+    asset_root : asset files below asset_root are deleted, None to keep files
+    batch_size : number of runs deleted at a time
+    report : callable, report(text), called with the summary of each prune
+    """
+    def __init__(self, client, days=7, interval=24, metadatastore='metadatastore_production_v1',
+                 filestore='filestore', asset_root=None, batch_size=100, report=None):
+        self.client = client
+        self.days = days
+        self.interval = interval
+        self.metadatastore = client[metadatastore]
+        self.filestore = client[filestore]
+        self.asset_root = os.path.abspath(asset_root) if asset_root else None
+        self.batch_size = batch_size
+        self.report = report
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start pruning in the background"""
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.prune()
+            except Exception as e:
+                logger.exception("RetentionManager : prune failed")
+                self._report("Error during pruning mongodb : {}".format(e))
+
+            if not self.interval or self._stop.wait(self.interval * 3600):
+                break
+
+    def ensureIndexes(self):
+        """Indexes used to find the documents of a run"""
+        ensureIndexes(self.metadatastore)
+        self.metadatastore['run_stop'].create_index([('run_start', ASCENDING)])
+        self.metadatastore['event_descriptor'].create_index([('run_start', ASCENDING)])
+        self.metadatastore['event'].create_index([('descriptor', ASCENDING)])
+        self.filestore['resource'].create_index([('run_start', ASCENDING)])
+        self.filestore['datum'].create_index([('resource', ASCENDING)])
+
+    def prune(self, now=None):
+        """
+        Delete runs started before now - days
+
+        return dict of the number of deleted documents and files
+        """
+        cutoff = (now or ttime.time()) - self.days * 24 * 3600
+        counts = dict.fromkeys(['run_start', 'run_stop', 'event_descriptor', 'event',
+                                'resource', 'datum', 'files'], 0)
+
+        self.ensureIndexes()
+
+        run_start = self.metadatastore['run_start']
+        while not self._stop.is_set():
+            uids = [doc['uid'] for doc in run_start.find({'time' : {'$lt' : cutoff}}, {'uid' : 1})
+                                                    .sort('time', ASCENDING)
+                                                    .limit(self.batch_size)]
+            if not len(uids):
+                break
+
+            deleted = self._deleteRuns(uids)
+            for key, value in deleted.items():
+                counts[key] += value
+
+            if not deleted['run_start']:
+                break
+
+        self._report("Pruned runs before {} : {}".format(
+                     ttime.strftime('%Y-%m-%d %H:%M', ttime.localtime(cutoff)),
+                     ', '.join('{} {}'.format(value, key) for key, value in counts.items())))
+
+        return counts
+
+    def _deleteRuns(self, uids):
+        mds = self.metadatastore
+        fs = self.filestore
+        counts = {}
+
+        descriptors = [doc['uid'] for doc in mds['event_descriptor'].find(
+                                                {'run_start' : {'$in' : uids}}, {'uid' : 1})]
+        resources = list(fs['resource'].find({'run_start' : {'$in' : uids}},
+                                             {'uid' : 1, 'root' : 1, 'resource_path' : 1}))
+        resource_uids = [doc['uid'] for doc in resources]
+
+        # Children first, so an interrupted prune leaves findable runs
+        counts['event'] = mds['event'].delete_many(
+                            {'descriptor' : {'$in' : descriptors}}).deleted_count
+        counts['datum'] = fs['datum'].delete_many(
+                            {'resource' : {'$in' : resource_uids}}).deleted_count
+        counts['files'] = self._deleteFiles(resources)
+        counts['resource'] = fs['resource'].delete_many(
+                            {'uid' : {'$in' : resource_uids}}).deleted_count
+        counts['event_descriptor'] = mds['event_descriptor'].delete_many(
+                            {'uid' : {'$in' : descriptors}}).deleted_count
+        counts['run_stop'] = mds['run_stop'].delete_many(
+                            {'run_start' : {'$in' : uids}}).deleted_count
+        counts['run_start'] = mds['run_start'].delete_many(
+                            {'uid' : {'$in' : uids}}).deleted_count
+
+        return counts
+
+    def _deleteFiles(self, resources):
+        """Delete asset files below asset_root, return the number of deleted files"""
+        if self.asset_root is None:
+            return 0
+
+        num_deleted = 0
+        for doc in resources:
+            filename = os.path.abspath(os.path.join(doc.get('root', ''), doc.get('resource_path', '')))
+            if os.path.commonpath([self.asset_root, filename]) != self.asset_root:
+                continue
+
+            try:
+                os.remove(filename)
+                num_deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("RetentionManager : {}".format(e))
+
+        return num_deleted
+
+    def _report(self, text):
+        logger.info(text)
+        if self.report is not None:
+            self.report(text)
@@ -0,0 +1,113 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from pymongo import ASCENDING, DESCENDING
+from bluesky.callbacks.core import CallbackBase
+
+logger = logging.getLogger(__name__)
+
+
+def ensureIndexes(database):
+    """
+    Create the indexes of run lookups by scan_type and time
+
+    Parameters
+    ----------
+    database : pymongo database of the metadatastore
+    """
+    run_start = database['run_start']
+    run_start.create_index([('time', DESCENDING)])
+    run_start.create_index([('scan_type', ASCENDING), ('time', DESCENDING)])
+
+
+class RunIndex(CallbackBase):
+    """
+    In-memory index of the runs started by the RunEngine
+
+    The uid, scan_type, time and exit status of the last maxlen runs are
+    kept in start order, so the last run of a scan_type is found without
+    searching the databroker and without racing other runs.
+
+    Parameters
+    ----------
+    db : databroker v1 Broker used by header()
+    maxlen : number of runs to keep
+    """
+    def __init__(self, db=None, maxlen=1000):
+        super().__init__()
+        self.db = db
+        self.maxlen = maxlen
+
+        self._runs = OrderedDict()
+        self._by_type = {}
+        self._lock = threading.Lock()
+
+    def start(self, doc):
+        run = {'uid' : doc['uid'],
+               'scan_type' : doc.get('scan_type'),
+               'time' : doc['time'],
+               'exit_status' : None}
+
+        with self._lock:
+            self._runs[run['uid']] = run
+            self._by_type.setdefault(run['scan_type'], deque()).append(run['uid'])
+
+            # The oldest run is also the oldest of its scan_type
+            while len(self._runs) > self.maxlen:
+                _, old = self._runs.popitem(last=False)
+                self._by_type[old['scan_type']].popleft()
+
+    def stop(self, doc):
+        with self._lock:
+            run = self._runs.get(doc['run_start'])
+            if run is not None:
+                run['exit_status'] = doc.get('exit_status')
+
+    def last(self, scan_type=None):
+        """uid of the last run of scan_type, all runs if None, None if not found"""
+        with self._lock:
+            if scan_type is None:
+                return next(reversed(self._runs), None)
+
+            uids = self._by_type.get(scan_type)
+            return uids[-1] if uids else None
+
+    def uids(self, scan_type=None, since=None):
+        """uids of scan_type started after since (unix time), newest first"""
+        with self._lock:
+            if scan_type is None:
+                uids = list(self._runs)
+            else:
+                uids = list(self._by_type.get(scan_type, []))
+
+            if since is not None:
+                uids = [uid for uid in uids if self._runs[uid]['time'] >= since]
+
+        return uids[::-1]
+
+    def get(self, uid):
+        """Indexed fields of a run, None if not indexed"""
+        with self._lock:
+            run = self._runs.get(uid)
+            return dict(run) if run is not None else None
+
+    def header(self, uid=None, scan_type=None):
+        """
+        Header of uid or of the last run of scan_type
+
+        Runs started before this index are searched in the databroker.
+        """
+        if uid is None:
+            uid = self.last(scan_type)
+
+        if uid is not None:
+            return self.db[uid]
+
+        if scan_type is None:
+            return self.db[-1]
+
+        for header in self.db(scan_type=scan_type):
+            return header
+
+        raise KeyError("No run of scan_type {}".format(scan_type))
@@ -298,6 +298,77 @@ class ScanControlWidget(qt.QMainWindow):
         self.use_batch_checkbox.setText('Batch Scan')
         self.use_batch_checkbox.setDisabled(True)
 
+        self.snap_to_encoder_checkbox = qt.QCheckBox(self)
+        self.snap_to_encoder_checkbox.setMinimumHeight(30)
+        self.snap_to_encoder_checkbox.setMaximumHeight(30)
+        self.snap_to_encoder_checkbox.setText('Snap to Encoder')
+        self.snap_to_encoder_checkbox.setToolTip('Snap step-scan energies to mono encoder '
+                                                 'positions and remove duplicates')
+        self.snap_to_encoder_checkbox.setChecked(False)
+
+        self.pipeline_checkbox = qt.QCheckBox(self)
+        self.pipeline_checkbox.setMinimumHeight(30)
+        self.pipeline_checkbox.setMaximumHeight(30)
+        self.pipeline_checkbox.setText('Pipelined Steps')
+        self.pipeline_checkbox.setToolTip('Move to the next point while the scaler is read')
+        self.pipeline_checkbox.setChecked(False)
+
+        self.settle_checkbox = qt.QCheckBox(self)
+        self.settle_checkbox.setMinimumHeight(30)
+        self.settle_checkbox.setMaximumHeight(30)
+        self.settle_checkbox.setText('Settle Detection')
+        self.settle_checkbox.setToolTip('Count when theta is stable, '
+                                        'the step delay time is the maximum wait')
+        self.settle_checkbox.setChecked(False)
+
+        self.dwell_mode = ComboBoxAligned(self)
+        self.dwell_mode.setMinimumSize(qt.QSize(_controlWidth, 30))
+        self.dwell_mode.setMaximumSize(qt.QSize(_controlWidth, 30))
+        self.dwell_mode.addItems(["Fixed", "Adaptive (Trans.)", "Adaptive (Fluo.)"])
+        self.dwell_mode.setToolTip('Count time of each point for the target error of mu, '
+                                   'the region time is the maximum')
+
+        self.dwell_error_edit = qt.QDoubleSpinBox(self)
+        self.dwell_error_edit.setMinimumSize(qt.QSize(_controlWidth, 30))
+        self.dwell_error_edit.setMaximumSize(qt.QSize(_controlWidth, 30))
+        self.dwell_error_edit.setAlignment(qt.Qt.AlignCenter)
+        self.dwell_error_edit.setDecimals(3)
+        self.dwell_error_edit.setMinimum(0.001)
+        self.dwell_error_edit.setMaximum(100.0)
+        self.dwell_error_edit.setSingleStep(0.01)
+        self.dwell_error_edit.setProperty("value", 0.1)
+
+        self.dwell_min_edit = qt.QDoubleSpinBox(self)
+        self.dwell_min_edit.setMinimumSize(qt.QSize(_controlWidth, 30))
+        self.dwell_min_edit.setMaximumSize(qt.QSize(_controlWidth, 30))
+        self.dwell_min_edit.setAlignment(qt.Qt.AlignCenter)
+        self.dwell_min_edit.setDecimals(1)
+        self.dwell_min_edit.setMinimum(0.1)
+        self.dwell_min_edit.setMaximum(10000000.0)
+        self.dwell_min_edit.setSingleStep(0.1)
+        self.dwell_min_edit.setProperty("value", 0.1)
+
+        self.est_time_label = qt.QLabel(self)
+        self.est_time_label.setMinimumSize(qt.QSize(90, 30))
+        self.est_time_label.setMaximumSize(qt.QSize(90, 30))
+        self.est_time_label.setAlignment(qt.Qt.AlignCenter)
+        self.est_time_label.setFrameShape(qt.QFrame.Panel)
+        self.est_time_label.setFrameShadow(qt.QFrame.Sunken)
+        self.est_time_label.setText("-")
+        self.est_time_label.setToolTip('Estimated remaining time of the step scans')
+
+        self.estimate_button = qt.QPushButton(self)
+        self.estimate_button.setMinimumSize(qt.QSize(60, 30))
+        self.estimate_button.setMaximumSize(qt.QSize(60, 30))
+        self.estimate_button.setText("Est.")
+
+        self.save_regions_button = qt.QPushButton(self)
+        self.save_regions_button.setMinimumSize(qt.QSize(100, 30))
+        self.save_regions_button.setMaximumSize(qt.QSize(100, 30))
+        self.save_regions_button.setText("Save Regions")
+        self.save_regions_button.setToolTip('Save the regions under a name '
+                                            'for the Regions column of the sample table')
+
         self.number_of_scan_edit = qt.QDoubleSpinBox(self)
         self.number_of_scan_edit.setMinimumSize(qt.QSize(_controlWidth, 30))
         self.number_of_scan_edit.setMaximumSize(qt.QSize(_controlWidth, 30))
@@ -572,6 +643,33 @@ class ScanControlWidget(qt.QMainWindow):
         self.run_start.setText("Run")
         self.run_start.setFont(bigBoldFont)
 
+        self.resumeScanButton = qt.QPushButton(self)
+        self.resumeScanButton.setMinimumSize(qt.QSize(130, 50))
+        self.resumeScanButton.setMaximumSize(qt.QSize(130, 50))
+        self.resumeScanButton.setText("Resume Scan")
+        self.resumeScanButton.setFont(bigBoldFont)
+        self.resumeScanButton.setToolTip('Continue the interrupted step scan '
+                                         'from the next unmeasured point')
+
+        self.enqueueButton = qt.QPushButton(self)
+        self.enqueueButton.setMinimumSize(qt.QSize(100, 30))
+        self.enqueueButton.setMaximumSize(qt.QSize(100, 30))
+        self.enqueueButton.setText("Enqueue")
+        self.enqueueButton.setToolTip('Queue a step scan of the current settings, '
+                                      'it starts when the running scans are finished')
+
+        self.clearQueueButton = qt.QPushButton(self)
+        self.clearQueueButton.setMinimumSize(qt.QSize(100, 30))
+        self.clearQueueButton.setMaximumSize(qt.QSize(100, 30))
+        self.clearQueueButton.setText("Clear Queue")
+
+        self.queue_label = qt.QLabel(self)
+        self.queue_label.setMinimumSize(qt.QSize(200, 30))
+        self.queue_label.setAlignment(qt.Qt.AlignCenter)
+        self.queue_label.setFrameShape(qt.QFrame.Panel)
+        self.queue_label.setFrameShadow(qt.QFrame.Sunken)
+        self.queue_label.setText("Queue : empty")
+
         # self.resumeButton = qt.QPushButton(self)
         # self.resumeButton.setMinimumSize(qt.QSize(130, 50))
         # self.resumeButton.setMaximumSize(qt.QSize(130, 50))
@@ -1032,7 +1130,9 @@ class ScanControlWidget(qt.QMainWindow):
         self.energyScanWidget.layout().addWidget(dataFileGB)
 
         self.energyScanWidget.layout().addWidget(addWidgets(
-            [self.run_start, self.abortButton], align='uniform'))
+            [self.run_start, self.resumeScanButton, self.abortButton], align='uniform'))
+        self.energyScanWidget.layout().addWidget(addWidgets(
+            [self.queue_label, self.enqueueButton, self.clearQueueButton], align='right'))
 
         self.energyScanWidget.layout().addStretch()
 
@@ -1053,9 +1153,18 @@ class ScanControlWidget(qt.QMainWindow):
         scanTypeGB.layout().setLabelAlignment(qt.Qt.AlignRight)
         scanTypeGB.layout().setFormAlignment(qt.Qt.AlignRight)
         scanTypeGB.layout().addRow('', self.use_batch_checkbox)
+        scanTypeGB.layout().addRow('', self.snap_to_encoder_checkbox)
+        scanTypeGB.layout().addRow('', self.pipeline_checkbox)
+        scanTypeGB.layout().addRow('', self.settle_checkbox)
         scanTypeGB.layout().addRow('Step Delay Time [ms]', self.edit_delay_time)
         scanTypeGB.layout().addRow('Scan Type', self.run_type)
         scanTypeGB.layout().addRow('Scan Number', self.number_of_scan_edit)
+        scanTypeGB.layout().addRow('Dwell Time', self.dwell_mode)
+        scanTypeGB.layout().addRow('Target Error [%]', self.dwell_error_edit)
+        scanTypeGB.layout().addRow('Min. Dwell [s]', self.dwell_min_edit)
+        scanTypeGB.layout().addRow('Scan Time', addWidgets([self.est_time_label,
+                                                            self.estimate_button],
+                                                           align='right'))
         scanTypeGB.layout().addRow(qt.QLabel())
         scanTypeGB.layout().addRow('SiMode', self.comboBox_Si_mode)
         scanTypeGB.layout().addRow('Mono Offset [Deg.]', self.E0_offset)
@@ -1125,6 +1234,7 @@ class ScanControlWidget(qt.QMainWindow):
         timeGB.layout().addStretch()
         timeGB.layout().setAlignment(qt.Qt.AlignCenter)
         scanSetupGB.layout().addWidget(timeGB)
+        scanSetupGB.layout().addWidget(addStretchWidget(self.save_regions_button))
 
         ampGB = qt.QGroupBox("Amplifier", gainDarkCurrentGB)
         ampGB.setLayout(qt.QVBoxLayout())
@@ -1,3 +1,5 @@
+import os
+import json
 import time as ttime
 import numpy as np
 import threading
@@ -13,7 +15,9 @@ from silx.gui import qt
 from silx.gui.utils.concurrent import submitToQtMainThread as _submit
 from bluesky.callbacks.core import CallbackBase
 
-from utils import derivative, loadPV
+from utils import derivative, loadPV, trimArrays
+from fly_hdf5 import load_fly_table
+from energy_grid import EnergyScanList
 
 logger = logging.getLogger(__name__)
 
@@ -302,7 +306,8 @@ class UpdatePlotThread(qt.QThread):
                         # Retrieve scan data
                         if scan_mode == 'normal':
                             try:
-                                data = run.primary.read()
+                                # Points of adaptive scans are not in energy order
+                                data = run.primary.read().sortby('dcm_energy')
                             except:
                                 # Do reset when there is no zoomed history
                                 resetzoom = len(self.parent.plot.getLimitsHistory()) == 0 and not self.parent.dragging
@@ -353,16 +358,11 @@ class UpdatePlotThread(qt.QThread):
 
                         elif scan_mode == 'fly':
 
-                            # header
-                            headers = self.parent.dbv1(scan_type='measure')
-
-                            for _idx, hd in enumerate(headers):
-                                header = hd
-                                if idx == _idx:
-                                    break
+                            # header of the same run
+                            header = self.parent.dbv1[meta_data['uid']]
 
                             if 'primary' in header.stream_names:
-                                data = header.table('primary')
+                                data = load_fly_table(header)
                                 meta_data = header.start
 
                                 # Convert encoder to energy
@@ -375,6 +375,9 @@ class UpdatePlotThread(qt.QThread):
                                 energy = _hc/(2.*_si_111*np.sin(np.deg2rad(scan_pos_th)))
                                 data['dcm_energy'] = energy
 
+                                # Sort each sweep, down-sweeps are measured in decreasing energy
+                                data = data.sort_values('dcm_energy', kind='mergesort')
+
                             else:
                                 # delay for monitor update
                                 ttime.sleep(0.2)
@@ -386,23 +389,17 @@ class UpdatePlotThread(qt.QThread):
                                 chan3   = np.array(self.IfPV.get())
                                 chan4   = np.array(self.IrPV.get())
 
-                                _arrayMinSize = int(min(enc_pos.size, chan1.size, chan2.size, chan3.size, chan4.size))
-
                                 # The arrays must be the same size
-                                if _arrayMinSize < enc_pos.size:
-                                    enc_pos = enc_pos[:_arrayMinSize]
-
-                                if _arrayMinSize < chan1.size:
-                                    chan1 = chan1[:_arrayMinSize]
-
-                                if _arrayMinSize < chan2.size:
-                                    chan2 = chan2[:_arrayMinSize]
-
-                                if _arrayMinSize < chan3.size:
-                                    chan3 = chan3[:_arrayMinSize]
-
-                                if _arrayMinSize < chan4.size:
-                                    chan4 = chan4[:_arrayMinSize]
+                                trimmed, _ = trimArrays({'ENC' : enc_pos,
+                                                         'I0'  : chan1,
+                                                         'It'  : chan2,
+                                                         'If'  : chan3,
+                                                         'Ir'  : chan4})
+                                enc_pos = trimmed['ENC']
+                                chan1   = trimmed['I0']
+                                chan2   = trimmed['It']
+                                chan3   = trimmed['If']
+                                chan4   = trimmed['Ir']
 
                                 # Load scan parameters
                                 enc_resolution = meta_data['enc_resolution']
@@ -418,6 +415,7 @@ class UpdatePlotThread(qt.QThread):
                                                      'It'            : chan2,
                                                      'If'            : chan3,
                                                      'Ir'            : chan4})
+                                data = data.sort_values('dcm_energy', kind='mergesort')
 
                         # Skip if DataFrame is empty
                         if not bool(int(data['dcm_energy'].count())):
@@ -762,109 +760,450 @@ class UpdatePlotThread(qt.QThread):
             # Set wait for events
             self.event.clear()
 
-class EnergyScanList:
-    """ make an E-Scan array """
-    def __init__(self, SRB=None, eMode=None, StepSize=None,\
-                 SRBOnOff=None, Time=None):
-
-        self.SRB = SRB
-        self.eMode = eMode
-        self.StepSize = StepSize
-        self.SRBOnOff = SRBOnOff
-        self.time_list = Time
-        self.energy_list = []
-        self.energy_start_points = []
-        self.makeArray()
-
-    def makeArray(self):
-        """ make an energy scan list """
-        for idx in range(len(self.SRB)-1):
-            active = self.SRBOnOff[idx]
-            eMode = self.eMode[idx]
-            eMode_next = self.eMode[idx+1]
-
-            if active:
-                if eMode and eMode_next:
-                    # Calculate energy list
-                    if len(self.energy_list):
-                        last_point = self.energy_list[-1][-1]
-                        last_step = self.StepSize[idx-1]
-
-                        # Check start point
-                        if last_point + last_step > self.SRB[idx]:
-                            last_point = last_point + self.StepSize[idx]
-
-                        item = np.arange(last_point,
-                                         self.SRB[idx+1],
-                                         self.StepSize[idx])
-
-                        # Check end point
-                        if np.isclose(item[-1] + self.StepSize[idx], self.SRB[idx+1]):
-                            item = np.append(item, self.SRB[idx+1])
-
-                    else:
-                        last_point = self.SRB[idx]
-                        item = np.arange(self.SRB[idx],
-                                         self.SRB[idx+1],
-                                         self.StepSize[idx])
-
-                        # Check end point
-                        if np.isclose(item[-1] + self.StepSize[idx], self.SRB[idx+1]):
-                            item = np.append(item, self.SRB[idx+1])
-
-                    # Save energy start points in eV
-                    self.energy_start_points.append(item[0])
-
-                    self.energy_list.append(np.round(item, 5))
-
-                elif not eMode and eMode_next:
-                    # Calculate energy list
-                    item = np.arange(self.energy_list[-1][-1],
-                                     self.SRB[idx+1],
-                                     self.StepSize[idx])
-                    self.energy_list.append(np.round(item, 5))
-
-                    # Save energy start points in eV
-                    self.energy_start_points.append(item[0])
-
-                else:
-                    if not len(self.energy_list):
-                        raise ValueError
-
-
-                    # Calculate energy list
-                    item = self.kMode(self.energy_list[-1][-1],
-                                      self.SRB[idx+1],
-                                      self.StepSize[idx])
-
-                    self.energy_list.append(np.round(item, 5))
-
-                    # Save energy start points in eV
-                    self.energy_start_points.append(item[0])
-
-        # End energy point in eV
-        self.energy_start_points.append(self.energy_list[-1][-1])
-
-        self.energy_list = np.array(self.energy_list, dtype=object)
-        self.time_list = self.time_list[:len(self.energy_list)]
-
-    def kMode(self, start_energy_eV, stop_energy_k, step_energy_k):
-        """ kMode energy list """
-        k_energy_list = []
-        a = np.sqrt(start_energy_eV) * 0.512
-        stop_energy_eV = (stop_energy_k/0.512)**2
-        N = 1
-
-        while True:
-            energy_eV = (((step_energy_k * N)+a)/0.512)**2
-
-            if (energy_eV >= stop_energy_eV):
+def quantizeEnergyList(energy_list, enc_resolution, offset=0.0):
+    """
+    Snap energies to theta positions of the mono encoder and merge duplicates
+
+    Encoder counts are in dial coordinates, theta_user = count * ERES + OFF.
+    Points that fall on an encoder count already in the grid are removed,
+    regions are kept in order so the time list still applies. ValueError is
+    raised when all points of a region are removed.
+
+    Parameters
+    ----------
+    energy_list : list of energy arrays in eV, one per region
+    enc_resolution : encoder resolution [deg.]
+    offset : theta user offset [deg.]
+
+    return (list of energy arrays, list of encoder counts)
+    """
+    seen = set()
+    energies = []
+    counts = []
+
+    for idx, item in enumerate(energy_list):
+        energy = np.asarray(item, dtype=float)
+        theta = np.rad2deg(np.arcsin(_hc/(2.*_si_111*energy)))
+        count = np.round((theta - offset) / enc_resolution).astype(np.int64)
+
+        # first occurrence in the region, in the scan order
+        _, index = np.unique(count, return_index=True)
+        index = [idx for idx in np.sort(index) if count[idx] not in seen]
+        count = count[index]
+        seen.update(count.tolist())
+
+        if len(energy) and not len(count):
+            raise ValueError("Region {} collapses to zero points at this "
+                             "encoder resolution".format(idx+1))
+
+        theta = count * enc_resolution + offset
+        energies.append(_hc/(2.*_si_111*np.sin(np.deg2rad(theta))))
+        counts.append(count)
+
+    return energies, counts
+
+def formatDuration(seconds):
+    """seconds to 'h:mm:ss'"""
+    seconds = int(round(max(seconds, 0)))
+    return '{:d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class OverheadModel:
+    """
+    Time model of step scans
+
+    A point takes a + b * |dE| + delay_time + count time. a is the fixed
+    overhead of a point (move, readout, event) and b the move time per eV.
+    A scan adds waitTime, the move to -200 eV and back with sleep(2) and
+    sleep(1) before the first point, and the move back to E0.
+
+    Parameters
+    ----------
+    a : overhead per point [sec]
+    b : move time per eV [sec/eV]
+    """
+    pre_move = 200.
+    pre_sleep = 3.
+
+    def __init__(self, a=0.3, b=0.01):
+        self.a = a
+        self.b = b
+        self.num_points = 0
+
+    def fit(self, headers, max_runs=5):
+        """
+        Fit a and b to the event timestamps of past step scans
+
+        Parameters
+        ----------
+        headers : databroker v1 headers, newest first
+        max_runs : number of runs to use, skipped runs are not counted
+
+        return True if fitted
+        """
+        dE = []
+        overhead = []
+        for header in headers:
+            if len(dE) >= max_runs:
                 break
 
-            k_energy_list.append(energy_eV)
-            N += 1
+            try:
+                if header.start.get('scan_mode') != 'normal' or header.stop is None:
+                    continue
+
+                data = header.table('primary', convert_times=False)
+                if len(data) < 3:
+                    continue
+
+                delay = header.start.get('delay_after_set_energy', 0)
+                dt = np.diff(data['time'].values)
+                count_time = data['scaler_time'].values[1:]
+
+                dE.append(np.abs(np.diff(data['dcm_energy'].values)))
+                overhead.append(dt - delay - count_time)
+
+            except Exception as e:
+                logger.debug("OverheadModel.fit : {}".format(e))
+
+        if not len(dE):
+            return False
+
+        dE = np.concatenate(dE)
+        overhead = np.concatenate(overhead)
+
+        # Drop pauses and interruptions
+        valid = (overhead > 0) & (overhead < 10 * np.median(overhead) + 1)
+        if np.count_nonzero(valid) < 3:
+            return False
+
+        A = np.vstack([np.ones(np.count_nonzero(valid)), dE[valid]]).T
+        (a, b), *_ = np.linalg.lstsq(A, overhead[valid], rcond=None)
+
+        # May be fitted on a worker thread, update together
+        a, b = max(float(a), 0.), max(float(b), 0.)
+        self.a, self.b, self.num_points = a, b, int(np.count_nonzero(valid))
+
+        return True
+
+    def pointTimes(self, energy_list, time_list, delay_time):
+        """Time of each point of a scan"""
+        times = []
+        last = None
+        for energies, count_time in zip(energy_list, time_list):
+            energies = np.asarray(energies, dtype=float)
+            if not len(energies):
+                continue
+
+            prev = np.concatenate([[energies[0] if last is None else last], energies[:-1]])
+            times.append(self.a + self.b * np.abs(energies - prev) + delay_time + count_time)
+            last = energies[-1]
+
+        return np.concatenate(times) if len(times) else np.array([])
+
+    def setupTime(self, energy_list, E0=None, waitTime=0):
+        """Time of a scan spent outside the points"""
+        energies = [item for item in energy_list if len(item)]
+        setup = waitTime + self.pre_sleep + 2 * (self.a + self.b * self.pre_move)
+
+        if E0 is not None and len(energies):
+            setup += self.a + self.b * abs(energies[-1][-1] - E0)
+
+        return setup
+
+    def estimate(self, energy_list, time_list, delay_time, E0=None, waitTime=0, num_scan=1):
+        """Duration of num_scan scans [sec]"""
+        scan_time = np.sum(self.pointTimes(energy_list, time_list, delay_time)) +\
+                    self.setupTime(energy_list, E0, waitTime)
+
+        return float(scan_time * num_scan)
+
+def orderBatch(rows, position=0.0, energy=None):
+    """
+    Order batch rows to reduce sample changer travel and DCM slews
+
+    Rows with the same edge are grouped. The group of the edge nearest to
+    the current energy goes first, and each group is swept from the end
+    nearest to the current position, so the sweep direction alternates.
+
+    Parameters
+    ----------
+    rows : list of dict with 'position' and optional 'E0'
+    position : current sample changer position
+    energy : current DCM energy [eV]
+
+    return ordered list of rows
+    """
+    groups = OrderedDict()
+    for item in rows:
+        groups.setdefault(item.get('E0'), []).append(item)
+
+    ordered = []
+    keys = list(groups)
+    while len(keys):
+        if energy is not None and None not in keys:
+            key = min(keys, key=lambda E0: abs(E0 - energy))
+            energy = key
+        else:
+            key = keys[0]
+        keys.remove(key)
+
+        group = sorted(groups[key], key=lambda item: item['position'])
+        if abs(position - group[-1]['position']) < abs(position - group[0]['position']):
+            group.reverse()
+
+        ordered += group
+        position = group[-1]['position']
+
+    return ordered
+
+def batchTravel(rows, position=0.0, energy=None):
+    """
+    Return (sample changer travel, DCM travel [eV]) of rows in order
+
+    Parameters
+    ----------
+    rows : list of dict with 'position' and optional 'E0'
+    position : current sample changer position
+    energy : current DCM energy [eV]
+    """
+    travel = 0.
+    slew = 0.
+    for item in rows:
+        travel += abs(item['position'] - position)
+        position = item['position']
+
+        E0 = item.get('E0')
+        if E0 is not None:
+            if energy is not None:
+                slew += abs(E0 - energy)
+            energy = E0
+
+    return travel, slew
+
+class ScanTimeCallback(CallbackBase):
+    """
+    Update the remaining time of step scans from the overhead model
+
+    Parameters
+    ----------
+    label : QLabel for the remaining time
+    point_times : time of each point, OverheadModel.pointTimes
+    setup_time : OverheadModel.setupTime
+    num_scan : number of scans
+    slow : ratio of elapsed to predicted time shown as a slowdown
+    schedule : list of (point_times, setup_time) of each scan, overrides
+               point_times, setup_time and num_scan when scans differ
+    """
+    def __init__(self, label, point_times, setup_time, num_scan=1, slow=1.2, schedule=None):
+        super().__init__()
+        self.label = label
+        self.slow = slow
+
+        if schedule is None:
+            schedule = [(point_times, setup_time)] * num_scan
+        self.schedule = [(np.asarray(times), setup) for times, setup in schedule]
+
+        self._scan_index = -1
+        self._start_time = None
+        self._num_events = 0
+
+    def start(self, doc):
+        self._scan_index += 1
+        self._start_time = doc['time']
+        self._num_events = 0
+
+    def event(self, doc):
+        self._num_events += 1
+
+        point_times, setup_time = self.schedule[min(self._scan_index, len(self.schedule) - 1)]
+
+        predicted = setup_time + np.sum(point_times[:self._num_events])
+        remaining = np.sum(point_times[self._num_events:]) +\
+                    sum([np.sum(times) + setup for times, setup in
+                         self.schedule[self._scan_index + 1:]])
+
+        # Scale with the measured speed
+        elapsed = doc['time'] - self._start_time
+        ratio = elapsed / predicted if predicted > 0 else 1.
+        remaining *= max(ratio, 1.)
+
+        text = formatDuration(remaining)
+        if ratio > self.slow:
+            _submit(self.label.setStyleSheet, "QLabel { color: red }")
+            text += ' (x{:.2f})'.format(ratio)
+        else:
+            _submit(self.label.setStyleSheet, "")
+
+        _submit(self.label.setText, text)
+
+def loadScanState(filename):
+    """Return the state saved by ScanStateCallback, None if not available"""
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remainingEnergyList(state):
+    """
+    Return (energy_list, time_list) of the points not measured yet
+
+    Regions without remaining points are dropped with their count time.
+
+    Parameters
+    ----------
+    state : dict, see ScanStateCallback
+    """
+    skip = state['num_completed']
+
+    energy_list = []
+    time_list = []
+    for energies, count_time in zip(state['energy_list'], state['time_list']):
+        remaining = energies[skip:]
+        skip = max(skip - len(energies), 0)
+
+        if len(remaining):
+            energy_list.append(np.array(remaining))
+            time_list.append(count_time)
+
+    return energy_list, time_list
+
+def stitchTables(runs):
+    """
+    Primary tables of an interrupted scan and its resumes without repeated points
+
+    A resume starts at the first point not saved by ScanStateCallback, so the
+    last points of the interrupted run may be measured again. Each run keeps
+    the points measured before the next run starts, the number of points
+    left at its start minus the number left at the start of the next run.
+
+    Parameters
+    ----------
+    runs : list of (start document, DataFrame), oldest first
+
+    return DataFrame in measurement order
+    """
+    def points_left(start):
+        energy_list = start.get('energy_list')
+        if energy_list is None:
+            return None
+        return sum(len(item) for item in energy_list)
+
+    tables = []
+    for idx, (start, table) in enumerate(runs):
+        if idx + 1 < len(runs):
+            left, left_next = points_left(start), points_left(runs[idx+1][0])
+            if left is not None and left_next is not None:
+                table = table.iloc[:max(left - left_next, 0)]
+
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+class ScanStateCallback(CallbackBase):
+    """
+    Persist the progress of step scans to a JSON file for resuming
+
+    The state has the energy grid, the number of measured points, the uid
+    of the run and of the runs it continues, and the metadata to start the
+    next run. It is written at the start, every few events and when the
+    run stops, and removed when the run finishes successfully. After a
+    crash the last points may be measured again, they are never skipped.
+
+    Parameters
+    ----------
+    filename : state file
+    every : write after this number of events
+    interval : write when the last write is older than interval [sec]
+    """
+    md_skip = ('uid', 'time', 'scan_id', 'plan_name', 'plan_type', 'plan_args',
+               'num_points', 'num_intervals', 'detectors', 'motors', 'hints',
+               'energy_list', 'time_list', 'resumed_from')
+
+    def __init__(self, filename, every=10, interval=5.):
+        super().__init__()
+        self.filename = filename
+        self.every = every
+        self.interval = interval
+        self._state = None
+        self._primary = set()
+        self._unsaved = 0
+        self._last_write = 0.
+
+    def start(self, doc):
+        self._state = None
+        self._primary = set()
+
+        if doc.get('scan_mode') != 'normal' or 'energy_list' not in doc:
+            return
+
+        previous = loadScanState(self.filename) if doc.get('resumed_from') else None
+
+        if previous is not None and previous['uid'] == doc['resumed_from'][-1]:
+            state = previous
+        else:
+            state = {'energy_list' : doc['energy_list'],
+                     'time_list' : doc['time_list'],
+                     'num_completed' : 0,
+                     'runs' : [],
+                     'md' : {key : value for key, value in doc.items()
+                             if key not in self.md_skip}}
+
+        state['uid'] = doc['uid']
+        state['runs'] = state['runs'] + [doc['uid']]
+        state['exit_status'] = None
+
+        self._state = state
+        self._write()
+
+    def descriptor(self, doc):
+        if doc.get('name') == 'primary':
+            self._primary.add(doc['uid'])
+
+    def event(self, doc):
+        if self._state is None or doc['descriptor'] not in self._primary:
+            return
+
+        self._state['num_completed'] += 1
+        self._state['last_energy'] = doc['data'].get('dcm_energy')
+        self._unsaved += 1
+
+        if self._unsaved >= self.every or ttime.monotonic() - self._last_write >= self.interval:
+            self._write()
+
+    def stop(self, doc):
+        if self._state is None or doc['run_start'] != self._state['uid']:
+            return
+
+        self._state['exit_status'] = doc['exit_status']
+        if doc['exit_status'] == 'success':
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+        else:
+            self._write()
+
+        self._state = None
+
+    @staticmethod
+    def _default(obj):
+        # numpy values in the metadata
+        if hasattr(obj, 'tolist'):
+            return obj.tolist()
+        return str(obj)
 
-        return k_energy_list
+    def _write(self):
+        self._unsaved = 0
+        self._last_write = ttime.monotonic()
+
+        # Replace the file at once, a crash leaves the previous state
+        temp = self.filename + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(self._state, f, default=self._default)
+            os.replace(temp, self.filename)
+        except Exception as e:
+            logger.warning("ScanStateCallback : {}".format(e))
 
 class Tweak():
     wait = True
@@ -886,7 +1225,7 @@ class AfterScanCallback(CallbackBase):
     def stop(self, doc):
         ''' Finalize scan '''
         # Save data
-        self.parent.save_data()
+        self.parent.save_data(doc['run_start'])
 
 # https://stackoverflow.com/questions/40932639/pyqt-messagebox-automatically
 # -closing-after-few-seconds
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Simulated DCM theta motor and HC10E counter board for fly-scan tests
+
+Serves the PV names of pv_list.json used by DCMFlyer and DCMEnergy.
+The theta motor moves at its VELO, the HC10E encoder follows the motor and
+a count bin is appended to the waveforms every SET_TRIG encoder steps
+while the board is in fly mode.
+
+Example)
+    python sim_fly_ioc.py --list-pvs
+"""
+
+import numpy as np
+
+from caproto import ChannelType
+from caproto.server import PVGroup, pvproperty, ioc_arg_parser, run
+
+from utils import loadPV
+
+_hc = 12398.5
+_si_111 = 5.4309/np.sqrt(3)
+
+pv_names = loadPV()
+
+
+def absorption(energy, E0=8333., gamma=1.5):
+    """Transmission and fluorescence yield of a simple edge"""
+    edge = 0.5 + np.arctan((energy - E0) / gamma) / np.pi
+    mu = 0.3 + 1.2 * edge
+    return np.exp(-mu), 0.02 * edge
+
+
+class SimFlyIOC(PVGroup):
+    """DCM theta motor record and HC10E counter board"""
+
+    theta = pvproperty(value=28.3, name=pv_names['DCM']['mono_theta'],
+                       record='motor', precision=6)
+
+    hc10e_reset     = pvproperty(value=0, name=pv_names['Scaler']['HC10E_Reset'])
+    hc10e_preset    = pvproperty(value=0, name=pv_names['Scaler']['HC10E_Preset'])
+    hc10e_mode      = pvproperty(value=0, name=pv_names['Scaler']['HC10E_Mode'])
+    hc10e_trig_step = pvproperty(value=26, name=pv_names['Scaler']['HC10E_TrigStep'])
+
+    hc10e_enc = pvproperty(value=0, name=pv_names['Scaler']['HC10E_ENC'], read_only=True)
+    hc10e_I0  = pvproperty(value=0.0, name=pv_names['Scaler']['HC10E_I0'], read_only=True)
+    hc10e_It  = pvproperty(value=0.0, name=pv_names['Scaler']['HC10E_It'], read_only=True)
+    hc10e_If  = pvproperty(value=0.0, name=pv_names['Scaler']['HC10E_If'], read_only=True)
+    hc10e_Ir  = pvproperty(value=0.0, name=pv_names['Scaler']['HC10E_Ir'], read_only=True)
+
+    _max_points = int(pv_names['Scaler']['HC10E_FlyMaxPoints'])
+
+    hc10e_enc_wf = pvproperty(value=[], dtype=ChannelType.DOUBLE, max_length=_max_points,
+                              name=pv_names['Scaler']['HC10E_ENC_WF'], read_only=True)
+    hc10e_I0_wf  = pvproperty(value=[], dtype=ChannelType.DOUBLE, max_length=_max_points,
+                              name=pv_names['Scaler']['HC10E_I0_WF'], read_only=True)
+    hc10e_It_wf  = pvproperty(value=[], dtype=ChannelType.DOUBLE, max_length=_max_points,
+                              name=pv_names['Scaler']['HC10E_It_WF'], read_only=True)
+    hc10e_If_wf  = pvproperty(value=[], dtype=ChannelType.DOUBLE, max_length=_max_points,
+                              name=pv_names['Scaler']['HC10E_If_WF'], read_only=True)
+    hc10e_Ir_wf  = pvproperty(value=[], dtype=ChannelType.DOUBLE, max_length=_max_points,
+                              name=pv_names['Scaler']['HC10E_Ir_WF'], read_only=True)
+
+    def __init__(self, *args, velocity=0.5, eres=1e-5, E0=8333., I0_rate=2e5,
+                 update_period=0.01, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._init_velocity = velocity
+        self._init_eres = eres
+        self._E0 = E0
+        self._I0_rate = I0_rate
+        self._dt = update_period
+
+        # Encoder increases when theta decreases, see HC10E_ENC_Direction
+        self._enc_sign = float(pv_names['Scaler']['HC10E_ENC_Direction'])
+
+        self._target = None
+        self._enc_ref = None
+        self._last_bin_enc = 0
+        self._bin_counts = np.zeros(4)
+        self._total_counts = np.zeros(4)
+        self._bins = [[] for _ in range(5)]
+
+    @theta.putter
+    async def theta(self, instance, value):
+        self._target = float(value)
+        await instance.field_inst.done_moving_to_value.write(0)
+        await instance.field_inst.motor_is_moving.write(1)
+        return value
+
+    @theta.startup
+    async def theta(self, instance, async_lib):
+        fields = instance.field_inst
+        await fields.velocity.write(self._init_velocity)
+        await fields.max_velocity.write(10 * self._init_velocity)
+        await fields.encoder_step_size.write(self._init_eres)
+        await fields.user_readback_value.write(instance.value)
+        await fields.done_moving_to_value.write(1)
+        self._enc_ref = instance.value
+
+        while True:
+            await async_lib.library.sleep(self._dt)
+            await self._move_step(instance)
+            await self._count_step(instance)
+
+    async def _move_step(self, instance):
+        fields = instance.field_inst
+        position = fields.user_readback_value.value
+
+        if fields.stop.value:
+            await fields.stop.write(0)
+            self._target = None
+            await instance.write(position, verify_value=False)
+
+        if self._target is None:
+            return
+
+        step = fields.velocity.value * self._dt
+        if abs(self._target - position) <= step:
+            position = self._target
+            self._target = None
+        else:
+            position += np.sign(self._target - position) * step
+
+        await fields.user_readback_value.write(position)
+        await fields.dial_readback_value.write(position - fields.user_offset.value)
+
+        if self._target is None:
+            await fields.motor_is_moving.write(0)
+            await fields.done_moving_to_value.write(1)
+
+    async def _count_step(self, instance):
+        position = instance.field_inst.user_readback_value.value
+        eres = instance.field_inst.encoder_step_size.value or self._init_eres
+
+        # Same conversion as the client, theta = enc_sign * enc * eres + startTh
+        enc = int(round(self._enc_sign * (position - self._enc_ref) / eres))
+        await self.hc10e_enc.write(enc)
+
+        energy = _hc/(2.*_si_111*np.sin(np.deg2rad(position)))
+        trans, fluo = absorption(energy, E0=self._E0)
+        rates = self._I0_rate * np.array([1.0, trans, fluo, 0.5 * trans])
+        counts = np.random.poisson(rates * self._dt)
+
+        self._bin_counts += counts
+        self._total_counts += counts
+
+        await self.hc10e_I0.write(self._total_counts[0])
+        await self.hc10e_It.write(self._total_counts[1])
+        await self.hc10e_If.write(self._total_counts[2])
+        await self.hc10e_Ir.write(self._total_counts[3])
+
+        if self.hc10e_mode.value != 1:
+            self._last_bin_enc = enc
+            self._bin_counts[:] = 0
+            return
+
+        if abs(enc - self._last_bin_enc) < max(int(self.hc10e_trig_step.value), 1):
+            return
+
+        if len(self._bins[0]) >= self._max_points:
+            return
+
+        for idx, value in enumerate([enc] + list(self._bin_counts)):
+            self._bins[idx].append(float(value))
+
+        self._last_bin_enc = enc
+        self._bin_counts[:] = 0
+        await self._write_waveforms()
+
+    async def _write_waveforms(self):
+        waveforms = [self.hc10e_enc_wf, self.hc10e_I0_wf, self.hc10e_It_wf,
+                     self.hc10e_If_wf, self.hc10e_Ir_wf]
+        for pv, values in zip(waveforms, self._bins):
+            await pv.write(list(values))
+
+    @hc10e_reset.putter
+    async def hc10e_reset(self, instance, value):
+        if value:
+            self._bins = [[] for _ in range(5)]
+            await self._write_waveforms()
+        return value
+
+    @hc10e_preset.putter
+    async def hc10e_preset(self, instance, value):
+        if value == 0:
+            self._enc_ref = self.theta.field_inst.user_readback_value.value
+            self._last_bin_enc = 0
+            self._bin_counts[:] = 0
+            self._total_counts[:] = 0
+            await self.hc10e_enc.write(0)
+        return value
+
+
+if __name__ == '__main__':
+    ioc_options, run_options = ioc_arg_parser(
+        default_prefix='',
+        desc='Simulated DCM theta motor and HC10E counter board')
+    ioc = SimFlyIOC(**ioc_options)
+    run(ioc.pvdb, **run_options)
@@ -115,6 +115,66 @@ def saveOffset(offset):
 
     return np.savetxt(path('dcm_offset.dat'), [offset])
 
+def loadRegions():
+    """
+    Return saved region settings as dict of name : settings
+    """
+    try:
+        return loadJson('regions.json')
+    except FileNotFoundError:
+        return {}
+
+def saveRegions(regions):
+    """
+    Save region settings, dict of name : EnergyScanList arguments
+    """
+    with open(path('regions.json'), 'w') as f:
+        json.dump(regions, f, indent=4)
+
+def findEdge(elements, element, edge):
+    """
+    Return the edge energy in eV
+
+    Parameters
+    ----------
+    elements : list of dict, edges_lines.json
+    element : symbol or name of the element, case-insensitive
+    edge : edge name, e.g. 'K', 'L3'
+    """
+    element = element.strip().lower()
+    for item in elements:
+        if element in (item['symbol'].lower(), item['name'].lower()):
+            for key, value in item.items():
+                if key.lower() == edge.strip().lower() and key not in ('name', 'symbol'):
+                    return float(value)
+
+            raise KeyError("{} edge of {} is not available".format(edge, item['name']))
+
+    raise KeyError("Unknown element : {}".format(element))
+
+def trimArrays(arrays):
+    """
+    Trim arrays to their common (shortest) length
+
+    Parameters
+    ----------
+    arrays : dict of array-like, None is regarded as an empty array
+
+    return (dict of trimmed numpy arrays, skew)
+    skew is the difference between the longest and the shortest length
+    """
+    arrays = {key: np.atleast_1d(np.asarray([] if value is None else value))
+              for key, value in arrays.items()}
+
+    lengths = [value.size for value in arrays.values()]
+    if not len(lengths):
+        return arrays, 0
+
+    min_size = int(min(lengths))
+    skew = int(max(lengths)) - min_size
+
+    return {key: value[:min_size] for key, value in arrays.items()}, skew
+
 def addWidgets(widgets, leftMargin=0, Type='h', align=None, spacing=None):
     # create a mother widget to make sure both qLabel & qLineEdit will
     # always be displayed side by side
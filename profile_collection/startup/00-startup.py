@@ -17,6 +17,10 @@ import databroker
 from databroker import Broker
 
 from utils import loadPV
+from retention import RetentionManager
+from document_sink import BulkInsertSink
+from plan_queue import during_task
+from fly_hdf5 import FLY_HDF5_SPEC, FlyHDF5Handler
 
 DEBUG_MODE = False
 GATE_MODE = True
@@ -32,26 +36,24 @@ warnings.filterwarnings("ignore", message="Creating an ndarray from ragged neste
 warnings.filterwarnings("ignore", message="Setting the line's pick radius via set_picker is deprecated")
 warnings.filterwarnings("ignore", message="The global colormaps dictionary is no longer considered public API")
 
-# Set up a RunEngine
-RE = RunEngine({})
+# Set up a RunEngine, plans of the GUI are run on the worker thread of PlanQueue
+RE = RunEngine({}, during_task=during_task)
 
 # PV parameter loadings
 pv_names = loadPV()
 
-# Drop Previous db older than one week.
+# Drop runs older than the retention time in the background,
+# the indexes of run lookups are created there as well
 client = MongoClient('127.0.0.1', 27017)
 
-try:
-    db = client.metadatastore_production_v1
-
-    oneWeekAgo = ttime.time() - 24 * 3600 * 7
-
-    for item in db.list_collection_names():
-        collection = db[item]
-        collection.delete_many({ "time": { "$lt" : oneWeekAgo }})
-
-except Exception as e:
-    print("Error during clear mongodb : {}".format(e))
+retention = pv_names.get('Retention', {})
+retention_manager = RetentionManager(client,
+                                     days=retention.get('days', 7),
+                                     interval=retention.get('interval_hours', 24),
+                                     asset_root=pv_names.get('AssetPath') \
+                                                if retention.get('delete_assets', False) else None,
+                                     report=print)
+retention_manager.start()
 
 # Use Mongodb
 config = {
@@ -79,9 +81,14 @@ config = {
 
 db=Broker.from_config(config)
 
+# Fly-scan waveforms are saved in HDF5 files
+db.reg.register_handler(FLY_HDF5_SPEC, FlyHDF5Handler, overwrite=True)
+
 # Subscribe metadatastore to documents.
 # If this is removed, data is not saved to metadatastore.
-RE.subscribe(db.insert)
+# Documents are inserted on a worker thread, the stop document waits until the run is stored.
+db_sink = BulkInsertSink(db.insert, report=print)
+RE.subscribe(db_sink)
 
 # Set up SupplementalData.
 from bluesky import SupplementalData
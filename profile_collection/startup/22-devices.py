@@ -2,15 +2,20 @@ import time as ttime
 import numpy as np
 import threading
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import ophyd
 from ophyd import (Component as Cpt, Device, EpicsSignal, EpicsSignalRO)
 from ophyd.flyers import MonitorFlyerMixin
 from ophyd.utils import OrderedDefaultDict
-from ophyd.status import DeviceStatus
+from ophyd.status import DeviceStatus, SubscriptionStatus
+from ophyd.status import wait as status_wait
 import bluesky.plans as bp
 
-from utils import loadPV
+from utils import loadPV, trimArrays
+from fly_hdf5 import FlyHDF5Writer, FLY_KEYS
+from motion_status import done_move_status, done_signals, stopped_status
 
 logger = logging.getLogger('__name__')
 
@@ -28,10 +33,12 @@ class DCMFlyer(Device):
     :PV fly_motor_speed : monochromator speed [deg/sec]
     :PV fly_motor_stop : Stop monochromator theta
     :PV fly_motor_done_move : Done moving when value is '1', '0' : moving
+    :PV fly_motor_readback : monochromator theta1 readback
     :PV scaler_mode : change mode. '0' : normal mode, '1' : fly(trigger) mode
     :PV encoder_steps : Flyer will accumulate counts during specified encoder steps
     :PV scaler_preset : set to '0' will result in measured values to reset
     :PV scaler_reset : reset array waveform
+    :PV enc_counter : encoder counter, '0' after reset
 
     :PV enc_waveform : encoder waveform
     :PV I0_waveform : I0 waveform
@@ -44,12 +51,14 @@ class DCMFlyer(Device):
     fly_motor_speed     = Cpt(EpicsSignal,   pv_names['DCM']["mono_theta_speed"])
     fly_motor_stop      = Cpt(EpicsSignal,   pv_names['DCM']["mono_theta_stop"])
     fly_motor_done_move = Cpt(EpicsSignalRO, pv_names['DCM']["mono_theta_dmov"])
+    fly_motor_readback  = Cpt(EpicsSignalRO, pv_names['DCM']["mono_theta_rbv"])
     fly_motor_eres      = Cpt(EpicsSignalRO, pv_names['DCM']["mono_enc_resolution"])
 
     scaler_mode         = Cpt(EpicsSignal,   pv_names['Scaler']["HC10E_Mode"])
     encoder_steps       = Cpt(EpicsSignal,   pv_names['Scaler']["HC10E_TrigStep"])
     scaler_preset       = Cpt(EpicsSignal,   pv_names['Scaler']["HC10E_Preset"])
     scaler_reset        = Cpt(EpicsSignal,   pv_names['Scaler']["HC10E_Reset"])
+    enc_counter         = Cpt(EpicsSignalRO, pv_names['Scaler']["HC10E_ENC"])
 
     enc_waveform        = Cpt(EpicsSignalRO, pv_names['Scaler']["HC10E_ENC_WF"])
     I0_waveform         = Cpt(EpicsSignalRO, pv_names['Scaler']["HC10E_I0_WF"])
@@ -57,7 +66,9 @@ class DCMFlyer(Device):
     If_waveform         = Cpt(EpicsSignalRO, pv_names['Scaler']["HC10E_If_WF"])
     Ir_waveform         = Cpt(EpicsSignalRO, pv_names['Scaler']["HC10E_Ir_WF"])
 
-    def __init__(self, *args, target_energy=None, speed=None, encoder_steps=None, stream_names=None, **kwargs):
+    def __init__(self, *args, target_energy=None, speed=None, encoder_steps=None, stream_names=None,
+                 page_size=2000, timeout=None, stall_time=None, setup_timeout=5,
+                 asset_root=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.complete_status = None
@@ -83,6 +94,44 @@ class DCMFlyer(Device):
         # Number of scan points to read
         self._num_of_counts = int(100)
 
+        # Number of points in one event
+        self._page_size = int(page_size)
+
+        # Emit new waveform slices while the motor is still moving
+        self._streaming = False
+
+        # Number of points already emitted in the current scan
+        self._collected_count = 0
+
+        # Waveforms are saved to HDF5 files under asset_root, events hold references.
+        # Inline events when asset_root is None
+        if asset_root is None:
+            asset_root = pv_names.get('AssetPath')
+        self._asset_root = asset_root
+        self._writer = None
+        self._external = False
+        self._asset_docs_cache = []
+        self._pending_events = []
+
+        # Waveforms read by collect_asset_docs for the next collect
+        self._snapshot = None
+
+        # Waveforms are fetched concurrently
+        self._executor = ThreadPoolExecutor(max_workers=5)
+        self.last_skew = 0
+
+        # Setup done by prepare() and its duration [sec]
+        self._prepared = False
+        self._setup_timeout = setup_timeout
+        self.kickoff_latency = None
+
+        # Fail the fly scan when the motion takes too long or stalls [sec]
+        self._timeout = timeout
+        self._stall_time = stall_time
+
+        # Segmented trajectory, list of (stop energy, speed, encoder steps)
+        self._segments = []
+
     def energyToTheta(self, energy):
         _th = np.rad2deg(np.arcsin(_hc/(2.*_si_111*energy)))
         return _th
@@ -112,74 +161,216 @@ class DCMFlyer(Device):
     def setNumOfCounts(self, counts):
         self._num_of_counts = int(counts)
 
-    def checkMotor(self):
-        """check motor motion on a separated thread"""
+    def setPageSize(self, size):
+        self._page_size = max(int(size), 1)
+
+    def setTimeout(self, timeout, stall_time=None):
+        self._timeout = timeout
+        self._stall_time = stall_time
+
+    def setSegments(self, segments):
+        """Set multi-segment trajectory
+
+        Parameters
+        ----------
+        segments : list of (energy breakpoint [eV], speed [deg/sec], encoder steps)
+                   Each segment runs from the previous breakpoint (or the start)
+                   to its breakpoint. None or empty list for a single segment.
+        """
+        self._segments = [(float(energy), float(speed), int(steps))
+                          for energy, speed, steps in (segments or [])]
+
+        if self._segments:
+            # First segment is set up by prepare()
+            _, self._speed, self._encoder_step_counts = self._segments[0]
+            self._target_energy = self._segments[-1][0]
+
+    def segmentCounts(self, enc_resolution, start_energy=None):
+        """Expected number of points of the segmented trajectory"""
+        if start_energy is None:
+            start_energy = self._start_energy
+
+        counts = 0
+        start_th = self.energyToTheta(start_energy)
+        for energy, _, steps in self._segments:
+            stop_th = self.energyToTheta(energy)
+            counts += int(abs(start_th - stop_th) / enc_resolution / steps)
+            start_th = stop_th
+
+        return counts
+
+    def _start_segment(self, index):
+        """Start motion of a segment, the next one is started when it is done
+
+        Called by the DMOV monitor of the previous segment, so speed and
+        encoder steps are put with completion callbacks instead of waiting.
+        """
+        _, speed, steps = self._segments[index]
+
+        if index > 0:
+            setup = self._put_status(self.fly_motor_speed, speed) & \
+                    self._put_status(self.encoder_steps, steps)
+            setup.add_callback(lambda st: self._move_segment(index))
+        else:
+            self._move_segment(index)
+
+    def _move_segment(self, index):
+        """Move to the breakpoint of a segment after its setup"""
+        complete_status = self.complete_status
+        if complete_status is None or complete_status.done:
+            return
+
+        _th = self.energyToTheta(self._segments[index][0])
+        status = done_move_status(self,
+                                  self.fly_motor_done_move,
+                                  readback=self.fly_motor_readback,
+                                  target=_th,
+                                  stall_time=self._stall_time)
+        status.add_callback(lambda st: self._segment_done(index, st))
 
-        # Wait for completion
-        while True:
-            if self.fly_motor_done_move.get() == 0:
-                # logger.error("fly_motor : {}".format(self.fly_motor_done_move.get()))
-                ttime.sleep(0.1)
-            else:
-                # logger.error("fly_motor : {}".format(self.fly_motor_done_move.get()))
-                break
+        self.fly_motor.put(_th, wait=False)
 
-        # logger.error("Done fly")
-        # After the wait, we declare success
+    def _segment_done(self, index, status):
+        complete_status = self.complete_status
+        if complete_status is None or complete_status.done:
+            return
+
+        if not status.success:
+            complete_status._finished(success=False)
+        elif index + 1 < len(self._segments):
+            self._start_segment(index + 1)
+        else:
+            complete_status._finished(success=True)
+
+    def setAssetRoot(self, asset_root):
+        """HDF5 asset directory, None to save waveforms inline"""
+        self._asset_root = asset_root
+
+    def setStreaming(self, streaming):
+        """Allow collect during flight, only new points are emitted each time"""
+        self._streaming = bool(streaming)
+
+    def _motion_done(self, status):
+        """Called when the fly motion is finished"""
         self._acquiring = False
-        self.complete_status._finished(success=True)
 
-    def kickoff(self):
-        '''Start collection
+        if not status.success:
+            # Timeout or stall, stop motor motion
+            self.fly_motor_stop.put(1)
+
+    def _put_status(self, signal, value):
+        """Put with completion callback, returns status"""
+        status = DeviceStatus(self)
+        signal.put(value, callback=lambda *args, **kwargs: status._finished(success=True))
+        return status
+
+    def prepare(self):
+        '''Setup monochromator and HC10E before kickoff
+
+        Speed, encoder steps, waveform reset and counter reset are put
+        concurrently. Setup is done when the HC10E readbacks confirm the reset,
+        the encoder waveform is empty and the encoder counter is zero.
 
         Returns
         -------
-        DeviceStatus
-            This will be set to done when acquisition has begun
+        float
+            setup latency [sec], also kept in kickoff_latency
         '''
-        # Put scaler in fly mode
-        # self.scaler_mode.put(1, wait=True)
+        t0 = ttime.time()
 
-        # Set monochromator speed
-        self.fly_motor_speed.put(self._speed, wait=True)
+        statuses = []
 
-        # Set encoder step size for accumulating counts
-        self.encoder_steps.put(self._encoder_step_counts, wait=True)
+        # Set monochromator speed and encoder step size, only when changed
+        if self._speed is not None and not np.isclose(self.fly_motor_speed.get(), self._speed):
+            statuses.append(self._put_status(self.fly_motor_speed, self._speed))
 
-        # Reset scaler array waveform
-        self.scaler_reset.put(1, wait=True)
+        if self._encoder_step_counts is not None and \
+                self.encoder_steps.get() != self._encoder_step_counts:
+            statuses.append(self._put_status(self.encoder_steps, self._encoder_step_counts))
 
-        # Reset scaler counter
-        self.scaler_preset.put(0, wait=True)
+        # Confirm the reset by readbacks, subscribe before the reset
+        statuses.append(SubscriptionStatus(self.enc_waveform,
+                                           lambda value, **kwargs: value is not None and len(value) == 0,
+                                           timeout=self._setup_timeout))
+        statuses.append(SubscriptionStatus(self.enc_counter,
+                                           lambda value, **kwargs: value == 0,
+                                           timeout=self._setup_timeout))
 
-        # Wait For HC10E scaler reset
-        ttime.sleep(.2)
+        # Reset scaler array waveform and counter
+        statuses.append(self._put_status(self.scaler_reset, 1))
+        statuses.append(self._put_status(self.scaler_preset, 0))
 
-        # Indicators
-        self._start_time = ttime.time()
-        self._acquiring = True
-        self._paused = False
+        for status in statuses:
+            status_wait(status, timeout=self._setup_timeout)
 
         # Put scaler in fly mode
         self.scaler_mode.put(1, wait=True)
 
-        # Start motor motion to target_position asynchronously
-        _th = self.energyToTheta(self._target_energy)
-        self.fly_motor.put(_th, wait=False)
-        ttime.sleep(0.2)
+        self._prepared = True
+        self.kickoff_latency = ttime.time() - t0
 
-        thread = threading.Thread(target=self.checkMotor, daemon=True)
-        thread.start()
+        return self.kickoff_latency
+
+    def kickoff(self):
+        '''Start collection
+
+        Returns
+        -------
+        DeviceStatus
+            This will be set to done when acquisition has begun
+        '''
+        if not self._prepared:
+            self.prepare()
+
+        self._prepared = False
+
+        # Indicators
+        self._start_time = ttime.time()
+        self._acquiring = True
+        self._paused = False
+        self._collected_count = 0
+        self._pending_events = []
+        self._snapshot = None
+
+        # New HDF5 file for this scan
+        self._close_writer()
+        if self._asset_root is not None:
+            self._writer = FlyHDF5Writer(self._asset_root, keys=FLY_KEYS,
+                                         chunk_size=self._page_size)
+            self._asset_docs_cache.append(('resource', self._writer.resource))
+        self._external = self._writer is not None
+
+        if self._segments:
+            # Segments are chained by their DMOV monitors into one collection
+            self.complete_status = DeviceStatus(self, timeout=self._timeout)
+            self.complete_status.add_callback(self._motion_done)
+            self._start_segment(0)
+        else:
+            # Completion is driven by the DMOV monitor, subscribe before the motion
+            _th = self.energyToTheta(self._target_energy)
+            self.complete_status = done_move_status(self,
+                                                    self.fly_motor_done_move,
+                                                    readback=self.fly_motor_readback,
+                                                    target=_th,
+                                                    timeout=self._timeout,
+                                                    stall_time=self._stall_time)
+            self.complete_status.add_callback(self._motion_done)
+
+            # Start motor motion to target_position asynchronously
+            self.fly_motor.put(_th, wait=False)
 
         # make status object, Indicate flying has started
         self.kickoff_status = DeviceStatus(self)
         self.kickoff_status._finished(success=True)
 
-        self.complete_status = DeviceStatus(self)
-
         return self.kickoff_status
 
 
+    def unstage(self):
+        # The writer is kept open until the last collect of the run
+        self._close_writer()
+        return super().unstage()
+
     def complete(self):
         '''Wait for flying to be complete'''
         if self.complete_status is None:
@@ -188,11 +379,20 @@ class DCMFlyer(Device):
         return self.complete_status
 
     def describe_collect(self):
-        d = dict(
-        source = "HC10E",
-        dtype = "number",
-        shape = (1,)
-        )
+        # Each event holds a chunk of up to _page_size points, the last one is shorter
+        if self._external:
+            d = dict(
+            source = "HC10E",
+            dtype = "array",
+            shape = (None,),
+            external = "FILESTORE:"
+            )
+        else:
+            d = dict(
+            source = "HC10E",
+            dtype = "array",
+            shape = (None,)
+            )
 
         return {
             'primary': {
@@ -203,58 +403,135 @@ class DCMFlyer(Device):
                 "Ir"     : d
             }}
 
-    def collect(self):
-        # Put scaler in normal mode
-        self.scaler_mode.put(0, wait=False)
+    def read_waveforms(self, max_skew=0, retries=2):
+        """Snapshot of the five HC10E waveforms
+
+        The waveforms are fetched concurrently. Their lengths are the
+        acquisition counts of each channel, when they disagree by more than
+        max_skew the snapshot is retried, then all waveforms are trimmed
+        to the common length.
+
+        Parameters
+        ----------
+        max_skew : allowed length difference between waveforms
+        retries : number of additional snapshots
+
+        return (OrderedDict of numpy arrays, skew)
+        """
+        signals = OrderedDict([('ENC', self.enc_waveform),
+                               ('I0',  self.I0_waveform),
+                               ('It',  self.It_waveform),
+                               ('If',  self.If_waveform),
+                               ('Ir',  self.Ir_waveform)])
+
+        for trial in range(retries + 1):
+            futures = OrderedDict((key, self._executor.submit(sig.get))
+                                  for key, sig in signals.items())
+            waveforms = OrderedDict((key, future.result())
+                                    for key, future in futures.items())
+
+            incomplete = any(value is None for value in waveforms.values())
+            waveforms, skew = trimArrays(waveforms)
+
+            if not incomplete and skew <= max_skew:
+                break
+
+        if skew:
+            logger.warning("{} : waveform length skew {}, trimmed to {} points".format(
+                            self.name, skew, len(waveforms['ENC'])))
+
+        self.last_skew = skew
+
+        return OrderedDict(waveforms), skew
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _read_slice(self):
+        """Read new points and make events of up to _page_size points
+
+        In streaming mode this may be called during flight. Only the points
+        appended since the previous call are read, so an interrupted scan
+        keeps everything that has been collected so far.
+
+        With an HDF5 writer, the points are appended to the file and each event
+        holds datum references for the chunk, otherwise the waveform slices.
+        """
+        # Status callbacks run on another thread, check the status itself
+        partial = self._acquiring and not self.complete_status.done
 
-        # '''Retrieve all collected data'''
-        if self._acquiring:
+        if partial and not self._streaming:
             raise RuntimeError('Acquisition still in progress. Call complete()'
                                ' first.')
 
-        self.complete_status = None
+        if not partial:
+            # Put scaler in normal mode
+            self.scaler_mode.put(0, wait=False)
+            self.complete_status = None
 
-        # Retrive waveforms from epics PVs
-        ENC = self.enc_waveform.get()
-        if isinstance(ENC, type(None)):
-            ENC = self.enc_waveform.get()
+        # During flight the waveforms grow, a skew is expected
+        waveforms, _ = self.read_waveforms(retries=0 if partial else 2)
+        self._snapshot = waveforms
 
-        I0  = self.I0_waveform.get()
-        if isinstance(I0, type(None)):
-            I0  = self.I0_waveform.get()
+        # Only bins present in every waveform are complete
+        available = len(waveforms['ENC'])
 
-        It  = self.It_waveform.get()
-        if isinstance(It, type(None)):
-            It  = self.It_waveform.get()
+        if not partial and self._num_of_counts > available:
+            self._num_of_counts = available
 
-        If  = self.If_waveform.get()
-        if isinstance(If, type(None)):
-            If  = self.If_waveform.get()
+        num = min(int(self._num_of_counts), available)
 
-        Ir  = self.Ir_waveform.get()
-        if isinstance(Ir, type(None)):
-            Ir  = self.Ir_waveform.get()
+        for start in range(self._collected_count, num, self._page_size):
+            stop = min(start + self._page_size, num)
+            t = ttime.time()
 
-        if self._num_of_counts > len(ENC):
-            self._num_of_counts = len(ENC)
+            if self._writer is not None:
+                datums = self._writer.write({key: value[start:stop]
+                                             for key, value in waveforms.items()})
+                for datum in datums.values():
+                    self._asset_docs_cache.append(('datum', datum))
+
+                event = dict(
+                    time=t,
+                    data={key: datum['datum_id'] for key, datum in datums.items()},
+                    timestamps={key: t for key in datums},
+                    filled={key: False for key in datums}
+                )
+            else:
+                event = dict(
+                    time=t,
+                    data={key: value[start:stop] for key, value in waveforms.items()},
+                    timestamps={key: t for key in waveforms}
+                )
 
-        # logger.error("ENC : {}".format(ENC))
-        # logger.error("num_of_counts : {}".format(self._num_of_counts))
-        # for idx in range(len(ENC)):
-        for idx in range(int(self._num_of_counts)):
-            t = ttime.time()
-            enc = ENC[idx]
-            _i0  = I0[idx]
-            _it  = It[idx]
-            _if  = If[idx]
-            _ir  = Ir[idx]
+            self._pending_events.append(event)
+            self._collected_count = stop
 
-            d = dict(
-                time=t,
-                data=dict(ENC=enc, I0=_i0, It=_it, If=_if, Ir=_ir),
-                timestamps=dict(ENC=t, I0=t, It=t, If=t, Ir=t)
-            )
-            yield d
+    def collect_asset_docs(self):
+        """Resource and datum documents, called before collect by RunEngine"""
+        if self._writer is not None and self.complete_status is not None:
+            self._read_slice()
+
+        items = list(self._asset_docs_cache)
+        self._asset_docs_cache.clear()
+        yield from items
+
+    def collect(self):
+        """Retrieve collected data, one event per chunk of ``_page_size`` points
+
+        RunEngine of bluesky 1.6 collects events, not event pages, so each
+        event holds numpy arrays of a chunk instead of one point.
+        load_fly_table concatenates the chunks into one row per point.
+        """
+        # collect_asset_docs has already read the waveforms of this collect
+        if not self._pending_events and self._snapshot is None:
+            self._read_slice()
+
+        events, self._pending_events = self._pending_events, []
+        self._snapshot = None
+        yield from events
 
 
 """ Example)
@@ -7,14 +7,19 @@ from itertools import chain
 import time as ttime
 import numpy as np
 
+from ophyd import Signal
+
 import bluesky.utils as utils
 from bluesky.utils import (separate_devices,
                            all_safe_rewind,
                            Msg,
                            merge_cycler,
                            ensure_generator,
+                           FailedStatus,
                            short_uid as _short_uid)
 
+from motion_status import StoppedWait
+
 from silx.gui.utils.concurrent import submitToQtMainThread as _submit
 
 try:
@@ -25,26 +30,71 @@ except ImportError:
 
 logger = logging.getLogger('plan')
 
-def stop_and_mv(motor, pos):
-    """ Stop motor and then move to pos"""
+# Time spent by wait_until_stopped
+idle_wait = Signal(name='idle_wait', value=0.0)
+
+def wait_until_stopped(motor, debounce=0.1, timeout=None, poll=0.05, parent=None):
+    """
+    Wait until motor has been stopped for debounce seconds
+
+    The wait follows the done-moving signals of the motor, motors without
+    them are polled. The time spent is put to idle_wait, logged and returned.
+
+    :param motor : positioner, e.g. dcm, dcm.energy or an EpicsMotor
+    :param debounce : time the motor should stay stopped [sec]
+    :param timeout : give up after timeout [sec], None to wait forever
+    :param poll : polling period of motors without done-moving signals [sec]
+    :param parent : Main window, the time spent is also shown in its log
+    """
+    start = ttime.monotonic()
+
+    if len(done_signals(motor)):
+        try:
+            yield from bps.trigger(StoppedWait(motor, debounce=debounce, timeout=timeout),
+                                   group=_short_uid('stopped'), wait=True)
+        except FailedStatus:
+            logger.warning("%s : not stopped within %s sec", motor.name, timeout)
+
+    else:
+        stopped_since = None
+        while True:
+            now = ttime.monotonic()
+            if motor.moving:
+                stopped_since = None
+            elif stopped_since is None:
+                stopped_since = now
+            elif now - stopped_since >= debounce:
+                break
+
+            if timeout is not None and now - start > timeout:
+                logger.warning("%s : not stopped within %s sec", motor.name, timeout)
+                break
+
+            yield from bps.sleep(poll)
+
+    elapsed = ttime.monotonic() - start
+    idle_wait.put(elapsed)
+    logger.info("%s : stopped after %.3f sec", motor.name, elapsed)
+    if parent is not None:
+        parent.toLog("{} stopped after {:.3f} sec".format(motor.name, elapsed))
+
+    return elapsed
+
+def stop_and_mv(motor, pos, debounce=0.1, parent=None):
+    """ Stop motor and then move to pos, return the time waited for the stop"""
 
     if False:
         # Stop motor
         yield from bps.stop(motor)
 
-    # Sleep until motor stop
-    while(True):
-        if motor.moving:
-            yield from bps.sleep(0.1)
-        else:
-            yield from bps.sleep(0.5)
-
-            if not motor.moving:
-                break
+    # Wait until motor stop
+    elapsed = yield from wait_until_stopped(motor, debounce=debounce, parent=parent)
 
     # Move to the target position
     yield from bps.mv(motor, pos)
 
+    return elapsed
+
 def delay_per_step(detectors, motor, step, delay_time):
     """
     Customized 1d step for delay
@@ -65,6 +115,293 @@ def delay_per_step(detectors, motor, step, delay_time):
 
     return (yield from bps.trigger_and_read(list(detectors) + [motor]))
 
+class Settle:
+    """
+    Wait until the readback is stable instead of sleeping a fixed time
+
+    The point is settled when the readback has stayed within tolerance for
+    window seconds, and the monitor, if given, within a relative tolerance.
+    The time spent is put to signal, a 'settle_time' data key.
+
+    Parameters
+    ----------
+    readback : e.g. dcm.theta.user_readback
+    tolerance : allowed change of the readback
+    monitor : optional signal, e.g. I0
+    monitor_tolerance : allowed relative change of the monitor
+    window : time the values should stay stable [sec]
+    poll : polling period [sec]
+    """
+    def __init__(self, readback, tolerance, *, monitor=None, monitor_tolerance=0.01,
+                 window=0.1, poll=0.02):
+        self.readback = readback
+        self.tolerance = tolerance
+        self.monitor = monitor
+        self.monitor_tolerance = monitor_tolerance
+        self.window = window
+        self.poll = poll
+        self.signal = Signal(name='settle_time', value=0.0)
+
+    def _changed(self, values, refs):
+        if abs(values[0] - refs[0]) > self.tolerance:
+            return True
+
+        if self.monitor is not None:
+            return abs(values[1] - refs[1]) > self.monitor_tolerance * max(abs(refs[1]), 1)
+
+        return False
+
+    def _values(self):
+        if self.monitor is None:
+            return (self.readback.get(), None)
+        return (self.readback.get(), self.monitor.get())
+
+    def wait(self, max_wait):
+        """Sleep until settled or max_wait[sec], return the settle time"""
+        start = ttime.monotonic()
+        refs = self._values()
+        stable_since = start
+
+        while True:
+            now = ttime.monotonic()
+            if now - stable_since >= self.window or now - start >= max_wait:
+                break
+
+            yield from bps.sleep(self.poll)
+
+            values = self._values()
+            if self._changed(values, refs):
+                refs = values
+                stable_since = ttime.monotonic()
+
+        elapsed = ttime.monotonic() - start
+        self.signal.put(elapsed)
+
+        return elapsed
+
+def settle_per_step(settle):
+    """
+    Make a per_step which waits for settle, delay_time is the maximum wait
+
+    :param settle : Settle
+    """
+    def per_step(detectors, motor, step, delay_time):
+        grp = _short_uid('set')
+        yield Msg('checkpoint')
+        yield Msg('set', motor, step, group=grp)
+        yield Msg('wait', None, group=grp)
+
+        yield from settle.wait(delay_time)
+
+        return (yield from bps.trigger_and_read(list(detectors) + [motor, settle.signal]))
+
+    return per_step
+
+class PipelinedMove:
+    """
+    Settable wrapper which reuses a move started by the previous step
+
+    set() returns the pending status when it has the same target and has
+    not failed, otherwise a new move is started. stop() forgets the pending
+    move, so a move interrupted by a pause is started again on rewind.
+
+    Parameters
+    ----------
+    motor : settable with a position, e.g. dcm.energy
+    tolerance : maximum distance from the target of a finished move
+    """
+    def __init__(self, motor, tolerance=0.05):
+        self.motor = motor
+        self.name = motor.name + '_pipelined'
+        self.parent = None
+        self.tolerance = tolerance
+        self._target = None
+        self._status = None
+
+    def set(self, target):
+        status = self._status
+        if status is not None and np.isclose(self._target, target, rtol=0, atol=1e-9):
+            if not status.done:
+                return status
+
+            if status.success and abs(self.motor.position - target) <= self.tolerance:
+                return status
+
+        self._target = target
+        self._status = self.motor.set(target)
+        return self._status
+
+    def stop(self, *, success=False):
+        self._status = None
+        self.motor.stop(success=success)
+
+def pipelined_per_step(motor, energy_list, tolerance=0.05, settle=None):
+    """
+    Make a per_step which starts the next move as soon as the counter gate closes
+
+    The motor is read before the next move starts. The detectors are read
+    and the event is emitted while the mono moves to the next point.
+
+    :param motor : motor of the scan
+    :param energy_list : list of energy list of the scan
+    :param tolerance : maximum distance from the target of a finished move
+    :param settle : Settle, wait for settle instead of delay_time
+    """
+    steps = np.array([step for item in energy_list for step in item], dtype=float)
+    mover = PipelinedMove(motor, tolerance=tolerance)
+    state = {'index' : 0}
+
+    def per_step(detectors, motor, step, delay_time):
+        index = state['index']
+        if not np.isclose(steps[index], step):
+            index = int(np.argmin(np.abs(steps - step)))
+        state['index'] = (index + 1) % len(steps)
+
+        def move():
+            grp = _short_uid('set')
+            yield Msg('checkpoint')
+            yield Msg('set', mover, step, group=grp)
+            yield Msg('wait', None, group=grp)
+
+        def delay():
+            yield Msg('sleep', None, delay_time)
+
+        yield from move()
+        # added for wait motor to settle
+        if settle is None:
+            yield from delay()
+        else:
+            yield from settle.wait(delay_time)
+
+        # Counting is finished when the trigger is done
+        grp = _short_uid('trigger')
+        for det in separate_devices(detectors):
+            yield Msg('trigger', det, group=grp)
+        yield Msg('wait', None, group=grp)
+
+        ret = {}
+        yield Msg('create', None, name='primary')
+
+        for obj in [motor] + ([settle.signal] if settle is not None else []):
+            reading = yield Msg('read', obj)
+            if reading is not None:
+                ret.update(reading)
+
+        # Move to the next point while the counters are read
+        if index + 1 < len(steps):
+            yield Msg('set', mover, steps[index + 1], group=_short_uid('set'))
+
+        for det in separate_devices(detectors):
+            reading = yield Msg('read', det)
+            if reading is not None:
+                ret.update(reading)
+
+        yield Msg('save')
+
+        return ret
+
+    return per_step
+
+class AdaptiveDwell:
+    """
+    Count time of the next point for a target relative error of mu
+
+    Rates of the last point are used for the next one. With the total rate R
+    and the dark-subtracted rate r of each counter, the relative error of
+    the counter ratio after t seconds is sqrt(sum(R/r**2) / t) (Poisson).
+    For transmission it is divided by mu = ln(I0/It).
+
+    Parameters
+    ----------
+    energy_list : list of energy list of the scan, for the region of a point
+    time_list : count time of each region, the upper bound
+    target_error : relative error of mu, e.g. 0.001
+    dark : dark current of each counter [counts/sec], e.g. {'I0' : 10, ...}
+    mode : 'transmission' or 'fluorescence'
+    min_time : lower bound [sec]
+    bounds : list of (min, max) for each region, overrides time_list and min_time
+    """
+    channels = {'transmission' : ('I0', 'It'),
+                'fluorescence' : ('I0', 'If')}
+
+    def __init__(self, energy_list, time_list, target_error, dark, *,
+                 mode='transmission', min_time=0.1, bounds=None):
+        if mode not in self.channels:
+            raise ValueError("mode should be one of {}".format(list(self.channels)))
+
+        self.target_error = target_error
+        self.dark = dark or {}
+        self.mode = mode
+
+        if bounds is None:
+            bounds = [(min(min_time, item), item) for item in time_list]
+        self.bounds = list(bounds)
+
+        # First energy of each region
+        self._starts = np.array([item[0] if len(item) else np.inf for item in energy_list])
+        self._time = None
+
+        self.signal = Signal(name='dwell_time', value=0.0)
+
+    def region(self, step):
+        index = np.searchsorted(self._starts, step, side='right') - 1
+        return int(np.clip(index, 0, len(self.bounds) - 1))
+
+    def time(self, step):
+        """Count time of the point at step"""
+        low, high = self.bounds[self.region(step)]
+
+        if self._time is None:
+            return high
+
+        return float(np.clip(self._time, low, high))
+
+    def update(self, reading, count_time):
+        """Calculate the next count time from the reading of a point"""
+        self._time = None
+
+        rates = {}
+        variance = 0.
+        for name in self.channels[self.mode]:
+            if name not in reading:
+                return
+
+            total = reading[name]['value'] / count_time
+            rates[name] = total - self.dark.get(name, 0)
+            if rates[name] <= 0:
+                return
+
+            variance += total / rates[name]**2
+
+        error = self.target_error
+        if self.mode == 'transmission':
+            error *= abs(np.log(rates['I0'] / rates['It']))
+
+        if error > 0:
+            self._time = variance / error**2
+
+def adaptive_per_step(per_step, dwell):
+    """
+    Make a per_step which sets the count time of each point from dwell
+
+    :param per_step : per_step to wrap
+    :param dwell : AdaptiveDwell
+    """
+    def _per_step(detectors, motor, step, delay_time):
+        count_time = dwell.time(step)
+
+        yield from bps.abs_set(scaler.preset_time, count_time, wait=True)
+        dwell.signal.put(count_time)
+
+        ret = yield from per_step(list(detectors) + [dwell.signal], motor, step, delay_time)
+
+        if ret:
+            dwell.update(ret, count_time)
+
+        return ret
+
+    return _per_step
+
 def sleep_and_count(detectors, waitTime=2):
     """sleep for waitTime and then count
 
@@ -135,6 +472,8 @@ def energy_list_scan(detectors,
            'num_intervals': num_points - 1,
            'plan_name': 'energy_list_scan',
            'delay_after_set_energy' : delay_time,
+           'energy_list' : [[float(step) for step in item] for item in energy_list],
+           'time_list' : [float(item) for item in time_list],
            'hints': {},
            }
     _md.update(md or {})
@@ -201,29 +540,240 @@ def exafs_scan(detectors,
                                                      energy_list,
                                                      time_list,
                                                      delay_time,
-                                                     per_step=delay_per_step,
+                                                     per_step=per_step,
                                                      md=md),
                                     cleanup_energy_scan(motor, E0))
 
+def reading_to_mu(reading, mode='transmission', dark=None):
+    """
+    Return mu of a reading, nan if it can not be calculated
+
+    :param reading : reading of the scaler
+    :param mode : 'transmission' or 'fluorescence'
+    :param dark : dark current of each counter [counts/sec]
+    """
+    dark = dark or {}
+    try:
+        count_time = reading['scaler_time']['value']
+        value = {name : reading[name]['value'] - dark.get(name, 0) * count_time
+                 for name in ('I0', 'It', 'If')}
+
+        if mode == 'transmission':
+            return float(np.log(value['I0'] / value['It']))
+        return float(value['If'] / value['I0'])
+
+    except (KeyError, ValueError, ZeroDivisionError, FloatingPointError):
+        return np.nan
+
+def refine_points(energy, mu, min_step, num_points, threshold=0.02):
+    """
+    Return midpoints of the intervals where mu changes most
+
+    The score of an interval is its change of mu plus the error of a linear
+    interpolation, h**2 * |mu''| / 8, normalized by the range of mu.
+
+    :param energy : measured energies in ascending order
+    :param mu : mu at energy
+    :param min_step : intervals are not split below this step
+    :param num_points : maximum number of new points
+    :param threshold : intervals with a lower score are not split
+    """
+    energy = np.asarray(energy, dtype=float)
+    mu = np.asarray(mu, dtype=float)
+
+    if len(energy) < 3 or num_points <= 0:
+        return []
+
+    span = np.ptp(mu)
+    if not span > 0:
+        return []
+
+    width = np.diff(energy)
+    curvature = np.abs(np.gradient(np.gradient(mu, energy), energy))
+    curvature = np.maximum(curvature[:-1], curvature[1:])
+
+    score = (np.abs(np.diff(mu)) + width**2 * curvature / 8.) / span
+    score[width < 2 * min_step] = 0
+
+    index = np.argsort(score)[::-1][:num_points]
+    index = np.sort(index[score[index] > threshold])
+
+    return list(energy[index] + width[index] / 2.)
+
+def adaptive_xanes_scan(detectors, motor, E0, start, stop, coarse_step, min_step,
+                        max_points, count_time, delay_time, *, mode='transmission',
+                        dark=None, batch=10, threshold=0.02, per_step=delay_per_step, md=None):
+    """
+    XANES scan which adds points where mu changes fast
+
+    The coarse grid is measured first. Then up to batch midpoints of the
+    intervals with the highest derivative and curvature are measured in
+    each pass, until max_points is reached or nothing is left to refine.
+    All points are saved in the primary stream in the measured order.
+
+    Parameters
+    ----------
+    detectors : list, list of 'readable' objects
+    motor : dcm.energy
+    E0 : edge energy in eV
+    start, stop : scan range relative to E0 [eV]
+    coarse_step : step of the first pass [eV]
+    min_step : minimum step of refined points [eV]
+    max_points : point budget, including the coarse grid
+    count_time : count time of each point [sec]
+    delay_time : delay after move [sec]
+    mode : 'transmission' or 'fluorescence'
+    dark : dark current of each counter [counts/sec]
+    batch : maximum number of new points per pass
+    threshold : minimum normalized score of a refined interval
+    per_step : callable, optional, see energy_list_scan
+    md : dict, optional, metadata
+    """
+    coarse = np.arange(E0 + start, E0 + stop, coarse_step)
+    if not np.isclose(coarse[-1], E0 + stop):
+        coarse = np.append(coarse, E0 + stop)
+    coarse = list(np.round(coarse[:max_points], 5))
+
+    _md = {'detectors': [det.name for det in detectors],
+           'motors': [motor.name],
+           'num_points': max_points,
+           'plan_name': 'adaptive_xanes_scan',
+           'delay_after_set_energy' : delay_time,
+           'adaptive' : {'coarse_step' : coarse_step,
+                         'min_step' : min_step,
+                         'mode' : mode,
+                         'threshold' : threshold},
+           'hints': {},
+           }
+    _md.update(md or {})
+
+    measured = {}
+
+    @bpp.stage_decorator(list(detectors) + [motor])
+    @bpp.run_decorator(md=_md)
+    def inner_adaptive_scan():
+        yield from bps.abs_set(scaler.preset_time, count_time, wait=True)
+
+        points = coarse
+        while len(points):
+            # approach from the low energy side
+            yield from bps.mv(motor, points[0] - coarse_step)
+
+            for step in points:
+                reading = yield from per_step(detectors, motor, step, delay_time)
+                measured[step] = reading_to_mu(reading or {}, mode, dark)
+
+            budget = max_points - len(measured)
+            energy = np.array(sorted(measured))
+            mu = np.array([measured[item] for item in energy])
+            valid = np.isfinite(mu)
+
+            points = [item for item in refine_points(energy[valid], mu[valid],
+                                                     min_step, min(batch, budget),
+                                                     threshold)
+                      if item not in measured]
+
+            logger.info("adaptive_xanes_scan : %d points, %d new", len(measured), len(points))
+
+    def main_plan():
+        # move Energy to Start_Energy
+        yield from bps.mv(motor, coarse[0])
+        yield from bps.sleep(1)
+
+        yield from bps.checkpoint()
+        yield from inner_adaptive_scan()
+
+    yield from bpp.finalize_wrapper(main_plan(), cleanup_energy_scan(motor, E0))
+
+
+def make_per_step(motor, energy_list, time_list, device_dict, pipelined=False, settle=False,
+                  dwell_mode=None, dwell_error=0.001, dwell_min=0.1, dark=None):
+    """
+    Make a per_step of exafs_scan from the scan options
+
+    See multi_exafs_scan for the parameters
+    """
+    if settle:
+        # Two encoder counts
+        _dcm = device_dict['dcm']
+        settle = Settle(_dcm.theta.user_readback, 2 * abs(_dcm.encResolution.get()))
+    else:
+        settle = None
+
+    if pipelined:
+        per_step = pipelined_per_step(motor, energy_list, settle=settle)
+    elif settle is not None:
+        per_step = settle_per_step(settle)
+    else:
+        per_step = delay_per_step
+
+    if dwell_mode:
+        dwell = AdaptiveDwell(energy_list, time_list, dwell_error, dark,
+                              mode=dwell_mode, min_time=dwell_min)
+        per_step = adaptive_per_step(per_step, dwell)
+
+    return per_step
 
 def multi_exafs_scan(detectors, motor, E0, energy_list, time_list,
-                     delay_time, waitTime, device_dict, parent):
-    """ Repeat multiple or batch exafs_scan"""
+                     delay_time, waitTime, device_dict, parent, pipelined=False,
+                     settle=False, dwell_mode=None, dwell_error=0.001, dwell_min=0.1,
+                     dark=None, batch_queue=None, num_scan=None):
+    """ Repeat multiple or batch exafs_scan
+
+    :param pipelined : start the next move while the counters are read
+    :param settle : wait until theta is stable, delay_time is the maximum wait
+    :param dwell_mode : 'transmission' or 'fluorescence' for adaptive count time
+                        within dwell_min and the time of each region
+    :param dwell_error : target relative error of mu
+    :param dark : dark current of each counter [counts/sec]
+    :param batch_queue : list of dict of the batch in run order with 'name',
+                         'position', 'num_scan' and optional 'E0',
+                         'energy_list', 'time_list' and 'md' of the sample,
+                         None for the sample table with E0 and energy_list.
+                         The rows are run as given, main.planBatchOrder sorts
+                         them with scan_utils.orderBatch when 'Optimize Order'
+                         of the sample table is checked, else table order
+    :param num_scan : number of scans without batch_queue, None for the
+                      batch checkbox and the scan number of the control
+    """
+    options = dict(pipelined=pipelined, settle=settle, dwell_mode=dwell_mode,
+                   dwell_error=dwell_error, dwell_min=dwell_min, dark=dark)
 
-    batch_scan = parent.control.use_batch_checkbox.isChecked()
+    # Queued scans do not follow the control
+    if batch_queue is None and num_scan is None:
+        batch_scan = parent.control.use_batch_checkbox.isChecked()
+    else:
+        batch_scan = batch_queue is not None
 
     if batch_scan:
         # Batch scan
-        sample_names, sample_info = parent.sampleTable.getData()
+        if batch_queue is None:
+            sample_names, sample_info = parent.sampleTable.getData()
+            batch_queue = [{'name' : sample_name,
+                            'position' : info[0],
+                            'num_scan' : info[1]}
+                           for sample_name, info in zip(sample_names, sample_info)]
 
-        for idx, sample_name in enumerate(sample_names):
+        for item in batch_queue:
+            sample_name = item['name']
 
             # Do not run this scan if sample_name is empty
             if not len(sample_name):
                 continue
 
-            sample_pos, num_scan = sample_info[idx]
-            num_scan = int(num_scan)
+            sample_pos = item['position']
+            num_scan = int(item['num_scan'])
+
+            # Edge and regions of the sample
+            _E0 = item.get('E0', E0)
+            _energy_list = item.get('energy_list', energy_list)
+            _time_list = item.get('time_list', time_list)
+            per_step = make_per_step(motor, _energy_list, _time_list, device_dict, **options)
+
+            _md = {'E0' : _E0,
+                   'sample_name' : sample_name,
+                   'scan_points' : sum([len(points) for points in _energy_list])}
+            _md.update(item.get('md', {}))
 
             if num_scan > 1:
                 # Multi-scan
@@ -239,27 +789,30 @@ def multi_exafs_scan(detectors, motor, E0, energy_list, time_list,
             _submit(parent.control.filename_edit.setText, sample_name)
 
             parent.toLog("Current sample_name in Batch mode is " + sample_name)
+            parent.toLog("E0 is {} eV with {} points".format(_E0, _md['scan_points']))
 
             # Disable controls
             parent.control_enable(False)
 
             # Move to sample position
             sample_changer = device_dict['sampleChanger']
-            yield from stop_and_mv(sample_changer, sample_pos)
+            _md['idle_wait'] = yield from stop_and_mv(sample_changer, sample_pos, parent=parent)
             parent.toLog("Sample position is moving to " + str(sample_pos))
 
-            for _ in range(num_scan):
+            for idx in range(num_scan):
                 parent.subscribe_callback()
                 parent.toLog("A new scan is started", color='blue')
 
                 # Do exafs scan
                 yield from exafs_scan(detectors,
                                       motor,
-                                      E0,
-                                      energy_list,
-                                      time_list,
+                                      _E0,
+                                      _energy_list,
+                                      _time_list,
                                       delay_time,
-                                      waitTime)
+                                      per_step=per_step,
+                                      md=_md,
+                                      waitTime=waitTime)
 
                 parent.unsubscribe_callback()
 
@@ -271,7 +824,9 @@ def multi_exafs_scan(detectors, motor, E0, energy_list, time_list,
 
     else:
         # Multi scan
-        num_scan = int(parent.control.number_of_scan_edit.value())
+        if num_scan is None:
+            num_scan = int(parent.control.number_of_scan_edit.value())
+        per_step = make_per_step(motor, energy_list, time_list, device_dict, **options)
 
         for idx in range(num_scan):
 
@@ -285,7 +840,8 @@ def multi_exafs_scan(detectors, motor, E0, energy_list, time_list,
                                     energy_list,
                                     time_list,
                                     delay_time,
-                                    waitTime)
+                                    per_step=per_step,
+                                    waitTime=waitTime)
 
             parent.unsubscribe_callback()
 
@@ -297,7 +853,9 @@ def multi_exafs_scan(detectors, motor, E0, energy_list, time_list,
 
 
 def multi_exafs_scan_with_cleanup(detectors, motor, E0, energy_list, time_list,
-                     delay_time, waitTime, device_dict, parent):
+                     delay_time, waitTime, device_dict, parent, pipelined=False,
+                     settle=False, dwell_mode=None, dwell_error=0.001, dwell_min=0.1,
+                     dark=None, batch_queue=None, num_scan=None):
     """ Repeat multiple or batch exafs_scan with clean-up"""
     yield from bpp.finalize_wrapper(multi_exafs_scan(detectors,
                                                      motor,
@@ -307,17 +865,59 @@ def multi_exafs_scan_with_cleanup(detectors, motor, E0, energy_list, time_list,
                                                      delay_time,
                                                      waitTime,
                                                      device_dict,
-                                                     parent),
-                                    finalize(parent, device_dict, E0))
+                                                     parent,
+                                                     pipelined=pipelined,
+                                                     settle=settle,
+                                                     dwell_mode=dwell_mode,
+                                                     dwell_error=dwell_error,
+                                                     dwell_min=dwell_min,
+                                                     dark=dark,
+                                                     batch_queue=batch_queue,
+                                                     num_scan=num_scan),
+                                    finalize(parent, device_dict, E0, fly=False))
+
+def resume_exafs_scan_with_cleanup(detectors, motor, E0, energy_list, time_list,
+                                   delay_time, waitTime, device_dict, parent, resumed_from,
+                                   pipelined=False, settle=False, dwell_mode=None,
+                                   dwell_error=0.001, dwell_min=0.1, dark=None):
+    """ Continue an interrupted exafs_scan in a new run with clean-up
+
+    :param energy_list : list of energy list of the points not measured yet
+    :param resumed_from : uids of the interrupted runs, oldest first
+    """
+    per_step = make_per_step(motor, energy_list, time_list, device_dict,
+                             pipelined=pipelined, settle=settle, dwell_mode=dwell_mode,
+                             dwell_error=dwell_error, dwell_min=dwell_min, dark=dark)
+
+    def resume_scan():
+        parent.subscribe_callback()
+        parent.toLog("The scan is resumed from {:.2f} eV".format(energy_list[0][0]), color='blue')
 
+        yield from exafs_scan(detectors,
+                              motor,
+                              E0,
+                              energy_list,
+                              time_list,
+                              delay_time,
+                              per_step=per_step,
+                              md={'resumed_from' : list(resumed_from)},
+                              waitTime=waitTime)
 
-def finalize(parent, device_dict, E0):
-    """ Cleanup exafs_scan """
+        parent.unsubscribe_callback()
+
+    yield from bpp.finalize_wrapper(resume_scan(), finalize(parent, device_dict, E0, fly=False))
+
+
+def finalize(parent, device_dict, E0, move_to_E0=True, fly=None):
+    """ Cleanup exafs_scan
+
+    :param fly : True for fly scans, None for the scan type of the control
+    """
 
     device_keys = device_dict.keys()
 
     try:
-        fly_mode = parent.control.run_type.currentIndex() == 2
+        fly_mode = parent.control.run_type.currentIndex() == 2 if fly is None else fly
         if fly_mode:
             orig_mono_speed = parent._orig_mono_speed
             flyer = device_dict['energyFlyer']
@@ -325,7 +925,7 @@ def finalize(parent, device_dict, E0):
             yield from bps.abs_set(flyer.fly_motor_speed, orig_mono_speed)
             # yield from bps.abs_set(flyer.fly_motor_stop, 1)
 
-        if 'dcm' in device_keys:
+        if 'dcm' in device_keys and move_to_E0:
             _submit(parent.control.abortButton.setDisabled, True)
             # _submit(parent.control.pauseButton.setDisabled, True)
             # _submit(parent.control.resumeButton.setDisabled, True)
@@ -335,7 +935,7 @@ def finalize(parent, device_dict, E0):
 
             dcm = device_dict['dcm']
             parent.toLog("Energy is moving to " + str(E0) + " keV", color='blue')
-            yield from stop_and_mv(dcm.energy, E0)
+            yield from stop_and_mv(dcm.energy, E0, parent=parent)
 
 
     finally:
@@ -350,7 +950,76 @@ def finalize(parent, device_dict, E0):
         parent.toLog("Scan is finished", color='blue')
 
 
-def fly_scan(E0, mono_speed, device_dict, parent):
+def fly_streaming(flyers, cadence=1.0, *, md=None):
+    """
+    Fly scan which collects the data during flight.
+
+    Same as bluesky.plans.fly, but ``collect`` is repeated every cadence
+    while the flyers are running. The flyers should emit only new points.
+    Flyers with ``prepare`` are set up before the run is opened, so that
+    the setup latency is recorded in the start document. The flyers are
+    staged during the run.
+
+    Parameters
+    ----------
+    flyers : collection
+        objects that support the flyer interface
+    cadence : float, optional
+        time between collects [sec]
+    md : dict, optional
+        metadata
+    """
+    _md = dict(md or {})
+
+    latency = {flyer.name: flyer.prepare() for flyer in flyers
+               if hasattr(flyer, 'prepare')}
+    if latency:
+        _md['kickoff_latency'] = latency
+
+    def fly_plan():
+        yield from bps.open_run(_md)
+
+        for flyer in flyers:
+            yield from bps.kickoff(flyer, wait=True)
+
+        grp = _short_uid('complete')
+        statuses = []
+        for flyer in flyers:
+            status = yield from bps.complete(flyer, group=grp, wait=False)
+            statuses.append(status)
+
+        while not all(status.done for status in statuses):
+            yield from bps.sleep(cadence)
+            for flyer in flyers:
+                yield from bps.collect(flyer)
+
+        yield from bps.wait(group=grp)
+
+        # Collect remaining points
+        for flyer in flyers:
+            yield from bps.collect(flyer)
+
+        return (yield from bps.close_run())
+
+    # Flyers release their files on unstage, after the last collect
+    return (yield from bpp.stage_wrapper(fly_plan(), flyers))
+
+def fly_scan(E0, mono_speed, device_dict, parent, cadence=1.0, return_to_E0=True, segments=None):
+    """
+    Fly scan with energyFlyer
+
+    Parameters
+    ----------
+    E0 : edge energy in eV
+    mono_speed : DCM speed during fly scan [deg/sec]
+    device_dict : ophyd devices
+    parent : Main window
+    cadence : time between collects during flight [sec]
+    return_to_E0 : False for bidirectional sweeps, the next sweep starts
+                   where this one stops and there is no cooling time
+    segments : list of (energy breakpoint [eV], speed [deg/sec], encoder steps),
+               optional. Variable speed trajectory merged into one run
+    """
     # Initial settings
     flyer = device_dict['energyFlyer']
 
@@ -360,8 +1029,18 @@ def fly_scan(E0, mono_speed, device_dict, parent):
     # Set to fly scan speed
     yield from bps.abs_set(flyer.fly_motor_speed, mono_speed)
 
+    # Save waveforms during flight
+    flyer.setStreaming(True)
+
+    # Single segment unless specified
+    flyer.setSegments(segments)
+    _md = None
+    if segments:
+        flyer.setNumOfCounts(flyer.segmentCounts(flyer.fly_motor_eres.get()))
+        _md = {'segments': [list(segment) for segment in segments]}
+
     # Do fly scan
-    yield from bpp.monitor_during_wrapper(bp.fly([flyer]),
+    yield from bpp.monitor_during_wrapper(fly_streaming([flyer], cadence=cadence, md=_md),
                                           [device_dict['ENC_fly_counter'],
                                            device_dict['I0_fly_counter'],
                                            device_dict['It_fly_counter'],
@@ -372,7 +1051,8 @@ def fly_scan(E0, mono_speed, device_dict, parent):
     yield from bps.abs_set(flyer.fly_motor_speed, parent._orig_mono_speed)
 
     # Move to E0
-    yield from stop_and_mv(dcm, E0)
+    if return_to_E0:
+        yield from stop_and_mv(dcm, E0, parent=parent)
 
     parent.unsubscribe_callback()
 
@@ -381,15 +1061,30 @@ def fly_scan(E0, mono_speed, device_dict, parent):
     if num_scan > 1:
         _submit(parent.control.number_of_scan_edit.setValue, num_scan-1)
 
+    if num_scan > 1 and return_to_E0:
         cooling_time = parent.control.flyControl.flyCoolTime.value()
         parent.toLog("Cooling dcm. The next scan starts after {} seconds.".format(cooling_time))
         yield from bps.sleep(cooling_time)
 
 
-def fly_scan_with_cleanup(E0, mono_speed, device_dict, parent):
-    """ Repeat multiple or batch exafs_scan with clean-up"""
-    yield from bpp.finalize_wrapper(fly_scan(E0, mono_speed, device_dict, parent),
-                                    finalize(parent, device_dict, E0))
+def fly_scan_with_cleanup(E0, mono_speed, device_dict, parent, return_to_E0=True, segments=None):
+    """ Fly scan with clean-up
+
+    A sweep with return_to_E0 False stays at its stop energy only when it
+    is completed, the DCM returns to E0 when it is aborted or fails.
+    """
+    completed = []
+
+    def sweep():
+        yield from fly_scan(E0, mono_speed, device_dict, parent,
+                            return_to_E0=return_to_E0,
+                            segments=segments)
+        completed.append(True)
+
+    def cleanup():
+        return finalize(parent, device_dict, E0, move_to_E0=return_to_E0 or not completed)
+
+    yield from bpp.finalize_wrapper(sweep(), cleanup)
 
 def move_and_count(motor, target):
     yield from bps.open_run(None)
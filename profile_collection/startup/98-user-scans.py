@@ -3,9 +3,15 @@ import bluesky.plans as bp
 import os
 import numpy as np
 
+from energy_grid import energyGrid, kGrid
+
 
 class EnergyScanList():
-    """ make an E-Scan array """
+    """ make an E-Scan array, energy_list is a flat list
+
+    Each E-space region starts at its own boundary and stops below the
+    next one, see energyGrid with joined=False.
+    """
     def __init__(self, SRB=None, eMode=None, StepSize=None,\
                  SRBOnOff=None, Time=None):
 
@@ -19,48 +25,9 @@ class EnergyScanList():
 
     def makeArray(self):
         """ make an energy scan list """
-        for idx in range(len(self.SRB)-1):
-            active = self.SRBOnOff[idx]
-            eMode = self.eMode[idx]
-            eMode_next = self.eMode[idx+1]
-
-            if active:
-                if eMode and eMode_next:
-                    for item in np.arange(self.SRB[idx],
-                                          self.SRB[idx+1],
-                                          self.StepSize[idx]):
-                        self.energy_list.append(round(item,5))
-
-                elif not eMode and eMode_next:
-                    for item in np.arange(self.energy_list[-1],
-                                          self.SRB[idx+1],
-                                          self.StepSize[idx]):
-                        self.energy_list.append(round(item,5))
-
-                else:
-                    if not len(self.energy_list):
-                        raise ValueError
-
-                    for item in self.kMode(self.energy_list[-1],
-                                           self.SRB[idx+1],
-                                           self.StepSize[idx]):
-                        self.energy_list.append(round(item,5))
-
+        grid = energyGrid(self.SRB, self.eMode, self.StepSize, self.SRBOnOff, joined=False)
+        self.energy_list = grid['energy'].tolist()
 
     def kMode(self, start_energy_eV, stop_energy_k, step_energy_k):
         """ kMode energy list """
-        k_energy_list = []
-        a = np.sqrt(start_energy_eV) * 0.512
-        stop_energy_eV = (stop_energy_k/0.512)**2
-        N = 1
-
-        while True:
-            energy_eV = (((step_energy_k * N)+a)/0.512)**2
-
-            if (energy_eV >= stop_energy_eV):
-                break
-
-            k_energy_list.append(energy_eV)
-            N += 1
-
-        return k_energy_list
+        return kGrid(start_energy_eV, stop_energy_k, step_energy_k).tolist()
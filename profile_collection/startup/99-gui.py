@@ -51,6 +51,7 @@ def quit(*args):
 main = Main(RE=RE,
             plan_funcs=[exafs_scan,
                         multi_exafs_scan_with_cleanup,
+                        resume_exafs_scan_with_cleanup,
                         fly_scan_with_cleanup,
                         scan,
                         tweak_custom,
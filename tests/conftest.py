@@ -0,0 +1,26 @@
+import os
+import sys
+import logging
+
+import pytest
+
+# pal_tools modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pal_tools'))
+
+STARTUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'profile_collection', 'startup')
+
+
+@pytest.fixture
+def load_startup():
+    """Execute startup files in one namespace as IPython does, names are predefined"""
+    def load(*filenames, **names):
+        ns = {'__name__': 'startup', 'logging': logging}
+        ns.update(names)
+        for filename in filenames:
+            filepath = os.path.join(STARTUP_DIR, filename)
+            with open(filepath) as f:
+                exec(compile(f.read(), filepath, 'exec'), ns)
+        return ns
+
+    return load
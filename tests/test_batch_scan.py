@@ -0,0 +1,86 @@
+import pytest
+
+pytest.importorskip('ophyd')
+pytest.importorskip('bluesky')
+pytest.importorskip('silx')
+
+import bluesky.plan_stubs as bps
+
+
+class Widget:
+    """Records the values set on a Qt control"""
+    def __init__(self, value=0):
+        self.values = [value]
+
+    def value(self):
+        return self.values[-1]
+
+    def setValue(self, value):
+        self.values.append(value)
+
+    setCurrentIndex = setText = setValue
+
+    def setDisabled(self, disabled):
+        pass
+
+    def isChecked(self):
+        return True
+
+
+class Parent:
+    def __init__(self):
+        control = type('Control', (), {})()
+        control.run_type = Widget()
+        control.number_of_scan_edit = Widget(1)
+        control.filename_edit = Widget('')
+        control.use_batch_checkbox = Widget()
+        self.control = control
+
+    def toLog(self, text, color=None):
+        pass
+
+    def control_enable(self, enable):
+        pass
+
+    def subscribe_callback(self):
+        pass
+
+    def unsubscribe_callback(self):
+        pass
+
+
+@pytest.fixture
+def plans(load_startup):
+    ns = load_startup('95-plans.py')
+    scans = []
+
+    def exafs_scan(detectors, motor, E0, energy_list, time_list, delay_time,
+                   per_step=None, md=None, waitTime=0):
+        scans.append((md['sample_name'], E0))
+        yield from bps.null()
+
+    def stop_and_mv(motor, pos, debounce=0.1, parent=None):
+        yield from bps.null()
+        return 0.
+
+    ns.update(exafs_scan=exafs_scan,
+              stop_and_mv=stop_and_mv,
+              _submit=lambda func, *args: func(*args))
+    ns['scans'] = scans
+
+    return ns
+
+
+def test_batch_runs_every_scan_of_every_sample(plans):
+    parent = Parent()
+    batch_queue = [{'name' : 'foil', 'position' : 10., 'num_scan' : 2},
+                   {'name' : 'sample', 'position' : 20., 'num_scan' : 3, 'E0' : 8979.}]
+
+    list(plans['multi_exafs_scan']([], None, 7112., [[-200., -100.]], [1.], 0.1, 0,
+                                   {'sampleChanger' : None}, parent,
+                                   batch_queue=batch_queue))
+
+    assert plans['scans'] == [('foil', 7112.)] * 2 + [('sample', 8979.)] * 3
+
+    # Number of scans of each sample, then the remaining scans after each scan
+    assert parent.control.number_of_scan_edit.values[1:] == [2, 1, 3, 2, 1]
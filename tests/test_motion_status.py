@@ -0,0 +1,134 @@
+import pytest
+
+pytest.importorskip('ophyd')
+
+from ophyd import Signal
+from ophyd.sim import SynAxis
+from ophyd.status import wait as status_wait
+
+from motion_status import done_move_status, stopped_status
+
+
+@pytest.fixture
+def motor():
+    return {'device': SynAxis(name='mono'),
+            'dmov': Signal(name='mono_dmov', value=1),
+            'rbv': Signal(name='mono_rbv', value=10.)}
+
+
+def num_subs(signal):
+    return len(signal._callbacks[signal.SUB_VALUE])
+
+
+def test_normal_completion(motor):
+    dmov, rbv = motor['dmov'], motor['rbv']
+    status = done_move_status(motor['device'], dmov, readback=rbv, target=11., stall_time=1.)
+
+    dmov.put(0)
+    rbv.put(10.5)
+    assert not status.done
+
+    rbv.put(11.)
+    dmov.put(1)
+    status_wait(status, timeout=1)
+
+    assert status.success
+    assert num_subs(dmov) == 0
+    assert num_subs(rbv) == 0
+
+
+def test_timeout(motor):
+    dmov, rbv = motor['dmov'], motor['rbv']
+    status = done_move_status(motor['device'], dmov, readback=rbv, timeout=0.2, stall_time=10.)
+
+    dmov.put(0)
+    with pytest.raises(Exception):
+        status_wait(status, timeout=2)
+
+    assert status.done and not status.success
+    assert num_subs(dmov) == 0
+    assert num_subs(rbv) == 0
+
+
+def test_stall(motor):
+    dmov, rbv = motor['dmov'], motor['rbv']
+    status = done_move_status(motor['device'], dmov, readback=rbv, stall_time=0.2)
+
+    dmov.put(0)
+    with pytest.raises(Exception):
+        status_wait(status, timeout=2)
+
+    assert status.done and not status.success
+    assert num_subs(dmov) == 0
+    assert num_subs(rbv) == 0
+
+
+def test_zero_length_move(motor):
+    dmov, rbv = motor['dmov'], motor['rbv']
+    status = done_move_status(motor['device'], dmov, readback=rbv, target=10., settle_time=0.1)
+
+    # DMOV never goes to 0 on a move to the current position
+    status_wait(status, timeout=2)
+
+    assert status.success
+    assert num_subs(dmov) == 0
+
+
+def test_not_at_target_waits_for_motion(motor):
+    dmov, rbv = motor['dmov'], motor['rbv']
+    status = done_move_status(motor['device'], dmov, readback=rbv, target=11., settle_time=0.1)
+
+    with pytest.raises(Exception):
+        status_wait(status, timeout=0.5)
+    assert not status.done
+
+    dmov.put(0)
+    rbv.put(11.)
+    dmov.put(1)
+    status_wait(status, timeout=1)
+
+    assert status.success
+
+
+def test_stopped_already_stopped(motor):
+    dmov = motor['dmov']
+    status = stopped_status(motor['device'], [dmov], debounce=0.1)
+
+    status_wait(status, timeout=1)
+
+    assert status.success
+    assert num_subs(dmov) == 0
+
+
+def test_stopped_debounce(motor):
+    dmov = motor['dmov']
+    other = Signal(name='mono2_dmov', value=0)
+    status = stopped_status(motor['device'], [dmov, other], debounce=0.3)
+
+    # A short stop of both motors is not enough
+    other.put(1)
+    dmov.put(0)
+    dmov.put(1)
+    dmov.put(0)
+    with pytest.raises(Exception):
+        status_wait(status, timeout=0.5)
+    assert not status.done
+
+    dmov.put(1)
+    status_wait(status, timeout=1)
+
+    assert status.success
+    assert num_subs(dmov) == 0
+    assert num_subs(other) == 0
+
+
+def test_stopped_timeout(motor):
+    dmov = motor['dmov']
+    dmov.put(0)
+    status = stopped_status(motor['device'], [dmov], debounce=0.1, timeout=0.2)
+
+    with pytest.raises(Exception):
+        status_wait(status, timeout=2)
+
+    assert status.done and not status.success
+    assert num_subs(dmov) == 0
@@ -0,0 +1,57 @@
+import time as ttime
+import threading
+
+import pytest
+
+pytest.importorskip('bluesky')
+
+from plan_queue import PlanQueue
+
+
+class GatedRE:
+    """RunEngine stand-in, plans are names and run when the gate is open"""
+    def __init__(self):
+        self.context_managers = []
+        self.state = 'idle'
+        self.calls = []
+        self.gate = threading.Event()
+        self._subs = {}
+
+    def subscribe(self, func, name='all'):
+        token = len(self._subs)
+        self._subs[token] = func
+        return token
+
+    def unsubscribe(self, token):
+        self._subs.pop(token)
+
+    def __call__(self, plan, **md):
+        self.gate.wait(5)
+        for func in list(self._subs.values()):
+            func('start', {'uid' : plan})
+        self.calls.append(plan)
+        return (plan,)
+
+
+def test_immediate_plans_run_before_queued_plans():
+    RE = GatedRE()
+    queue = PlanQueue(RE)
+
+    running = queue.submit('running')
+    deadline = ttime.monotonic() + 5
+    while running.state != 'running' and ttime.monotonic() < deadline:
+        ttime.sleep(0.01)
+
+    queued = queue.submit('queued')
+    first = queue.submit('first', immediate=True)
+    second = queue.submit('second', immediate=True)
+    RE.gate.set()
+
+    for item in (running, queued, first, second):
+        assert item.wait(5)
+
+    assert RE.calls == ['running', 'first', 'second', 'queued']
+    assert first.uids == ['first']
+    assert queued.uids == ['queued']
+
+    queue.stop()
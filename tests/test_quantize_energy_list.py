@@ -0,0 +1,24 @@
+import pytest
+
+for module in ('numpy', 'pandas', 'xarray', 'h5py', 'epics', 'silx', 'bluesky'):
+    pytest.importorskip(module)
+
+import numpy as np
+
+from scan_utils import quantizeEnergyList
+
+ENC_RESOLUTION = 0.0005
+
+
+def test_duplicates_are_merged():
+    energies, counts = quantizeEnergyList([np.arange(7000., 7010., 0.001)], ENC_RESOLUTION)
+
+    assert len(energies[0]) == len(np.unique(counts[0])) < 10000
+
+
+def test_collapsed_region_raises():
+    # Every point of region 2 falls on a count of region 1
+    regions = [np.arange(7000., 7010., 1.), np.array([7005.0001, 7009.0001])]
+
+    with pytest.raises(ValueError, match="Region 2 collapses"):
+        quantizeEnergyList(regions, ENC_RESOLUTION)
@@ -0,0 +1,40 @@
+import pytest
+
+for module in ('numpy', 'pandas', 'xarray', 'h5py', 'epics', 'silx', 'bluesky'):
+    pytest.importorskip(module)
+
+import numpy as np
+import pandas as pd
+
+from scan_utils import stitchTables, remainingEnergyList
+
+
+def test_resume_after_lost_state_writes():
+    grid = [[float(value) for value in np.arange(-200., -100., 5.)],
+            [float(value) for value in np.arange(-100., 0., 1.)]]
+    num_points = sum(len(item) for item in grid)
+
+    # 37 points were measured, the state file was last written at 30
+    energies = np.concatenate(grid)
+    first = pd.DataFrame({'dcm_energy' : energies[:37]})
+
+    remaining, _ = remainingEnergyList({'num_completed' : 30,
+                                        'energy_list' : grid,
+                                        'time_list' : [1., 1.]})
+    second = pd.DataFrame({'dcm_energy' : np.concatenate(remaining)})
+
+    data = stitchTables([({'energy_list' : grid}, first),
+                         ({'energy_list' : [item.tolist() for item in remaining]}, second)])
+
+    assert len(data) == num_points
+    assert not data['dcm_energy'].duplicated().any()
+    np.testing.assert_array_equal(data['dcm_energy'].values, energies)
+
+
+def test_runs_without_grid_are_kept():
+    first = pd.DataFrame({'dcm_energy' : [1., 2., 3.]})
+    second = pd.DataFrame({'dcm_energy' : [3., 4.]})
+
+    data = stitchTables([({}, first), ({'energy_list' : [[3., 4.]]}, second)])
+
+    assert len(data) == 5
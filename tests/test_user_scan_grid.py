@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('bluesky')
+
+STARTUP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'profile_collection', 'startup', '98-user-scans.py')
+
+# Default K-edge regions of the scan control, relative to E0
+K_EDGE = dict(SRB=[-200., -50., -20., 40., 12., 16.],
+              eMode=[True, True, True, True, False, False],
+              StepSize=[5., 1., 0.4, 0.03, 0.05],
+              SRBOnOff=[True, True, True, True, True],
+              Time=[1., 1., 1., 1., 1.])
+
+
+def reference_grid(SRB, eMode, StepSize, SRBOnOff, Time=None):
+    """energy_list of the original 98-user-scans EnergyScanList"""
+    def kMode(start_energy_eV, stop_energy_k, step_energy_k):
+        k_energy_list = []
+        a = np.sqrt(start_energy_eV) * 0.512
+        stop_energy_eV = (stop_energy_k/0.512)**2
+        N = 1
+
+        while True:
+            energy_eV = (((step_energy_k * N)+a)/0.512)**2
+
+            if (energy_eV >= stop_energy_eV):
+                break
+
+            k_energy_list.append(energy_eV)
+            N += 1
+
+        return k_energy_list
+
+    energy_list = []
+    for idx in range(len(SRB)-1):
+        if SRBOnOff[idx]:
+            if eMode[idx] and eMode[idx+1]:
+                for item in np.arange(SRB[idx], SRB[idx+1], StepSize[idx]):
+                    energy_list.append(round(item, 5))
+
+            elif not eMode[idx] and eMode[idx+1]:
+                for item in np.arange(energy_list[-1], SRB[idx+1], StepSize[idx]):
+                    energy_list.append(round(item, 5))
+
+            else:
+                for item in kMode(energy_list[-1], SRB[idx+1], StepSize[idx]):
+                    energy_list.append(round(item, 5))
+
+    return energy_list
+
+
+@pytest.fixture(scope='module')
+def EnergyScanList():
+    ns = {}
+    with open(STARTUP) as f:
+        exec(compile(f.read(), STARTUP, 'exec'), ns)
+    return ns['EnergyScanList']
+
+
+def test_k_edge_grid(EnergyScanList):
+    assert EnergyScanList(**K_EDGE).energy_list == reference_grid(**K_EDGE)
+
+
+def test_inactive_regions(EnergyScanList):
+    regions = dict(K_EDGE, SRBOnOff=[True, False, True, True, False])
+    assert EnergyScanList(**regions).energy_list == reference_grid(**regions)
+
+
+def test_regions_start_at_their_boundary(EnergyScanList):
+    # The pre-edge step does not land on -50 eV
+    regions = dict(K_EDGE, StepSize=[7., 1., 0.4, 0.03, 0.05])
+    energy_list = EnergyScanList(**regions).energy_list
+
+    assert energy_list == reference_grid(**regions)
+    assert -50. in energy_list and -20. in energy_list
+
+
+def test_joined_grid_is_cached_separately(EnergyScanList):
+    from energy_grid import energyGrid
+
+    regions = dict(K_EDGE, StepSize=[7., 1., 0.4, 0.03, 0.05])
+    joined = energyGrid(**regions)['energy']
+    separate = energyGrid(**regions, joined=False)['energy']
+
+    assert separate.tolist() == EnergyScanList(**regions).energy_list
+    assert -50. in separate and -50. not in joined